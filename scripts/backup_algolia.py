@@ -1,82 +1,224 @@
 #!/usr/bin/env python3
 """
-Backup Algolia index to JSON files
+Backup Algolia index to compressed JSONL snapshots
+A full snapshot holds one record per line. An incremental snapshot holds only
+what changed since the previous one (add, update and delete operations);
+restore_algolia.py replays a full snapshot and its deltas.
 """
 
 import os
 import json
+import gzip
+import hashlib
+import argparse
 import asyncio
+import time
 from datetime import datetime
 from pathlib import Path
+from typing import AsyncIterator, Dict, List
 import httpx
 
+import docstore
+from metrics import METRICS
+
+SNAPSHOT_FORMATS = ("jsonl.gz", "jsonl.zst")
+CHAIN_FILE = "chain.json"
+HASHES_FILE = "hashes.json.gz"
+
+
+def clean_record(hit: Dict) -> Dict:
+    """The stored record: browse hits carry Algolia's own _-prefixed fields"""
+    return {key: value for key, value in hit.items() if not key.startswith("_")}
+
+
+def record_hash(record: Dict) -> str:
+    payload = json.dumps(record, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def load_chain(backup_dir: Path) -> Dict:
+    chain_file = backup_dir / CHAIN_FILE
+    if not chain_file.exists():
+        return {"index": "ma3_docs", "snapshots": []}
+    with open(chain_file, 'r') as f:
+        return json.load(f)
+
+
+def save_chain(backup_dir: Path, chain: Dict):
+    tmp_path = backup_dir / (CHAIN_FILE + ".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(chain, f, indent=2)
+    tmp_path.replace(backup_dir / CHAIN_FILE)
+
+
+def load_hashes(backup_dir: Path) -> Dict[str, str]:
+    """objectID -> content hash of every record as of the latest snapshot"""
+    path = backup_dir / HASHES_FILE
+    if not path.exists():
+        return {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_hashes(backup_dir: Path, hashes: Dict[str, str]):
+    tmp_path = backup_dir / (HASHES_FILE + ".tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(hashes, f)
+    tmp_path.replace(backup_dir / HASHES_FILE)
+
+
+async def browse(client: httpx.AsyncClient, browse_url: str, headers: Dict[str, str]) -> AsyncIterator[List[Dict]]:
+    """Yield the index one browse page at a time"""
+    cursor = None
+    page = 0
+    while True:
+        params = {"hitsPerPage": 1000}
+        if cursor:
+            params["cursor"] = cursor
+
+        with METRICS.timer("algolia_browse_page_seconds"):
+            response = await client.get(browse_url, headers=headers, params=params, timeout=60)
+        METRICS.inc("algolia_bytes_received", len(response.content))
+
+        if response.status_code != 200:
+            # A partial snapshot would look like mass deletes to the next diff
+            raise RuntimeError(f"Error fetching page {page}: {response.text}")
+
+        data = response.json()
+        hits = data.get("hits", [])
+        METRICS.inc("algolia_records_fetched", len(hits))
+        print(f"Fetched page {page} with {len(hits)} records")
+        yield hits
+
+        cursor = data.get("cursor")
+        if not cursor:
+            break
+
+        page += 1
+
+
 async def backup_algolia():
+    parser = argparse.ArgumentParser(description='Back up the Algolia index')
+    parser.add_argument('--output', default='backups/algolia',
+                        help='Backup directory; keeps the snapshot chain used by incremental backups')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Write only adds, updates and deletes since the previous snapshot')
+    parser.add_argument('--format', choices=SNAPSHOT_FORMATS, default='jsonl.gz', help='Snapshot format')
+    parser.add_argument('--rebase-every', type=int, default=7,
+                        help='Write a full snapshot after this many incremental ones')
+    parser.add_argument('--metrics-file',
+                        help='Write per-stage timings and counters here (JSON, or Prometheus text for .prom)')
+    args = parser.parse_args()
+
+    METRICS.labels.update(script="backup_algolia")
+    try:
+        await write_snapshot(args)
+    finally:
+        METRICS.print_summary()
+        if args.metrics_file:
+            METRICS.write(args.metrics_file)
+
+
+async def write_snapshot(args):
+    """Write a full or incremental snapshot and append it to the chain"""
     app_id = os.getenv("ALGOLIA_APP_ID")
     api_key = os.getenv("ALGOLIA_API_KEY")
-    
+
     if not app_id or not api_key:
         print("Missing Algolia credentials")
         return
-    
-    backup_dir = Path(f"backups/{datetime.now().strftime('%Y%m%d')}/algolia")
+
+    backup_dir = Path(args.output)
     backup_dir.mkdir(parents=True, exist_ok=True)
-    
+    chain = load_chain(backup_dir)
+    previous = load_hashes(backup_dir)
+    deltas_since_base = 0
+    for snapshot in reversed(chain["snapshots"]):
+        if snapshot["type"] == "base":
+            break
+        deltas_since_base += 1
+
+    incremental = args.incremental and bool(chain["snapshots"])
+    if args.incremental and not incremental:
+        print("No previous snapshot found, writing a full backup")
+    elif incremental and deltas_since_base >= args.rebase_every:
+        print(f"{deltas_since_base} incremental snapshots since the last full one, writing a full backup")
+        incremental = False
+
+    snapshot_type = "delta" if incremental else "base"
+    # The sequence number keeps names unique and in chain order
+    output_file = backup_dir / (f"{len(chain['snapshots']):05d}-{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                                f"-{snapshot_type}.{args.format}")
+    tmp_file = output_file.with_name(output_file.name + ".partial")
+    start = time.monotonic()
+    hashes: Dict[str, str] = {}
+    counts = {"records": 0, "add": 0, "update": 0, "delete": 0}
+
     async with httpx.AsyncClient() as client:
-        # Browse index to get all records
-        browse_url = f"https://{app_id}-dsn.algolia.net/1/indexes/ma3_docs/browse"
+        # ALGOLIA_BASE_URL points at a local stand-in instead (scripts/mock_services.py)
+        base_url = os.getenv("ALGOLIA_BASE_URL", f"https://{app_id}-dsn.algolia.net").rstrip("/")
+        browse_url = f"{base_url}/1/indexes/ma3_docs/browse"
         headers = {
             "X-Algolia-Application-Id": app_id,
             "X-Algolia-API-Key": api_key,
         }
-        
-        all_records = []
-        cursor = None
-        page = 0
-        
-        while True:
-            params = {"hitsPerPage": 1000}
-            if cursor:
-                params["cursor"] = cursor
-            
-            response = await client.get(browse_url, headers=headers, params=params)
-            
-            if response.status_code != 200:
-                print(f"Error fetching page {page}: {response.text}")
-                break
-            
-            data = response.json()
-            hits = data.get("hits", [])
-            all_records.extend(hits)
-            
-            print(f"Fetched page {page} with {len(hits)} records")
-            
-            cursor = data.get("cursor")
-            if not cursor:
-                break
-            
-            page += 1
-        
-        # Save records
-        output_file = backup_dir / f"records_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        with open(output_file, 'w') as f:
-            json.dump({
-                "index": "ma3_docs",
-                "timestamp": datetime.now().isoformat(),
-                "count": len(all_records),
-                "records": all_records
-            }, f, indent=2)
-        
-        print(f"Backed up {len(all_records)} records to {output_file}")
-        
+
+        # Records are written as each page arrives; only objectID -> hash is kept
+        with docstore.open_text(tmp_file, "w", suffix=output_file.suffix) as f:
+            async for hits in browse(client, browse_url, headers):
+                page_started = time.monotonic()
+                for hit in hits:
+                    record = clean_record(hit)
+                    object_id = record["objectID"]
+                    content_hash = record_hash(record)
+                    hashes[object_id] = content_hash
+                    counts["records"] += 1
+                    if not incremental:
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        continue
+                    previous_hash = previous.get(object_id)
+                    if previous_hash == content_hash:
+                        continue
+                    op = "add" if previous_hash is None else "update"
+                    counts[op] += 1
+                    f.write(json.dumps({"op": op, "objectID": object_id, "record": record},
+                                       ensure_ascii=False) + "\n")
+                METRICS.observe("backup_write_seconds", time.monotonic() - page_started, source="algolia")
+            if incremental:
+                for object_id in previous.keys() - hashes.keys():
+                    counts["delete"] += 1
+                    f.write(json.dumps({"op": "delete", "objectID": object_id}) + "\n")
+        tmp_file.replace(output_file)
+
         # Also get index settings
-        settings_url = f"https://{app_id}-dsn.algolia.net/1/indexes/ma3_docs/settings"
+        settings_url = f"{base_url}/1/indexes/ma3_docs/settings"
         settings_response = await client.get(settings_url, headers=headers)
-        
+
         if settings_response.status_code == 200:
             settings_file = backup_dir / "settings.json"
             with open(settings_file, 'w') as f:
                 json.dump(settings_response.json(), f, indent=2)
             print(f"Backed up index settings to {settings_file}")
 
+    entry = {
+        "file": output_file.name,
+        "type": snapshot_type,
+        "created": datetime.now().isoformat(),
+        "records": counts["records"],
+    }
+    if incremental:
+        entry.update({op: counts[op] for op in ("add", "update", "delete")})
+    chain["snapshots"].append(entry)
+    save_chain(backup_dir, chain)
+    save_hashes(backup_dir, hashes)
+
+    size_kb = output_file.stat().st_size / 1024
+    elapsed = time.monotonic() - start
+    if incremental:
+        print(f"Backed up {counts['add']} adds, {counts['update']} updates and {counts['delete']} deletes "
+              f"of {counts['records']} records to {output_file} ({size_kb:.1f} KB) in {elapsed:.1f}s")
+    else:
+        print(f"Backed up {counts['records']} records to {output_file} ({size_kb:.1f} KB) in {elapsed:.1f}s")
+
 if __name__ == "__main__":
-    asyncio.run(backup_algolia())
\ No newline at end of file
+    asyncio.run(backup_algolia())
@@ -1,71 +1,391 @@
 #!/usr/bin/env python3
 """
 Backup Upstash Vector index
+Scans every vector ID with the range endpoint and fetches the vectors in
+concurrent batches, streaming them to vectors.npy (float32, one row per
+vector) and their IDs and metadata to records.jsonl.gz in the same row order
 """
 
 import os
+import ast
+import gzip
 import json
+import random
+import struct
+import sys
+import argparse
 import asyncio
+import time
+from array import array
 from datetime import datetime
 from pathlib import Path
+from typing import Dict, Iterator, Optional, Sequence, Tuple
 import httpx
 
+from metrics import METRICS
+
+try:
+    import numpy as np
+except ImportError:  # Only needed for int8 and binary quantized copies
+    np = None
+
+VECTORS_FILE = "vectors.npy"
+RECORDS_FILE = "records.jsonl.gz"
+MANIFEST_FILE = "manifest.json"
+# Per-row scale of int8 copies
+SCALES_FILE = "scales.npy"
+
+# Row storage: float32 as-is, int8 with a per-row scale, or one sign bit per dimension
+QUANTIZATIONS = ("float32", "int8", "binary")
+NPY_DESCR = {"float32": "<f4", "int8": "|i1", "binary": "|u1"}
+
+NPY_MAGIC = b"\x93NUMPY"
+# Header space reserved up front so the row count can be written once it is known
+NPY_HEADER_SIZE = 128
+
+
+def _npy_header(rows: int, dimensions: int, descr: str = "<f4") -> bytes:
+    header = repr({"descr": descr, "fortran_order": False, "shape": (rows, dimensions)})
+    # Version 1.0 layout: magic, version, little-endian header length, header padded to
+    # NPY_HEADER_SIZE and ended by a newline
+    padding = NPY_HEADER_SIZE - len(NPY_MAGIC) - 4 - len(header) - 1
+    return (NPY_MAGIC + b"\x01\x00" + struct.pack("<H", NPY_HEADER_SIZE - len(NPY_MAGIC) - 4)
+            + header.encode("latin1") + b" " * padding + b"\n")
+
+
+class NpyWriter:
+    """Appends rows to a .npy file without knowing the row count in advance
+
+    Rows are float32 arrays ("f"), or int8/uint8 arrays ("b"/"B") with the
+    matching descr.
+    """
+
+    def __init__(self, path, dimensions: int, descr: str = "<f4"):
+        self.path = Path(path)
+        self.dimensions = dimensions
+        self.descr = descr
+        self.rows = 0
+        self._file = open(self.path, "wb")
+        self._file.write(_npy_header(0, dimensions, descr))
+
+    def append(self, vector: array):
+        if len(vector) != self.dimensions:
+            raise ValueError(f"Vector has {len(vector)} dimensions, expected {self.dimensions}")
+        if sys.byteorder == "big" and vector.typecode == "f":
+            vector = array("f", vector)
+            vector.byteswap()
+        vector.tofile(self._file)
+        self.rows += 1
+
+    def close(self):
+        self._file.seek(0)
+        self._file.write(_npy_header(self.rows, self.dimensions, self.descr))
+        self._file.close()
+
+
+def quantize(vector: Sequence[float], quantization: str) -> Tuple[array, float]:
+    """Stored row and scale of a vector
+
+    int8 rows are round(v * 127 / max|v|) with the scale max|v| / 127;
+    binary rows are the packed signs and carry no scale.
+    """
+    values = np.asarray(vector, dtype=np.float32)
+    if quantization == "binary":
+        return array("B", np.packbits(values > 0).tobytes()), 1.0
+    peak = float(np.abs(values).max()) if len(values) else 0.0
+    scale = peak / 127 if peak else 1.0
+    return array("b", np.rint(values / scale).astype(np.int8).tobytes()), scale
+
+
+def dequantize(rows: "np.ndarray", quantization: str, dimension: int,
+               scales: Optional["np.ndarray"] = None) -> "np.ndarray":
+    """float32 rows back from stored rows; binary rows come back unit-length"""
+    if quantization == "float32":
+        return np.asarray(rows, dtype=np.float32)
+    if quantization == "int8":
+        return np.asarray(rows, dtype=np.float32) * np.asarray(scales, dtype=np.float32).reshape(-1, 1)
+    signs = np.unpackbits(np.asarray(rows), axis=1, count=dimension).astype(np.float32) * 2 - 1
+    return signs / np.float32(np.sqrt(dimension))
+
+
+class BackupVectors:
+    """Read-only float32 view of a backup's vectors, dequantizing on slicing
+
+    Float32 backups are memory-mapped as they are; quantized ones are
+    expanded one requested block at a time.
+    """
+
+    def __init__(self, backup_dir):
+        backup_dir = Path(backup_dir)
+        with open(backup_dir / MANIFEST_FILE, 'r') as f:
+            manifest = json.load(f)
+        self.quantization = manifest.get("quantization", "float32")
+        self.dimension = manifest["dimension"]
+        if self.quantization != "float32" and np is None:
+            raise ImportError(f"numpy is required to read {self.quantization} vectors")
+        self._rows = np.load(backup_dir / VECTORS_FILE, mmap_mode="r") if np else None
+        self._scales = np.load(backup_dir / SCALES_FILE, mmap_mode="r") if self.quantization == "int8" else None
+        self.shape = (manifest["count"], self.dimension)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, rows) -> "np.ndarray":
+        return dequantize(self._rows[rows], self.quantization, self.dimension,
+                          self._scales[rows] if self._scales is not None else None)
+
+
+def read_npy_header(f, descr: str = "<f4") -> Tuple[int, int]:
+    """Row count and dimensions of a 2-D .npy file, leaving f at the first row"""
+    if f.read(len(NPY_MAGIC)) != NPY_MAGIC:
+        raise ValueError("Not a .npy file")
+    major, _ = f.read(2)
+    if major == 1:
+        (header_len,) = struct.unpack("<H", f.read(2))
+    else:
+        (header_len,) = struct.unpack("<I", f.read(4))
+    header = ast.literal_eval(f.read(header_len).decode("latin1"))
+    if header["descr"] != descr or header["fortran_order"] or len(header["shape"]) != 2:
+        raise ValueError(f"Expected a 2-D {descr} array, got {header}")
+    return header["shape"]
+
+
+class BackupWriter:
+    """vectors.npy, records.jsonl.gz and manifest.json of a backup directory
+
+    Files carry a .partial suffix until close(), so an interrupted run never
+    looks like a complete backup. Quantized copies store int8 or packed-bit
+    rows (plus scales.npy for int8) and are read back with BackupVectors.
+    """
+
+    def __init__(self, output_dir, dimension: int, quantization: str = "float32"):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}")
+        if quantization != "float32" and np is None:
+            raise ImportError(f"numpy is required for {quantization} quantization")
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.dimension = dimension
+        self.quantization = quantization
+        row_size = (dimension + 7) // 8 if quantization == "binary" else dimension
+        self._vectors = NpyWriter(self.output_dir / (VECTORS_FILE + ".partial"), row_size,
+                                  NPY_DESCR[quantization])
+        self._scales = None
+        if quantization == "int8":
+            self._scales = NpyWriter(self.output_dir / (SCALES_FILE + ".partial"), 1)
+        self._records = gzip.open(self.output_dir / (RECORDS_FILE + ".partial"), "wt", encoding="utf-8")
+
+    @property
+    def count(self) -> int:
+        return self._vectors.rows
+
+    def append(self, vector_id: str, vector: array, metadata: Optional[Dict] = None, data=None):
+        if self.quantization == "float32":
+            self._vectors.append(vector)
+        else:
+            if len(vector) != self.dimension:
+                raise ValueError(f"Vector has {len(vector)} dimensions, expected {self.dimension}")
+            row, scale = quantize(vector, self.quantization)
+            self._vectors.append(row)
+            if self._scales:
+                self._scales.append(array("f", [scale]))
+        record = {"id": vector_id}
+        if metadata is not None:
+            record["metadata"] = metadata
+        if data is not None:
+            record["data"] = data
+        self._records.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def abort(self):
+        self._vectors.close()
+        if self._scales:
+            self._scales.close()
+        self._records.close()
+
+    def close(self, **details) -> Dict:
+        """Finish the files and write the manifest, with `details` added to it"""
+        self.abort()
+        files = {"vectors": VECTORS_FILE, "records": RECORDS_FILE}
+        if self._scales:
+            files["scales"] = SCALES_FILE
+        for name in files.values():
+            (self.output_dir / (name + ".partial")).replace(self.output_dir / name)
+        manifest = {
+            "created": datetime.now().isoformat(),
+            "count": self.count,
+            "dimension": self.dimension,
+            "quantization": self.quantization,
+            **details,
+            "files": files,
+        }
+        with open(self.output_dir / MANIFEST_FILE, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+
+def iter_backup(backup_dir) -> Iterator[Tuple[Dict, array]]:
+    """Yield (record, vector) pairs of a backup in row order
+
+    Vectors of quantized backups are the dequantized approximations.
+    """
+    backup_dir = Path(backup_dir)
+    with open(backup_dir / MANIFEST_FILE, 'r') as f:
+        quantization = json.load(f).get("quantization", "float32")
+    if quantization != "float32":
+        vectors = BackupVectors(backup_dir)
+        with gzip.open(backup_dir / RECORDS_FILE, "rt", encoding="utf-8") as records:
+            for row in range(len(vectors)):
+                yield json.loads(records.readline()), array("f", vectors[row:row + 1][0].tobytes())
+        return
+    with open(backup_dir / VECTORS_FILE, "rb") as vectors, \
+            gzip.open(backup_dir / RECORDS_FILE, "rt", encoding="utf-8") as records:
+        rows, dimensions = read_npy_header(vectors)
+        for _ in range(rows):
+            vector = array("f")
+            vector.fromfile(vectors, dimensions)
+            if sys.byteorder == "big":
+                vector.byteswap()
+            yield json.loads(records.readline()), vector
+
+
+async def post_with_retry(client: httpx.AsyncClient, url: str, payload, max_retries: int = 5):
+    """POST to Upstash, retrying rate limits, server errors and dropped connections"""
+    endpoint = url.rsplit("/", 1)[-1]
+    body = json.dumps(payload).encode()
+    for attempt in range(max_retries + 1):
+        try:
+            METRICS.inc("upstash_bytes_sent", len(body), endpoint=endpoint)
+            with METRICS.timer("upstash_request_seconds", endpoint=endpoint):
+                response = await client.post(url, content=body)
+            METRICS.inc("upstash_bytes_received", len(response.content), endpoint=endpoint)
+            if response.status_code == 200:
+                return response.json()["result"]
+            if response.status_code != 429 and response.status_code < 500:
+                raise RuntimeError(f"Upstash error {response.status_code}: {response.text}")
+            error = f"HTTP {response.status_code}"
+        except httpx.TransportError as e:
+            error = type(e).__name__
+        if attempt == max_retries:
+            raise RuntimeError(f"Upstash request to {url} failed after {max_retries} retries ({error})")
+        METRICS.inc("upstash_retries", endpoint=endpoint, error=error)
+        delay = random.uniform(0, min(30.0, 2 ** attempt))
+        print(f"Upstash request failed ({error}), retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+
+class VectorBackup:
+    """Full dump of an Upstash Vector index
+
+    A single cursor walks the ID range (IDs only, so pages are small) and
+    feeds batches of IDs to concurrent fetch workers. Rows are written in
+    completion order; the records file carries each row's ID.
+    """
+
+    def __init__(self, url: str, token: str, output_dir, page_size: int = 1000,
+                 fetch_batch_size: int = 100, concurrency: int = 4):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.output_dir = Path(output_dir)
+        self.page_size = page_size
+        self.fetch_batch_size = fetch_batch_size
+        self.concurrency = concurrency
+        self.pages_scanned = 0
+        self.missing = 0
+
+    async def run(self) -> Dict:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        start = time.monotonic()
+        headers = {"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"}
+        limits = httpx.Limits(max_connections=self.concurrency + 1)
+        async with httpx.AsyncClient(headers=headers, limits=limits, timeout=60) as client:
+            info_response = await client.get(f"{self.url}/info")
+            info_response.raise_for_status()
+            info = info_response.json()["result"]
+            with open(self.output_dir / "info.json", 'w') as f:
+                json.dump(info, f, indent=2)
+            print(f"Index holds {info.get('vectorCount', '?')} vectors of "
+                  f"{info.get('dimension', '?')} dimensions")
+
+            writer = BackupWriter(self.output_dir, info["dimension"])
+            id_batches: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+            async def scan():
+                cursor = "0"
+                while True:
+                    page = await post_with_retry(client, f"{self.url}/range", {
+                        "cursor": cursor, "limit": self.page_size,
+                        "includeVectors": False, "includeMetadata": False,
+                    })
+                    self.pages_scanned += 1
+                    ids = [vector["id"] for vector in page["vectors"]]
+                    for i in range(0, len(ids), self.fetch_batch_size):
+                        await id_batches.put(ids[i:i + self.fetch_batch_size])
+                    cursor = page.get("nextCursor")
+                    if not cursor:
+                        break
+                for _ in range(self.concurrency):
+                    await id_batches.put(None)
+
+            async def fetch_worker():
+                while (ids := await id_batches.get()) is not None:
+                    fetched = await post_with_retry(client, f"{self.url}/fetch", {
+                        "ids": ids, "includeVectors": True, "includeMetadata": True, "includeData": True,
+                    })
+                    # No await while writing, so each batch's rows and records stay aligned
+                    with METRICS.timer("backup_write_seconds", source="upstash"):
+                        for vector in fetched:
+                            if vector is None:
+                                # Deleted between the scan and the fetch
+                                self.missing += 1
+                                continue
+                            writer.append(vector["id"], array("f", vector["vector"]),
+                                          vector.get("metadata"), vector.get("data"))
+                    if writer.count // 10_000 != (writer.count - len(fetched)) // 10_000:
+                        print(f"Backed up {writer.count} vectors...")
+
+            try:
+                await asyncio.gather(scan(), *(fetch_worker() for _ in range(self.concurrency)))
+            except BaseException:
+                writer.abort()
+                raise
+
+        manifest = writer.close(source=self.url, similarity_function=info.get("similarityFunction"))
+        elapsed = time.monotonic() - start
+        size_mb = sum((self.output_dir / name).stat().st_size for name in (VECTORS_FILE, RECORDS_FILE)) / 1e6
+        print(f"Backed up {writer.count} vectors to {self.output_dir} in {elapsed:.1f}s "
+              f"({writer.count / elapsed if elapsed else 0:.0f} vectors/s, {size_mb:.1f} MB, "
+              f"{self.pages_scanned} range pages"
+              + (f", {self.missing} deleted during the backup" if self.missing else "") + ")")
+        return manifest
+
+
 async def backup_upstash_vector():
+    parser = argparse.ArgumentParser(description='Back up every vector of the Upstash Vector index')
+    parser.add_argument('--output', default=f"backups/{datetime.now().strftime('%Y%m%d')}/vector",
+                        help='Backup directory')
+    parser.add_argument('--page-size', type=int, default=1000, help='IDs per range page')
+    parser.add_argument('--fetch-batch-size', type=int, default=100, help='Vectors per fetch request')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent fetch requests')
+    parser.add_argument('--metrics-file',
+                        help='Write per-stage timings and counters here (JSON, or Prometheus text for .prom)')
+    args = parser.parse_args()
+
     url = os.getenv("UPSTASH_VECTOR_REST_URL")
     token = os.getenv("UPSTASH_VECTOR_REST_TOKEN")
-    
+
     if not url or not token:
         print("Missing Upstash credentials")
         return
-    
-    backup_dir = Path(f"backups/{datetime.now().strftime('%Y%m%d')}/vector")
-    backup_dir.mkdir(parents=True, exist_ok=True)
-    
-    async with httpx.AsyncClient() as client:
-        headers = {"Authorization": f"Bearer {token}"}
-        
-        # Get index info
-        info_response = await client.get(f"{url}/info", headers=headers)
-        if info_response.status_code == 200:
-            info_file = backup_dir / "info.json"
-            with open(info_file, 'w') as f:
-                json.dump(info_response.json(), f, indent=2)
-            print(f"Backed up index info to {info_file}")
-        
-        # Fetch vectors (limited to metadata only for size)
-        # Note: Upstash Vector doesn't have a browse endpoint, 
-        # so we'd need to implement cursor-based fetching
-        
-        # For now, save a sample query to verify the index is working
-        sample_query = {
-            "vector": [0.1] * 1536,  # Dummy vector
-            "topK": 5,
-            "includeMetadata": True,
-        }
-        
-        query_response = await client.post(
-            f"{url}/query",
-            headers=headers,
-            json=sample_query,
-            timeout=30
-        )
-        
-        if query_response.status_code == 200:
-            sample_file = backup_dir / f"sample_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            with open(sample_file, 'w') as f:
-                json.dump({
-                    "timestamp": datetime.now().isoformat(),
-                    "sample_results": query_response.json(),
-                    "status": "healthy"
-                }, f, indent=2)
-            print(f"Saved sample query results to {sample_file}")
-        
-        # Note: For full backup, you'd need to:
-        # 1. Keep track of all vector IDs during insertion
-        # 2. Fetch vectors in batches using those IDs
-        # 3. Store vectors and metadata separately
-        
-        print("Note: Full vector backup requires tracking IDs during insertion")
+
+    backup = VectorBackup(url, token, args.output, page_size=args.page_size,
+                          fetch_batch_size=args.fetch_batch_size, concurrency=args.concurrency)
+    METRICS.labels.update(script="backup_vector")
+    try:
+        await backup.run()
+    finally:
+        METRICS.print_summary()
+        if args.metrics_file:
+            METRICS.write(args.metrics_file)
 
 if __name__ == "__main__":
-    asyncio.run(backup_upstash_vector())
\ No newline at end of file
+    asyncio.run(backup_upstash_vector())
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks for the crawl/index/backup pipeline
+micro: per-page extraction, cleaning, code location, chunking and
+serialization on synthetic corpora; e2e: the real scripts run against
+scripts/mock_services.py. Results can be saved and compared with a
+baseline to catch regressions.
+"""
+
+import os
+import sys
+import json
+import argparse
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, List
+from urllib.request import urlopen
+
+import docstore
+import extract
+from boilerplate import BoilerplateDetector
+from metrics import peak_rss_mb, percentile
+from mock_services import synthetic_page
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+DEFAULT_SIZES = "1000,10000,100000"
+BASE_URL = "http://127.0.0.1/grandMA3/2.3/HTML/"
+
+
+class Timings:
+    """Per-call latencies of each benchmarked step"""
+
+    def __init__(self):
+        self.calls: Dict[str, List[float]] = {}
+
+    def add(self, name: str, started: float):
+        self.calls.setdefault(name, []).append(time.perf_counter() - started)
+
+    def summary(self, items: Dict[str, int]) -> Dict[str, Dict]:
+        result = {}
+        for name, latencies in self.calls.items():
+            total = sum(latencies)
+            result[name] = {
+                "seconds": total,
+                "per_second": items.get(name, len(latencies)) / total if total else 0.0,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+            }
+        return result
+
+
+def run_micro(pages: int, parser: str = "lxml", dimensions: int = 1536) -> Dict:
+    """Process `pages` synthetic pages the way crawl.py and index.py do
+
+    Pages stream through a temporary document store, so memory stays flat
+    however large the corpus is.
+    """
+    # DocumentIndexer checks for credentials; nothing is contacted here
+    for name, value in (("OPENAI_API_KEY", "benchmark"), ("UPSTASH_VECTOR_REST_URL", "http://127.0.0.1:9"),
+                        ("UPSTASH_VECTOR_REST_TOKEN", "benchmark"), ("ALGOLIA_APP_ID", "benchmark"),
+                        ("ALGOLIA_API_KEY", "benchmark")):
+        os.environ.setdefault(name, value)
+    from index import DocumentIndexer, encode_json
+
+    indexer = DocumentIndexer(version="2.3", embedding_cache=None, dedupe_threshold=None)
+    timings = Timings()
+    counts = {"pages": pages, "html_bytes": 0, "chunks": 0, "payload_bytes": 0}
+    embedding = array("f", [0.1] * dimensions)
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        partial_store = Path(tmp) / "documents.jsonl.partial"
+        raw_store = Path(tmp) / "documents.jsonl.gz"
+
+        # Crawl side: parse each page and append it to the partial store
+        writer = docstore.DocumentWriter(partial_store)
+        for number in range(pages):
+            _, html = synthetic_page("2.3", number)
+            counts["html_bytes"] += len(html)
+            url = f"{BASE_URL}t{number}.html"
+            started = time.perf_counter()
+            document = extract.extract_static(url, html, "2.3", BASE_URL, parser)
+            timings.add("extract", started)
+            started = time.perf_counter()
+            writer.append(document)
+            timings.add("serialize_append", started)
+        writer.close()
+        started = time.perf_counter()
+        docstore.write_store(docstore.iter_documents(partial_store), raw_store)
+        timings.add("serialize_store", started)
+
+        started = time.perf_counter()
+        detector = BoilerplateDetector()
+        detector.fit(lambda: (doc["text"] for doc in docstore.iter_documents(raw_store)))
+        timings.add("boilerplate_fit", started)
+
+        # Finalize and index side: clean, locate code, chunk, build request bodies
+        documents = docstore.iter_documents(raw_store)
+        while True:
+            started = time.perf_counter()
+            document = next(documents, None)
+            if document is None:
+                break
+            timings.add("serialize_read", started)
+
+            started = time.perf_counter()
+            blocks = extract.limit_blocks(detector.strip_blocks(document["blocks"]), extract.TEXT_LIMIT)
+            text = extract.blocks_text(blocks)
+            timings.add("clean", started)
+
+            started = time.perf_counter()
+            code_blocks, code_spans = extract.code_block_spans(blocks)
+            timings.add("code", started)
+
+            document = {**document, "text": text, "blocks": blocks,
+                        "code_blocks": code_blocks, "code_spans": code_spans}
+            started = time.perf_counter()
+            chunks = indexer._chunk_document(document)
+            timings.add("chunk", started)
+            counts["chunks"] += len(chunks)
+
+            started = time.perf_counter()
+            for chunk in chunks:
+                chunk["urls"] = [chunk["url"]]
+                body = encode_json([indexer._vector_record(chunk, embedding)])
+                body += encode_json({"requests": [{"action": "addObject", "body": indexer._algolia_record(chunk)}]})
+                counts["payload_bytes"] += len(body)
+            timings.add("serialize_payload", started)
+
+    items = dict.fromkeys(timings.calls, pages)
+    items["serialize_payload"] = counts["chunks"]
+    return {
+        "pages": pages,
+        "parser": parser,
+        "counts": counts,
+        "seconds": time.perf_counter() - start,
+        "peak_rss_mb": peak_rss_mb(),
+        "steps": timings.summary(items),
+    }
+
+
+def print_micro(result: Dict):
+    counts = result["counts"]
+    print(f"{result['pages']} pages ({counts['html_bytes'] / 1e6:.1f} MB HTML, {counts['chunks']} chunks, "
+          f"parser {result['parser']}): {result['seconds']:.1f}s, peak RSS {result['peak_rss_mb']:.0f} MB")
+    for name, step in result["steps"].items():
+        print(f"  {name:<18} {step['seconds']:7.2f}s  {step['per_second']:9.0f}/s  "
+              f"p50 {step['p50_ms']:.3f}ms  p95 {step['p95_ms']:.3f}ms")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def mock_stats(url: str) -> Dict[str, int]:
+    with urlopen(f"{url}/stats", timeout=10) as response:
+        return json.load(response)
+
+
+def run_stage(name: str, command: List[str], env: Dict[str, str], log_dir: Path) -> Dict:
+    """Run one script to completion, with its own wall time, CPU time and peak RSS"""
+    log_path = log_dir / f"{name}.log"
+    started = time.perf_counter()
+    with open(log_path, "w") as log:
+        process = subprocess.Popen([sys.executable, *command], cwd=SCRIPTS_DIR, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+        # wait4 reports the child's own resource usage, not the running total of all children
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    result = {
+        "seconds": time.perf_counter() - started,
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        "peak_rss_mb": usage.ru_maxrss / 1024,
+        "exit_code": process.returncode,
+    }
+    if process.returncode != 0:
+        tail = log_path.read_text().splitlines()[-20:]
+        raise RuntimeError(f"{name} exited with {process.returncode}:\n" + "\n".join(tail))
+    return result
+
+
+def run_e2e(pages: int, work_dir: Path, latency_ms: float = 0.0, error_rate: float = 0.0,
+            concurrency: int = 8, dimensions: int = 1536) -> Dict:
+    """Crawl, index (twice: full then unchanged) and back up against the mock services"""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    log_dir = work_dir / "logs"
+    log_dir.mkdir(parents=True, exist_ok=True)
+    env = {
+        **os.environ,
+        "PYTHONUNBUFFERED": "1",
+        "DOCS_BASE_URL": url,
+        "OPENAI_BASE_URL": f"{url}/v1",
+        "OPENAI_API_KEY": "benchmark",
+        "UPSTASH_VECTOR_REST_URL": url,
+        "UPSTASH_VECTOR_REST_TOKEN": "benchmark",
+        "ALGOLIA_BASE_URL": url,
+        "ALGOLIA_APP_ID": "benchmark",
+        "ALGOLIA_API_KEY": "benchmark",
+    }
+    data_dir = work_dir / "data"
+    stages = [
+        ("crawl", ["crawl.py", "--version", "2.3", "--max-pages", str(pages + 1), "--output", str(data_dir),
+                   "--fetch-mode", "static", "--discovery", "toc", "--rps", "100000", "--burst", "1000",
+                   "--concurrency", str(concurrency)]),
+        ("index", ["index.py", "--version", "2.3", "--input", str(data_dir),
+                   "--embedding-cache", str(data_dir / "cache" / "embeddings.sqlite"),
+                   "--dimensions", str(dimensions)]),
+        ("reindex", ["index.py", "--version", "2.3", "--input", str(data_dir),
+                     "--embedding-cache", str(data_dir / "cache" / "embeddings.sqlite"),
+                     "--dimensions", str(dimensions)]),
+        ("backup_vector", ["backup_vector.py", "--output", str(work_dir / "backups" / "vector")]),
+        ("backup_algolia", ["backup_algolia.py", "--output", str(work_dir / "backups" / "algolia")]),
+    ]
+
+    with open(log_dir / "mock.log", "w") as mock_log:
+        mock = subprocess.Popen(
+            [sys.executable, "mock_services.py", "--port", str(port), "--site-pages", str(pages),
+             "--latency-ms", str(latency_ms), "--error-rate", str(error_rate), "--dimensions", str(dimensions)],
+            cwd=SCRIPTS_DIR, stdout=mock_log, stderr=subprocess.STDOUT)
+    try:
+        for _ in range(100):
+            try:
+                before = mock_stats(url)
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError("Mock services did not start")
+
+        results = {}
+        for name, command in stages:
+            print(f"  {name}...", flush=True)
+            # Per-stage timings of each script's own --metrics-file
+            command = command + ["--metrics-file", str(work_dir / "metrics" / f"{name}.json")]
+            result = run_stage(name, command, env, log_dir)
+            after = mock_stats(url)
+            result["mock_cpu_seconds"] = (after["cpu_ms"] - before["cpu_ms"]) / 1000
+            result["requests"] = {key: value - before.get(key, 0) for key, value in after.items()
+                                  if key != "cpu_ms" and value != before.get(key, 0)}
+            before = after
+            results[name] = result
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    chunks = results["index"]["requests"].get("algolia_records", 0)
+    throughput = {"crawl": pages, "index": chunks, "reindex": chunks, "backup_vector": chunks,
+                  "backup_algolia": chunks}
+    for name, result in results.items():
+        result["per_second"] = throughput[name] / result["seconds"] if result["seconds"] else 0.0
+    return {"pages": pages, "chunks": chunks, "latency_ms": latency_ms, "error_rate": error_rate,
+            "stages": results}
+
+
+def print_e2e(result: Dict):
+    print(f"{result['pages']} pages, {result['chunks']} chunks "
+          f"(mock latency {result['latency_ms']}ms, error rate {result['error_rate']})")
+    for name, stage in result["stages"].items():
+        requests = ", ".join(f"{key}={value}" for key, value in sorted(stage["requests"].items()))
+        print(f"  {name:<15} {stage['seconds']:7.1f}s  {stage['per_second']:8.0f}/s  "
+              f"cpu {stage['cpu_seconds']:6.1f}s (mock {stage['mock_cpu_seconds']:5.1f}s)  "
+              f"peak RSS {stage['peak_rss_mb']:5.0f} MB  {requests}")
+
+
+def flatten(result, prefix: str = "") -> Dict[str, float]:
+    metrics = {}
+    for key, value in result.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten(value, name + "."))
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict) and "pages" in item:
+                    metrics.update(flatten(item, f"{name}.{item['pages']}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[name] = value
+    return metrics
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Metrics worse than the baseline by more than `tolerance` (a share)
+
+    Times and memory regress upwards, throughput downwards; per-call
+    percentiles are left out as too noisy to gate on.
+    """
+    regressions = []
+    now, before = flatten(current), flatten(baseline)
+    for name, value in sorted(now.items()):
+        previous = before.get(name)
+        if not previous:
+            continue
+        leaf = name.rsplit(".", 1)[-1]
+        if leaf in ("seconds", "cpu_seconds", "peak_rss_mb"):
+            change = value / previous - 1
+        elif leaf == "per_second":
+            change = previous / value - 1 if value else float("inf")
+        else:
+            continue
+        if change > tolerance:
+            regressions.append(f"{name}: {previous:.3f} -> {value:.3f} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks for crawl.py, index.py and the backups')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    micro = subparsers.add_parser('micro', help='Per-page processing steps on synthetic corpora')
+    micro.add_argument('--pages', default=DEFAULT_SIZES, help='Comma-separated corpus sizes')
+    micro.add_argument('--parser', choices=extract.PARSERS, default='lxml', help='HTML parser backend')
+
+    e2e = subparsers.add_parser('e2e', help='The real scripts against the mock services')
+    e2e.add_argument('--pages', default='1000,10000', help='Comma-separated docs site sizes')
+    e2e.add_argument('--latency-ms', type=float, default=0.0, help='Added latency per mock request')
+    e2e.add_argument('--error-rate', type=float, default=0.0, help='Share of mock requests answered with 429')
+    e2e.add_argument('--concurrency', type=int, default=8, help='Crawl workers')
+    e2e.add_argument('--dimensions', type=int, default=1536, help='Embedding dimensions')
+    e2e.add_argument('--work-dir', help='Keep crawl data, backups and logs here (default: a temporary directory)')
+
+    for subparser in (micro, e2e):
+        subparser.add_argument('--output', help='Write the results as JSON')
+        subparser.add_argument('--baseline', help='Results JSON of an earlier run to compare against')
+        subparser.add_argument('--tolerance', type=float, default=0.2,
+                               help='Allowed slowdown or memory growth before failing (0.2 = 20%%)')
+
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.pages.split(",") if size.strip()]
+    results: Dict = {"benchmark": args.command, "python": sys.version.split()[0], "runs": []}
+
+    if args.command == 'micro':
+        for pages in sizes:
+            # A fresh process per size, so peak RSS belongs to that size alone
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                result = pool.submit(run_micro, pages, args.parser).result()
+            print_micro(result)
+            results["runs"].append(result)
+    else:
+        for pages in sizes:
+            print(f"End-to-end run with {pages} pages")
+            if args.work_dir:
+                work_dir = Path(args.work_dir) / str(pages)
+                shutil.rmtree(work_dir, ignore_errors=True)
+                result = run_e2e(pages, work_dir, args.latency_ms, args.error_rate, args.concurrency,
+                                 args.dimensions)
+            else:
+                with tempfile.TemporaryDirectory() as tmp:
+                    result = run_e2e(pages, Path(tmp), args.latency_ms, args.error_rate, args.concurrency,
+                                     args.dimensions)
+            print_e2e(result)
+            results["runs"].append(result)
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions beyond {args.tolerance:.0%} of {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            raise SystemExit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Cross-page boilerplate detection
+Finds word shingles shared by most pages of a version (navigation, headers,
+footers) and strips them from the text of every page
+"""
+
+import hashlib
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+# Texts are whitespace-normalized, so shingles are runs of this many words
+SHINGLE_WORDS = 8
+
+
+def _kept_spans(words: List[str], keep: List[bool], spans: Iterable[List[int]]) -> List[List[int]]:
+    """Spans of " ".join(words) moved onto the text of the kept words"""
+    old, new = [], []
+    old_position = new_position = 0
+    for word, keep_word in zip(words, keep):
+        old.append(old_position)
+        new.append(new_position if keep_word else None)
+        old_position += len(word) + 1
+        if keep_word:
+            new_position += len(word) + 1
+    moved = []
+    for start, end in spans:
+        inside = [
+            i for i, word in enumerate(words)
+            if keep[i] and old[i] < end and old[i] + len(word) > start
+        ]
+        if inside:
+            first, last = inside[0], inside[-1]
+            moved.append([new[first] + max(start - old[first], 0),
+                          new[last] + min(end, old[last] + len(words[last])) - old[last]])
+    return moved
+
+
+class BoilerplateDetector:
+    """Learns which shingles appear on more than `threshold` of a corpus's pages
+
+    Fitting takes two passes so memory stays small on large corpora: shingles
+    common in a sample of pages become candidates, then only candidates are
+    counted exactly across every page.
+
+    Pages that were already stripped by a previous run are passed as None and
+    count as containing the previous run's boilerplate.
+    """
+
+    def __init__(self, threshold: float = 0.5, min_pages: int = 5, sample_size: int = 50,
+                 candidate_share: float = 0.2, previous: Iterable[int] = ()):
+        self.threshold = threshold
+        self.min_pages = min_pages
+        self.sample_size = sample_size
+        self.candidate_share = candidate_share
+        self.previous: Set[int] = set(previous)
+        self.boilerplate: Set[int] = set()
+        self._word_ids: Dict[str, int] = {}
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    def _word_id(self, word: str) -> int:
+        word_id = self._word_ids.get(word)
+        if word_id is None:
+            # Stable across runs, unlike hash() of a str, so shingles can be saved
+            word_id = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+            self._word_ids[word] = word_id
+        return word_id
+
+    def shingles(self, words: List[str]) -> List[int]:
+        ids = [self._word_id(word) for word in words]
+        # A tuple of ints hashes deterministically
+        return [hash(tuple(ids[i:i + SHINGLE_WORDS])) for i in range(len(ids) - SHINGLE_WORDS + 1)]
+
+    def _page_shingles(self, text: Optional[str]) -> Set[int]:
+        if text is None:
+            return self.previous
+        return set(self.shingles(text.split()))
+
+    def fit(self, texts: Callable[[], Iterable[Optional[str]]]) -> Set[int]:
+        """Learn the boilerplate shingles; `texts` returns a fresh iterator per pass"""
+        pages = sum(1 for _ in texts())
+        if pages < self.min_pages:
+            self.boilerplate = set()
+            return self.boilerplate
+
+        stride = max(1, pages // self.sample_size)
+        sample = Counter()
+        sampled = 0
+        for i, text in enumerate(texts()):
+            if i % stride == 0:
+                sample.update(self._page_shingles(text))
+                sampled += 1
+        candidates = {
+            shingle for shingle, count in sample.items()
+            if count >= self.candidate_share * sampled
+        }
+        del sample
+
+        document_frequency = Counter()
+        for text in texts():
+            document_frequency.update(self._page_shingles(text) & candidates)
+        self.boilerplate = {
+            shingle for shingle, count in document_frequency.items()
+            if count > self.threshold * pages
+        }
+        return self.boilerplate
+
+    def _covered(self, words: List[str]) -> List[bool]:
+        """Which words fall inside a boilerplate shingle"""
+        covered = [False] * len(words)
+        if self.boilerplate:
+            for i, shingle in enumerate(self.shingles(words)):
+                if shingle in self.boilerplate:
+                    covered[i:i + SHINGLE_WORDS] = [True] * SHINGLE_WORDS
+        return covered
+
+    def strip(self, text: str) -> str:
+        """Remove every run of words covered by a boilerplate shingle"""
+        words = text.split()
+        stripped = " ".join(word for word, skip in zip(words, self._covered(words)) if not skip)
+        self.bytes_before += len(text.encode())
+        self.bytes_after += len(stripped.encode())
+        return stripped
+
+    def strip_blocks(self, blocks: List[Dict]) -> List[Dict]:
+        """`strip` over the page text as a whole, keeping block boundaries
+
+        Blocks with nothing removed keep their original text; emptied blocks are dropped.
+        Code blocks are kept or dropped whole, since rejoining their words would
+        lose the line breaks.
+        """
+        block_words = [block["text"].split() for block in blocks]
+        words = [word for block in block_words for word in block]
+        covered = self._covered(words)
+        self.bytes_before += len(" ".join(words).encode())
+
+        stripped = []
+        start = 0
+        for block, block_word_list in zip(blocks, block_words):
+            end = start + len(block_word_list)
+            if not any(covered[start:end]):
+                stripped.append(block)
+            elif block["type"] == "code":
+                if not all(covered[start:end]):
+                    stripped.append(block)
+            else:
+                keep = [not skip for skip in covered[start:end]]
+                kept = [word for word, keep_word in zip(block_word_list, keep) if keep_word]
+                if kept:
+                    block = {**block, "text": " ".join(kept)}
+                    code_spans = _kept_spans(block_word_list, keep, block.pop("code_spans", ()))
+                    if code_spans:
+                        block["code_spans"] = code_spans
+                    stripped.append(block)
+            start = end
+        self.bytes_after += len(" ".join(block["text"] for block in stripped).encode())
+        return stripped
+
+    def stats(self) -> str:
+        removed = self.bytes_before - self.bytes_after
+        share = removed / self.bytes_before if self.bytes_before else 0.0
+        return (f"{len(self.boilerplate)} boilerplate shingles, "
+                f"{removed / 1024:.1f} KB removed ({share:.1%} of page text)")
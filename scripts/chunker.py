@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Structure-aware chunking
+Packs a page's blocks (headings, paragraphs, tables, code) into chunks of at
+most max_tokens tokens, carrying the heading trail as the section path
+"""
+
+import re
+from typing import Dict, List, NamedTuple, Tuple
+
+# Chunks are joined from pieces with this separator, counted as one token
+SEPARATOR = "\n"
+_SENTENCE_END = re.compile(r'(?<=[.!?:;])\s+')
+
+
+class Chunk(NamedTuple):
+    text: str
+    section_path: str
+    # [start, end) of the chunk in the page's flat text
+    start: int
+    end: int
+
+
+class Chunker:
+    """Greedy packer over page blocks with an exact token budget
+
+    Blocks are kept whole whenever they fit. A block larger than the budget
+    is split at line breaks (code, tables) or sentence ends (prose), then at
+    words, and only as a last resort in the middle of a token run. A heading
+    starts a new chunk once the current one holds a reasonable amount of
+    text, so chunks line up with sections.
+
+    Token counts come from `encoding` (a tiktoken Encoding) when given,
+    otherwise from a 4-characters-per-token estimate.
+    """
+
+    def __init__(self, encoding=None, max_tokens: int = 500, min_chars: int = 100):
+        self.encoding = encoding
+        self.max_tokens = max_tokens
+        self.min_chars = min_chars
+        # A heading only closes the current chunk once it has this many tokens
+        self.min_section_tokens = max_tokens // 5
+        # Oversized blocks are cut a little under budget so a heading fits before them
+        self.split_tokens = max_tokens - max_tokens // 10
+
+    def count_tokens(self, text: str) -> int:
+        if self.encoding:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return len(text) // 4 + 1
+
+    def chunk(self, title: str, blocks: List[Dict]) -> List[Chunk]:
+        """Split a page into chunks with their section path and span in the page text"""
+        # Each chunk is a list of pieces: (text, tokens, start, end)
+        chunks: List[Tuple[List[Tuple[str, int, int, int]], str]] = []
+        pieces: List[Tuple[str, int, int, int]] = []
+        trailing_headings = 0
+        trail: List[Tuple[int, str]] = []
+        path = self._section_path(title, trail)
+
+        def total(chunk_pieces) -> int:
+            return sum(piece[1] for piece in chunk_pieces) + max(0, len(chunk_pieces) - 1)
+
+        def flush():
+            nonlocal pieces, trailing_headings
+            if not pieces:
+                return
+            if chunks and len(SEPARATOR.join(piece[0] for piece in pieces)) < self.min_chars:
+                # Fold a short section into the chunk before it when there's room
+                prev_pieces, prev_path = chunks[-1]
+                if total(prev_pieces + pieces) <= self.max_tokens:
+                    chunks[-1] = (prev_pieces + pieces, prev_path)
+                    pieces, trailing_headings = [], 0
+                    return
+            chunks.append((pieces, path))
+            pieces, trailing_headings = [], 0
+
+        # Page text is the blocks' whitespace-normalized text joined by spaces
+        offset = 0
+        for block in blocks:
+            is_heading = block["type"] == "heading"
+            if is_heading:
+                level = block.get("level", 1)
+                if total(pieces) >= self.min_section_tokens:
+                    flush()
+                while trail and trail[-1][0] >= level:
+                    trail.pop()
+                trail.append((level, block["text"]))
+                if not pieces:
+                    path = self._section_path(title, trail)
+
+            flat = " ".join(block["text"].split())
+            cursor = 0
+            for piece, piece_tokens in self._split(block):
+                needle = " ".join(piece.split())
+                position = flat.find(needle, cursor)
+                if position < 0:
+                    position = cursor
+                cursor = position + len(needle)
+                item = (piece, piece_tokens, offset + position, offset + cursor)
+
+                if pieces and total(pieces + [item]) > self.max_tokens:
+                    # Headings go with the text that follows them
+                    carried = []
+                    if 0 < trailing_headings < len(pieces):
+                        carried = pieces[-trailing_headings:]
+                        if total(carried + [item]) > self.max_tokens:
+                            carried = []
+                        else:
+                            del pieces[-trailing_headings:]
+                    flush()
+                    path = self._section_path(title, trail)
+                    pieces = list(carried)
+                    trailing_headings = len(carried)
+                pieces.append(item)
+                trailing_headings = trailing_headings + 1 if is_heading else 0
+            offset += len(flat) + 1
+        flush()
+
+        results = [
+            Chunk(SEPARATOR.join(piece[0] for piece in chunk_pieces), section_path,
+                  chunk_pieces[0][2], chunk_pieces[-1][3])
+            for chunk_pieces, section_path in chunks
+        ]
+        # A page with almost no text isn't worth a chunk
+        if len(results) == 1 and len(results[0].text) < self.min_chars:
+            return []
+        return results
+
+    @staticmethod
+    def _section_path(title: str, trail: List[Tuple[int, str]]) -> str:
+        headings = [text for _, text in trail]
+        if not headings or headings[0] != title:
+            headings.insert(0, title)
+        return " > ".join(heading for heading in headings if heading)
+
+    def _split(self, block: Dict) -> List[Tuple[str, int]]:
+        """A block as pieces that each fit the budget, with their token counts"""
+        text = block["text"]
+        tokens = self.count_tokens(text)
+        if tokens <= self.max_tokens:
+            return [(text, tokens)]
+        if block["type"] == "heading":
+            return self._hard_split(text)
+
+        if block["type"] in ("code", "table"):
+            parts, joiner = text.split("\n"), "\n"
+        else:
+            parts, joiner = _SENTENCE_END.split(text), " "
+        if len(parts) == 1:
+            parts, joiner = text.split(), " "
+        return self._pack(parts, joiner)
+
+    def _pack(self, parts: List[str], joiner: str) -> List[Tuple[str, int]]:
+        pieces: List[Tuple[str, int]] = []
+        current: List[str] = []
+        current_tokens = 0
+        for part in parts:
+            part_tokens = self.count_tokens(part)
+            if part_tokens > self.split_tokens:
+                if current:
+                    pieces.append((joiner.join(current), current_tokens))
+                    current, current_tokens = [], 0
+                if " " in part.strip():
+                    pieces.extend(self._pack(part.split(), " "))
+                else:
+                    pieces.extend(self._hard_split(part))
+                continue
+            added = part_tokens + (1 if current else 0)
+            if current and current_tokens + added > self.split_tokens:
+                pieces.append((joiner.join(current), current_tokens))
+                current, current_tokens, added = [], 0, part_tokens
+            current.append(part)
+            current_tokens += added
+        if current:
+            pieces.append((joiner.join(current), current_tokens))
+        return pieces
+
+    def _hard_split(self, text: str) -> List[Tuple[str, int]]:
+        """Cut a single unbreakable run into budget-sized token windows"""
+        if self.encoding:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            windows = [tokens[i:i + self.split_tokens] for i in range(0, len(tokens), self.split_tokens)]
+            return [(self.encoding.decode(window), len(window)) for window in windows]
+        size = self.split_tokens * 4
+        return [(text[i:i + size], self.count_tokens(text[i:i + size])) for i in range(0, len(text), size)]
@@ -5,84 +5,810 @@ Crawls grandMA3 docs and saves to JSON files
 """
 
 import asyncio
-import json
 import hashlib
+import json
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Set
+from typing import Dict, List, Optional, Set, Tuple
 from urllib.parse import urljoin, urlparse
 import argparse
-import re
+from xml.etree import ElementTree
 
-from playwright.async_api import async_playwright
+import httpx
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 from bs4 import BeautifulSoup
 
+import boilerplate
+import docstore
+import extract
+from extract import CONTENT_SELECTORS, canonicalize_url
+from metrics import METRICS, percentile
+
+FETCH_MODES = ("auto", "static", "browser")
+
+# Set DOCS_BASE_URL to crawl a local copy of the manual (e.g. scripts/mock_services.py)
+DOCS_BASE_URL = os.getenv("DOCS_BASE_URL", "https://help.malighting.com").rstrip("/")
+
+# Containers that hold the help.html table of contents / navigation tree
+TOC_SELECTORS = ['.nav-tree', '#toc', '.toc', 'nav', '[role="navigation"]', '.sidebar']
+
+DISCOVERY_MODES = ("auto", "toc", "links")
+
+# fast: block assets, reuse pages, wait for content; full: fresh page and fixed sleeps
+RENDER_MODES = ("fast", "full")
+
+DEFAULT_PARSE_WORKERS = min(4, os.cpu_count() or 1)
+
+# Resources that never contribute text, skipped by the fast render mode
+BLOCKED_RESOURCE_TYPES = {"image", "font", "stylesheet", "media"}
+
+# Ready once a content selector holds enough text (in the page or a same-origin
+# iframe), or once the loaded page's text has stopped changing for settleMs
+CONTENT_READY_JS = """
+    ([selectors, minChars, settleMs]) => {
+        const docs = [document];
+        document.querySelectorAll('iframe').forEach(frame => {
+            try {
+                if (frame.contentDocument) docs.push(frame.contentDocument);
+            } catch (e) {}
+        });
+        let longest = 0;
+        for (const doc of docs) {
+            for (const selector of selectors) {
+                const elem = doc.querySelector(selector);
+                if (!elem) continue;
+                const length = elem.textContent.trim().length;
+                if (length >= minChars) return true;
+                longest = Math.max(longest, length);
+            }
+        }
+        if (document.readyState !== 'complete') return false;
+        const now = Date.now();
+        const state = window.__contentReady || (window.__contentReady = {length: -1, since: now});
+        if (state.length !== longest) {
+            state.length = longest;
+            state.since = now;
+            return false;
+        }
+        return now - state.since >= settleMs;
+    }
+"""
+
+# Collects anchors and onclick navigation targets, in document order
+EXTRACT_LINKS_JS = """
+    () => {
+        const links = [];
+        // Get all anchor tags
+        document.querySelectorAll('a[href]').forEach(a => {
+            if (a.href && a.href.includes('.html')) {
+                links.push(a.href);
+            }
+        });
+        // Also check for dynamically loaded navigation items
+        document.querySelectorAll('[onclick*=".html"]').forEach(el => {
+            const match = el.getAttribute('onclick').match(/['"]([^'"]*\\.html)['"]/);
+            if (match) {
+                links.push(new URL(match[1], window.location.href).href);
+            }
+        });
+        return links;
+    }
+"""
+
+# Document status values written in incremental mode
+DOCUMENT_STATUSES = ("new", "changed", "unchanged", "removed")
+# Responses that prove a page was taken down; any other failure may be transient
+GONE_STATUSES = (404, 410)
+
+class TokenBucket:
+    """Async token bucket: refills at `rate` tokens/s, holds at most `capacity`"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Waiters queue up on the lock, so tokens are handed out in FIFO order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class HostRateLimiter:
+    """One token bucket per host, shared by all crawl workers"""
+
+    def __init__(self, rps: float, burst: float = 1.0):
+        self.rps = rps
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    async def acquire(self, url: str):
+        host = urlparse(url).netloc
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(self.rps, self.burst)
+        await bucket.acquire()
+
+
+def url_key(url: str, case_insensitive: bool = True) -> str:
+    """Deduplication key: the canonical URL, case-folded unless disabled"""
+    url = canonicalize_url(url)
+    return url.lower() if case_insensitive else url
+
+
+class CrawlFrontier(asyncio.PriorityQueue):
+    """Priority queue of URLs to crawl in which every URL is enqueued at most once
+
+    Entries are ordered by (priority, insertion order), so lower priorities such
+    as link depth are crawled first and ties stay FIFO.
+    """
+
+    def __init__(self, case_insensitive: bool = True):
+        super().__init__()
+        self.case_insensitive = case_insensitive
+        self._seen: Set[str] = set()
+        self._order = itertools.count()
+        self.enqueued = 0
+        self.duplicates_suppressed = 0
+
+    def mark_seen(self, url: str):
+        self._seen.add(url_key(url, self.case_insensitive))
+
+    def release(self, url: str):
+        """Forget a URL that failed, so another spelling of it may still be crawled"""
+        self._seen.discard(url_key(url, self.case_insensitive))
+
+    def push(self, url: str, priority: int = 0) -> bool:
+        key = url_key(url, self.case_insensitive)
+        if key in self._seen:
+            self.duplicates_suppressed += 1
+            return False
+        self._seen.add(key)
+        self.put_nowait((priority, next(self._order), canonicalize_url(url)))
+        self.enqueued += 1
+        return True
+
+    async def pop(self) -> Tuple[str, int]:
+        priority, _, url = await self.get()
+        return url, priority
+
+    def pending(self) -> List[Tuple[str, int]]:
+        return [(url, priority) for priority, _, url in sorted(self._queue)]
+
+
+class PagePool:
+    """Fixed set of browser pages handed out to workers and reused across URLs"""
+    
+    def __init__(self, context, size: int):
+        self.context = context
+        self.size = size
+        self._created = 0
+        self._idle: asyncio.Queue = asyncio.Queue()
+    
+    async def acquire(self):
+        if self._idle.empty() and self._created < self.size:
+            self._created += 1
+            return await self.context.new_page()
+        return await self._idle.get()
+    
+    async def release(self, page, broken: bool = False):
+        """Return a page; broken pages are replaced so a crash doesn't poison the pool"""
+        if broken or page.is_closed():
+            try:
+                await page.close()
+            except Exception:
+                pass
+            page = await self.context.new_page()
+        self._idle.put_nowait(page)
+    
+    async def close(self):
+        while not self._idle.empty():
+            await self._idle.get_nowait().close()
+
+
+class FetchSession:
+    """HTTP pool, browser context and parse pool used by one or more crawlers
+
+    Crawlers of several versions share one session, so a multi-version run
+    launches a single browser and keeps a single connection pool.
+    """
+    
+    def __init__(self, fetch_mode: str = "auto", render_mode: str = "fast",
+                 connections: int = 4, parse_workers: int = DEFAULT_PARSE_WORKERS):
+        self.fetch_mode = fetch_mode
+        self.render_mode = render_mode
+        self.connections = max(1, connections)
+        self.parse_workers = parse_workers
+        self.http: Optional[httpx.AsyncClient] = None
+        self.context = None
+        self.parse_pool: Optional[ProcessPoolExecutor] = None
+        self.blocked_requests = 0
+        self._playwright = None
+        self._browser = None
+    
+    async def __aenter__(self):
+        # Spawned rather than forked: a forked worker would inherit the Playwright
+        # driver's pipes and keep it from shutting down
+        if self.parse_workers > 0:
+            self.parse_pool = ProcessPoolExecutor(
+                max_workers=self.parse_workers, mp_context=multiprocessing.get_context("spawn"),
+            )
+        limits = httpx.Limits(max_connections=self.connections, max_keepalive_connections=self.connections)
+        self.http = httpx.AsyncClient(limits=limits, timeout=30, follow_redirects=True)
+        if self.fetch_mode != "static":
+            self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(
+                headless=True,
+                args=['--no-sandbox', '--disable-setuid-sandbox']  # Required for GitHub Actions
+            )
+            # All workers share one context (cookies, cache) and open their own pages
+            self.context = await self._browser.new_context()
+            if self.render_mode == "fast":
+                await self.context.route("**/*", self._route_request)
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        if self._browser:
+            await self._browser.close()
+        if self._playwright:
+            await self._playwright.stop()
+        await self.http.aclose()
+        if self.parse_pool is not None:
+            self.parse_pool.shutdown()
+    
+    async def _route_request(self, route):
+        if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+            self.blocked_requests += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+
 class LightweightCrawler:
-    def __init__(self, version: str = "2.3", output_dir: str = "./data"):
+    def __init__(self, version: str = "2.3", output_dir: str = "./data",
+                 rate_limiter: Optional[HostRateLimiter] = None,
+                 fetch_mode: str = "auto", min_static_chars: int = 500,
+                 incremental: bool = False, store_format: str = "jsonl.gz",
+                 checkpoint_every: int = 25, case_insensitive_urls: bool = True,
+                 discovery: str = "auto", min_toc_topics: int = 10,
+                 render_mode: str = "fast", ready_min_chars: int = 200,
+                 ready_timeout: float = 10.0, settle_ms: int = 500,
+                 parse_workers: int = DEFAULT_PARSE_WORKERS, parser: str = "lxml",
+                 boilerplate_threshold: Optional[float] = 0.5):
+        if discovery not in DISCOVERY_MODES:
+            raise ValueError(f"discovery must be one of {', '.join(DISCOVERY_MODES)}")
+        if render_mode not in RENDER_MODES:
+            raise ValueError(f"render_mode must be one of {', '.join(RENDER_MODES)}")
+        if fetch_mode not in FETCH_MODES:
+            raise ValueError(f"fetch_mode must be one of {', '.join(FETCH_MODES)}")
         self.version = version
-        self.base_url = f"https://help.malighting.com/grandMA3/{version}/HTML/"
+        self.base_url = f"{DOCS_BASE_URL}/grandMA3/{version}/HTML/"
         self.output_dir = Path(output_dir) / "raw" / version
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.visited_urls: Set[str] = set()
-        self.documents: List[Dict] = []
+        # URLs whose documents are in the store; the documents themselves are not kept
+        self.crawled_urls: Set[str] = set()
+        # URLs the server answered with a GONE_STATUSES code
+        self.gone_urls: Set[str] = set()
+        self.store_format = store_format
+        self.partial_file = self.output_dir / "documents.jsonl.partial"
+        self.checkpoint_file = self.output_dir / "checkpoint.json"
+        self.checkpoint_every = checkpoint_every
+        self.store: Optional[docstore.DocumentWriter] = None
+        # URLs claimed by a worker but not yet written to the store, with their depth
+        self._in_flight: Dict[str, int] = {}
+        self.frontier = CrawlFrontier(case_insensitive=case_insensitive_urls)
+        self.discovery = discovery
+        self.min_toc_topics = min_toc_topics
+        # Complete topic list from the TOC/sitemap; when set, page links aren't followed
+        self.topics: List[str] = []
+        self.topics_source: Optional[str] = None
+        self.out_of_scope = 0
+        self.rate_limiter = rate_limiter or HostRateLimiter(rps=2.0)
+        self.fetch_mode = fetch_mode
+        self.min_static_chars = min_static_chars
+        self.incremental = incremental
+        self.pages_crawled = 0
+        self._pages_reserved = 0
+        self._budget_exhausted = False
+        # Previous run's manifest entries and documents, keyed by URL
+        self.previous_manifest: Dict[str, Dict] = {}
+        self.previous_documents: Optional[docstore.DocumentLookup] = None
+        # ETag/Last-Modified seen for each URL fetched in this run
+        self._validators: Dict[str, Dict] = {}
+        self._http: Optional[httpx.AsyncClient] = None
+        # Pages and seconds spent per fetch path
+        self.fetch_stats = {"static": 0, "browser": 0, "fallback": 0, "not_modified": 0}
+        self.fetch_seconds = {"static": 0.0, "browser": 0.0}
+        self.render_mode = render_mode
+        # Parsing and cleaning run in worker processes; 0 keeps them on the event loop
+        self.parse_workers = parse_workers
+        self.parser = parser
+        self._parse_pool: Optional[ProcessPoolExecutor] = None
+        self.extract_seconds = 0.0
+        self.extract_count = 0
+        # Text shared by most pages is stripped when the store is finalized
+        self.boilerplate = (
+            boilerplate.BoilerplateDetector(threshold=boilerplate_threshold)
+            if boilerplate_threshold else None
+        )
+        self.ready_min_chars = ready_min_chars
+        self.ready_timeout = ready_timeout
+        self.settle_ms = settle_ms
+        self._pages: Optional[PagePool] = None
+        # Wall time of each browser render, for p50/p95 reporting
+        self.render_seconds: List[float] = []
+        self.session: Optional[FetchSession] = None
         
-    async def crawl(self, max_pages: int = 100):
-        print(f"Starting crawl of grandMA3 v{self.version} docs...")
+    async def crawl(self, max_pages: int = 100, concurrency: int = 4, resume: bool = False,
+                    session: Optional[FetchSession] = None):
+        """Crawl the version; `session` shares fetch resources with other crawlers"""
+        print(f"Starting crawl of grandMA3 v{self.version} docs "
+              f"({concurrency} workers, {self.rate_limiter.rps} req/s per host, "
+              f"fetch mode {self.fetch_mode})...")
+        start = time.monotonic()
+        if self.incremental:
+            self._load_previous_crawl()
         
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=True,
-                args=['--no-sandbox', '--disable-setuid-sandbox']  # Required for GitHub Actions
-            )
-            context = await browser.new_context()
-            
-            # Start from help page (main table of contents)
-            queue = [self.base_url + "help.html"]
-            pages_crawled = 0
-            
-            while queue and pages_crawled < max_pages:
-                url = queue.pop(0)
+        # Start from help page (main table of contents)
+        frontier = [(self.base_url + "help.html", 0)]
+        if resume and self.partial_file.exists():
+            frontier = self._restore_checkpoint()
+            self.store = docstore.DocumentWriter(self.partial_file, append=True)
+        else:
+            if resume:
+                print("Nothing to resume, starting a fresh crawl")
+            self.store = docstore.DocumentWriter(self.partial_file)
+        
+        if session is None:
+            async with FetchSession(self.fetch_mode, self.render_mode, concurrency,
+                                    self.parse_workers) as own_session:
+                await self._run_workers(own_session, frontier, max_pages, concurrency)
+        else:
+            await self._run_workers(session, frontier, max_pages, concurrency)
+        
+        # Finalize the document store
+        with METRICS.timer("crawl_save_seconds"):
+            self._save_documents()
+        elapsed = time.monotonic() - start
+        print(f"Crawl complete. {self.pages_crawled} pages saved to {self.output_dir} in {elapsed:.1f}s")
+        print(f"Total unique URLs visited: {len(self.visited_urls)}")
+        print(f"Frontier: {self.frontier.enqueued} URLs enqueued, "
+              f"{self.frontier.duplicates_suppressed} duplicates suppressed, "
+              f"{self.out_of_scope} out-of-scope links skipped")
+        self._print_fetch_stats()
+        if self.topics:
+            self._report_coverage()
+    
+    async def _run_workers(self, session: FetchSession, frontier: List[Tuple[str, int]],
+                           max_pages: int, concurrency: int):
+        self.session = session
+        self._http = session.http
+        self._parse_pool = session.parse_pool
+        context = session.context
+        if context is not None and self.render_mode == "fast":
+            self._pages = PagePool(context, max(1, concurrency))
+        
+        if self.discovery != "links" and not self.topics:
+            with METRICS.timer("crawl_discovery_seconds"):
+                topics = await self._discover_topics(context)
+            if topics:
+                # Priority is the TOC position, so topics are fetched in TOC order
+                self.topics = topics
+                frontier = list(zip(topics, range(len(topics))))
+            elif self.discovery == "toc":
+                print("Warning: no table of contents found, falling back to following links")
+        if not self.topics and self.previous_documents is not None:
+            # Without a topic list, recheck every previous page so one that is no
+            # longer linked is still seen, and only removed if the server says so
+            frontier = frontier + [(url, 1) for url in self.previous_documents.urls()]
+        
+        for url, depth in frontier:
+            self.frontier.push(url, depth)
+        
+        workers = [
+            asyncio.create_task(self._worker(context, max_pages))
+            for _ in range(max(1, concurrency))
+        ]
+        # Workers only return by raising (e.g. the store can't be written), which
+        # would leave join() waiting forever, so a failed worker aborts the crawl
+        join = asyncio.create_task(self.frontier.join())
+        done, _ = await asyncio.wait([join, *workers], return_when=asyncio.FIRST_COMPLETED)
+        join.cancel()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(join, *workers, return_exceptions=True)
+        
+        if self._pages:
+            await self._pages.close()
+            self._pages = None
+        self._http = None
+        self._parse_pool = None
+        for worker in done - {join}:
+            worker.result()
+    
+    async def _discover_topics(self, context) -> List[str]:
+        """Complete topic list for this version from a sitemap or the help.html TOC"""
+        sources = [
+            ("sitemap", self._discover_from_sitemap),
+            ("table of contents", self._discover_from_toc),
+        ]
+        if context is not None:
+            sources.append(("rendered table of contents", lambda: self._discover_from_rendered_toc(context)))
+        
+        for source, discover in sources:
+            try:
+                urls = await discover()
+            except Exception as e:
+                print(f"Discovery from {source} failed: {e}")
+                continue
+            topics = [
+                url for url in dict.fromkeys(canonicalize_url(u) for u in urls)
+                if self._should_crawl(url)
+            ]
+            if len(topics) >= self.min_toc_topics:
+                print(f"Discovered {len(topics)} topics from the {source}")
+                self.topics_source = source
+                return topics
+        return []
+    
+    async def _discover_from_sitemap(self) -> List[str]:
+        urls = []
+        pending = [self.base_url + "sitemap.xml"]
+        while pending:
+            sitemap_url = pending.pop(0)
+            await self.rate_limiter.acquire(sitemap_url)
+            response = await self._http.get(sitemap_url)
+            if response.status_code != 200:
+                continue
+            root = ElementTree.fromstring(response.content)
+            locs = [elem.text.strip() for elem in root.iter() if elem.tag.endswith("loc") and elem.text]
+            # A sitemap index lists further sitemaps rather than pages
+            if root.tag.endswith("sitemapindex"):
+                pending.extend(locs)
+            else:
+                urls.extend(urljoin(sitemap_url, loc) for loc in locs)
+        return urls
+    
+    async def _discover_from_toc(self) -> List[str]:
+        toc_url = self.base_url + "help.html"
+        await self.rate_limiter.acquire(toc_url)
+        response = await self._http.get(toc_url)
+        if response.status_code != 200:
+            return []
+        soup = BeautifulSoup(response.text, "lxml")
+        for selector in TOC_SELECTORS:
+            container = soup.select_one(selector)
+            if container is not None:
+                links = self._extract_links(toc_url, container)
+                if len(links) >= self.min_toc_topics:
+                    return [toc_url] + links
+        return [toc_url] + self._extract_links(toc_url, soup)
+    
+    async def _discover_from_rendered_toc(self, context) -> List[str]:
+        """Navigation trees built by JavaScript only exist after rendering"""
+        toc_url = self.base_url + "help.html"
+        await self.rate_limiter.acquire(toc_url)
+        page = await context.new_page()
+        try:
+            await page.goto(toc_url, wait_until="networkidle", timeout=30000)
+            urls = [toc_url]
+            for frame in page.frames:
+                urls.extend(await frame.evaluate(EXTRACT_LINKS_JS))
+            return urls
+        finally:
+            await page.close()
+    
+    def _report_coverage(self):
+        crawled = {url_key(url, self.frontier.case_insensitive) for url in self.crawled_urls}
+        missing = [
+            url for url in self.topics
+            if url_key(url, self.frontier.case_insensitive) not in crawled
+        ]
+        covered = len(self.topics) - len(missing)
+        print(f"Coverage: {covered}/{len(self.topics)} topics from the {self.topics_source} "
+              f"({covered / len(self.topics):.1%})")
+        for url in missing[:10]:
+            print(f"  missing: {url}")
+        if len(missing) > 10:
+            print(f"  ... and {len(missing) - 10} more")
+        
+        with open(self.output_dir / "topics.json", 'w') as f:
+            json.dump({
+                "version": self.version,
+                "source": self.topics_source,
+                "topics": self.topics,
+                "missing": missing,
+            }, f, indent=2)
+    
+    def _print_fetch_stats(self):
+        parts = []
+        for path in ("static", "browser"):
+            count = self.fetch_stats[path]
+            seconds = self.fetch_seconds[path]
+            avg = seconds / count if count else 0.0
+            parts.append(f"{path}={count} ({seconds:.1f}s, avg {avg:.2f}s)")
+        print(f"Fetch paths: {', '.join(parts)}, static->browser fallbacks={self.fetch_stats['fallback']}")
+        if self.extract_count:
+            where = f"{self.parse_workers} parse workers" if self.parse_workers else "event loop"
+            print(f"Extraction ({self.parser}, {where}): {self.extract_count} pages, "
+                  f"avg {self.extract_seconds / self.extract_count * 1000:.1f}ms")
+        if self.render_seconds:
+            print(f"Render time ({self.render_mode} mode): "
+                  f"p50 {percentile(self.render_seconds, 50):.2f}s, "
+                  f"p95 {percentile(self.render_seconds, 95):.2f}s over {len(self.render_seconds)} pages"
+                  + (f", {self.session.blocked_requests} asset requests blocked"
+                     if self.render_mode == "fast" and self.session else ""))
+        if self.incremental:
+            print(f"Not modified (304): {self.fetch_stats['not_modified']}")
+    
+    def _load_previous_crawl(self):
+        manifest_file = self.output_dir / "manifest.json"
+        docs_file = docstore.find_store(self.output_dir)
+        if not manifest_file.exists() or docs_file is None:
+            print("No previous manifest found, running a full crawl")
+            return
+        
+        with open(manifest_file, 'r') as f:
+            self.previous_manifest = json.load(f).get("pages", {})
+        self.previous_documents = docstore.DocumentLookup(
+            docs_file, self.output_dir / "documents.previous.jsonl"
+        )
+        print(f"Loaded previous manifest with {len(self.previous_manifest)} pages")
+        
+        boilerplate_file = self.output_dir / "boilerplate.json"
+        if self.boilerplate is not None and boilerplate_file.exists():
+            with open(boilerplate_file, 'r') as f:
+                saved = json.load(f)
+            if saved.get("shingle_words") == boilerplate.SHINGLE_WORDS:
+                self.boilerplate.previous = set(saved["shingles"])
+    
+    def _write_checkpoint(self):
+        """Persist the frontier and visited set so an interrupted crawl can resume"""
+        # In-flight pages aren't in the store yet, so they go back on the frontier
+        frontier = list(self._in_flight.items()) + self.frontier.pending()
+        checkpoint = {
+            "version": self.version,
+            "visited": sorted(self.visited_urls - set(self._in_flight)),
+            "frontier": frontier,
+            "validators": self._validators,
+            "budget_exhausted": self._budget_exhausted,
+            "topics": self.topics,
+            "topics_source": self.topics_source,
+        }
+        tmp_file = self.checkpoint_file.with_suffix(".tmp")
+        with open(tmp_file, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_file, self.checkpoint_file)
+    
+    def _restore_checkpoint(self) -> List[Tuple[str, int]]:
+        """Rebuild crawl state from the partial store and last checkpoint, returns the frontier"""
+        checkpoint = {}
+        if self.checkpoint_file.exists():
+            with open(self.checkpoint_file, 'r') as f:
+                checkpoint = json.load(f)
+        self.visited_urls.update(checkpoint.get("visited", []))
+        self._validators.update(checkpoint.get("validators", {}))
+        self._budget_exhausted = checkpoint.get("budget_exhausted", False)
+        self.topics = checkpoint.get("topics", [])
+        self.topics_source = checkpoint.get("topics_source")
+        
+        # The store may be ahead of the checkpoint: trust it for what was crawled
+        docstore.DocumentWriter.repair(self.partial_file)
+        frontier = [tuple(entry) for entry in checkpoint.get("frontier", [])]
+        for doc in docstore.iter_documents(self.partial_file):
+            self.crawled_urls.add(doc["url"])
+            self.visited_urls.add(doc["url"])
+            # Depth of links found after the checkpoint is unknown; crawl them early
+            if not self.topics:
+                frontier.extend((link, 1) for link in doc.get("links", []))
+        
+        self.pages_crawled = self._pages_reserved = len(self.crawled_urls)
+        for url in self.visited_urls:
+            self.frontier.mark_seen(url)
+        frontier = [(url, depth) for url, depth in frontier if self._should_crawl(url)]
+        print(f"Resuming crawl: {self.pages_crawled} pages already stored, "
+              f"{len(frontier)} URLs on the frontier")
+        return frontier
+    
+    async def _worker(self, context, max_pages: int):
+        while True:
+            url, depth = await self.frontier.pop()
+            try:
+                # Only possible after release() re-admitted an identical spelling
                 if url in self.visited_urls:
                     continue
-                    
-                page_data = await self._crawl_page(context, url)
-                if page_data:
-                    self.documents.append(page_data)
-                    pages_crawled += 1
-                    
-                    # Debug: Show how many links were found
-                    num_links = len(page_data.get("links", []))
-                    if num_links == 0:
-                        print(f"Warning: No links found on {url}")
-                    elif pages_crawled <= 3:
-                        print(f"Found {num_links} links on {url}")
-                    
-                    if pages_crawled % 10 == 0:
-                        print(f"Crawled {pages_crawled} pages...")
-                    elif pages_crawled <= 5:
-                        print(f"Crawled page {pages_crawled}: {url}")
-                    
-                    # Add new URLs to queue
-                    for link in page_data.get("links", []):
-                        if self._should_crawl(link):
-                            queue.append(link)
+                if self._pages_reserved >= max_pages:
+                    self._budget_exhausted = True
+                    continue
+                # Claim the URL and a page slot before yielding to other workers
+                self.visited_urls.add(url)
+                self._in_flight[url] = depth
+                self._pages_reserved += 1
                 
-                # Rate limiting
-                await asyncio.sleep(0.5)
-            
-            await browser.close()
-            
-        # Save all documents
-        self._save_documents()
-        print(f"Crawl complete. {pages_crawled} pages saved to {self.output_dir}")
-        print(f"Total unique URLs visited: {len(self.visited_urls)}")
+                try:
+                    with METRICS.timer("crawl_rate_limit_wait_seconds"):
+                        await self.rate_limiter.acquire(url)
+                    with METRICS.timer("crawl_page_seconds"):
+                        page_data = await self._crawl_page(context, url)
+                except Exception as e:
+                    # One bad page must not take its worker down with it
+                    print(f"Unexpected error crawling {url}: {e!r}")
+                    page_data = None
+                finally:
+                    self._in_flight.pop(url, None)
+                if not page_data:
+                    METRICS.inc("crawl_pages_failed")
+                    self._pages_reserved -= 1
+                    self.frontier.release(url)
+                    continue
+                
+                self.store.append(page_data)
+                self.crawled_urls.add(url)
+                self.pages_crawled += 1
+                pages_crawled = self.pages_crawled
+                METRICS.inc("crawl_pages", status=page_data.get("status", "new"))
+                
+                # Debug: Show how many links were found
+                num_links = len(page_data.get("links", []))
+                if num_links == 0 and not self.topics:
+                    print(f"Warning: No links found on {url}")
+                elif pages_crawled <= 3:
+                    print(f"Found {num_links} links on {url}")
+                
+                if pages_crawled % 10 == 0:
+                    print(f"Crawled {pages_crawled} pages...")
+                elif pages_crawled <= 5:
+                    print(f"Crawled page {pages_crawled}: {url}")
+                
+                # Add new URLs to the frontier, shallowest pages first.
+                # A discovered topic list is already complete.
+                for link in page_data.get("links", []) if not self.topics else []:
+                    if self._should_crawl(link):
+                        self.frontier.push(link, depth + 1)
+                    else:
+                        self.out_of_scope += 1
+                
+                if pages_crawled % self.checkpoint_every == 0:
+                    self._write_checkpoint()
+            finally:
+                self.frontier.task_done()
     
-    async def _crawl_page(self, context, url: str) -> Dict:
+    async def _crawl_page(self, context, url: str) -> Optional[Dict]:
         self.visited_urls.add(url)
         
+        response = None
+        if self.previous_documents is not None and url in self.previous_documents:
+            response = await self._conditional_get(url)
+            if response is not None and response.status_code == 304:
+                self.fetch_stats["not_modified"] += 1
+                METRICS.inc("crawl_fetch_not_modified")
+                self._validators[url] = self.previous_manifest.get(url, {})
+                return {**self.previous_documents.get(url), "status": "unchanged"}
+            if response is not None and response.status_code in GONE_STATUSES:
+                self.gone_urls.add(url)
+                return None
+            # Only a full 200 can be reused by the static path; anything else refetches
+            if response is not None and (self.fetch_mode == "browser" or response.status_code != 200):
+                await self.rate_limiter.acquire(url)
+        
+        if self.fetch_mode != "browser":
+            started = time.monotonic()
+            page_data = await self._crawl_page_static(url, response)
+            self.fetch_seconds["static"] += time.monotonic() - started
+            # A page the server says is gone won't render in a browser either
+            if self.fetch_mode == "static" or url in self.gone_urls or (
+                page_data and len(page_data["text"]) >= self.min_static_chars
+            ):
+                if page_data:
+                    self.fetch_stats["static"] += 1
+                return page_data
+            # Server response has no usable content, so it's rendered client-side
+            self.fetch_stats["fallback"] += 1
+            METRICS.inc("crawl_fetch_fallbacks")
+            await self.rate_limiter.acquire(url)
+        
+        started = time.monotonic()
+        page_data = await self._crawl_page_browser(context, url)
+        self.fetch_seconds["browser"] += time.monotonic() - started
+        if page_data:
+            self.fetch_stats["browser"] += 1
+        return page_data
+    
+    async def _conditional_get(self, url: str) -> Optional[httpx.Response]:
+        """GET with the validators from the previous run, so unchanged pages return 304"""
+        previous = self.previous_manifest.get(url, {})
+        headers = {}
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+        if not headers:
+            return None
+        try:
+            with METRICS.timer("crawl_fetch_seconds", path="conditional"):
+                response = await self._http.get(url, headers=headers)
+            METRICS.inc("crawl_bytes_received", len(response.content), path="conditional")
+            return response
+        except Exception as e:
+            METRICS.inc("crawl_fetch_errors", path="conditional")
+            print(f"Conditional request error for {url}: {e}")
+            return None
+    
+    def _record_validators(self, url: str, headers):
+        self._validators[url] = {
+            "etag": headers.get("etag"),
+            "last_modified": headers.get("last-modified"),
+        }
+    
+    def _document_status(self, page_data: Dict) -> str:
+        url = page_data["url"]
+        if self.previous_documents is None or url not in self.previous_documents:
+            return "new"
+        previous_hash = self.previous_manifest.get(url, {}).get("hash")
+        return "unchanged" if previous_hash == page_data["hash"] else "changed"
+    
+    async def _crawl_page_static(self, url: str, response: Optional[httpx.Response] = None) -> Optional[Dict]:
+        """Fetch the raw server response and extract content without a browser"""
         try:
-            page = await context.new_page()
-            await page.goto(url, wait_until="networkidle", timeout=30000)
+            # A full 200 from the conditional request can be reused as-is
+            if response is None or response.status_code != 200:
+                with METRICS.timer("crawl_fetch_seconds", path="static"):
+                    response = await self._http.get(url)
+                METRICS.inc("crawl_bytes_received", len(response.content), path="static")
+            if response.status_code != 200:
+                METRICS.inc("crawl_fetch_errors", path="static")
+                if response.status_code in GONE_STATUSES:
+                    self.gone_urls.add(url)
+                print(f"Static fetch of {url} returned {response.status_code}")
+                return None
             
+            self._record_validators(url, response.headers)
+            return await self._extract(
+                extract.extract_static, url, response.text, self.version, self.base_url, self.parser,
+            )
+        except Exception as e:
+            METRICS.inc("crawl_fetch_errors", path="static")
+            print(f"Static fetch error for {url}: {e}")
+            return None
+    
+    async def _render_fast(self, page, url: str):
+        """Load the document and return as soon as the topic content is ready"""
+        with METRICS.timer("crawl_navigation_seconds", render_mode="fast"):
+            response = await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+        try:
+            with METRICS.timer("crawl_settle_seconds", render_mode="fast"):
+                await page.wait_for_function(
+                    CONTENT_READY_JS,
+                    arg=[CONTENT_SELECTORS, self.ready_min_chars, self.settle_ms],
+                    timeout=self.ready_timeout * 1000,
+                    polling=100,
+                )
+        except PlaywrightTimeoutError:
+            # Extract whatever has rendered so far
+            METRICS.inc("crawl_ready_timeouts")
+        return response
+    
+    async def _render_full(self, page, url: str):
+        with METRICS.timer("crawl_navigation_seconds", render_mode="full"):
+            response = await page.goto(url, wait_until="networkidle", timeout=30000)
+        
+        with METRICS.timer("crawl_settle_seconds", render_mode="full"):
             # Wait for JavaScript content to load
             try:
                 # Wait for the actual content frame/iframe if it exists
@@ -93,17 +819,25 @@ class LightweightCrawler:
             # Always wait a bit for dynamic content
             await asyncio.sleep(3)
             
-            # Check if content is in an iframe
-            frames = page.frames
-            content_frame = None
-            for frame in frames:
-                if 'content' in frame.name or 'main' in frame.name:
-                    content_frame = frame
-                    break
-            
             # Try to trigger any lazy-loaded content
             await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
             await asyncio.sleep(1)
+        return response
+    
+    async def _crawl_page_browser(self, context, url: str) -> Optional[Dict]:
+        started = time.monotonic()
+        page = await self._pages.acquire() if self._pages else await context.new_page()
+        broken = False
+        try:
+            if self.render_mode == "fast":
+                response = await self._render_fast(page, url)
+            else:
+                response = await self._render_full(page, url)
+            if response and response.status in GONE_STATUSES:
+                self.gone_urls.add(url)
+                return None
+            if response:
+                self._record_validators(url, response.headers)
             
             # Check for iframes and switch to content frame if exists
             frames = page.frames
@@ -123,20 +857,8 @@ class LightweightCrawler:
             # Try to get content using JavaScript evaluation
             try:
                 js_content = await content_page.evaluate("""
-                    () => {
+                    (selectors) => {
                         // Try multiple selectors for content
-                        const selectors = [
-                            '.topic-content',
-                            '.main-content', 
-                            '#content',
-                            'main',
-                            'article',
-                            '.content-wrapper',
-                            '[role="main"]',
-                            '.body-content',
-                            '.doc-content'
-                        ];
-                        
                         for (const selector of selectors) {
                             const elem = document.querySelector(selector);
                             if (elem && elem.textContent.trim().length > 100) {
@@ -153,119 +875,267 @@ class LightweightCrawler:
                             html: document.body.innerHTML
                         };
                     }
-                """)
+                """, CONTENT_SELECTORS)
                 
                 if js_content and js_content.get('text', '').strip():
-                    text = self._clean_text(js_content['text'])
+                    text = js_content['text']
                     html = js_content.get('html', '')
-                    soup = BeautifulSoup(html, "lxml")
                 else:
+                    text = None
                     html = await page.content()
-                    soup = BeautifulSoup(html, "lxml")
-                    text = self._clean_text(soup.get_text())
             except:
+                text = None
                 html = await page.content()
-                soup = BeautifulSoup(html, "lxml")
-                text = self._clean_text(soup.get_text())
             
             # Extract title
             title = await page.title() or ""
             
-            # Extract code blocks from soup
-            code_blocks = [
-                code.get_text(strip=True) 
-                for code in soup.find_all(["pre", "code"])
-                if code.get_text(strip=True)
-            ]
-            
-            # Extract links from both content and JavaScript-generated navigation
-            links = []
-            # First try to get all links on the page
-            all_links = soup.find_all("a", href=True)
-            for a in all_links:
-                href = urljoin(url, a["href"])
-                if self._is_same_host(href, self.base_url) and href.endswith('.html'):
-                    links.append(href.split("#")[0])
-            
-            # Also try to extract links using JavaScript evaluation
+            # Links from JavaScript-generated navigation, added to those in the content
+            js_links = []
             try:
-                js_links = await page.evaluate("""
-                    () => {
-                        const links = [];
-                        // Get all anchor tags
-                        document.querySelectorAll('a[href]').forEach(a => {
-                            if (a.href && a.href.includes('.html')) {
-                                links.push(a.href);
-                            }
-                        });
-                        // Also check for dynamically loaded navigation items
-                        document.querySelectorAll('[onclick*=".html"]').forEach(el => {
-                            const match = el.getAttribute('onclick').match(/['"]([^'"]*\.html)['"]/);
-                            if (match) {
-                                links.push(new URL(match[1], window.location.href).href);
-                            }
-                        });
-                        return links;
-                    }
-                """)
-                for link in js_links:
-                    if self._is_same_host(link, self.base_url):
-                        links.append(link.split("#")[0])
+                js_links = await page.evaluate(EXTRACT_LINKS_JS)
             except Exception as e:
                 print(f"Error extracting JS links: {e}")
+            self.render_seconds.append(time.monotonic() - started)
+            METRICS.observe("crawl_render_seconds", self.render_seconds[-1], render_mode=self.render_mode)
             
-            await page.close()
-            
-            return {
-                "url": url,
-                "version": self.version,
-                "title": title,
-                "text": text,
-                "code_blocks": code_blocks[:5],  # Limit code blocks
-                "links": list(set(links))[:20],  # Limit links
-                "hash": hashlib.sha256(text.encode()).hexdigest()[:16],
-            }
+            return await self._extract(
+                extract.extract_rendered, url, self.version, title, text, html,
+                self.base_url, js_links, self.parser,
+            )
             
         except Exception as e:
+            broken = True
+            METRICS.inc("crawl_fetch_errors", path="browser")
             print(f"Error crawling {url}: {e}")
             return None
+        finally:
+            if self._pages:
+                await self._pages.release(page, broken=broken)
+            else:
+                await page.close()
+    
+    def _extract_links(self, url: str, soup) -> List[str]:
+        hrefs = [a["href"] for a in soup.find_all("a", href=True)]
+        return extract.extract_links(url, hrefs, self.base_url)
     
-    def _clean_text(self, text: str) -> str:
-        text = re.sub(r'\s+', ' ', text)
-        text = re.sub(r'[\u200b\u00a0]', ' ', text)
-        return text.strip()[:5000]  # Limit text length
+    async def _extract(self, func, *args) -> Dict:
+        """Run an extraction function in the parse pool, or inline without one"""
+        started = time.monotonic()
+        try:
+            if self._parse_pool is None:
+                return func(*args)
+            return await asyncio.get_running_loop().run_in_executor(self._parse_pool, func, *args)
+        finally:
+            elapsed = time.monotonic() - started
+            self.extract_seconds += elapsed
+            self.extract_count += 1
+            METRICS.observe("crawl_extract_seconds", elapsed, parser=self.parser)
     
     def _should_crawl(self, url: str) -> bool:
-        if url in self.visited_urls:
+        """Whether a URL is in scope; duplicates are filtered by the frontier"""
+        key = url_key(url)
+        if not key.startswith(url_key(self.base_url) + "/"):
             return False
-        if not url.startswith(self.base_url):
-            return False
-        if any(url.endswith(ext) for ext in ['.pdf', '.jpg', '.png', '.zip']):
+        if any(key.endswith(ext) for ext in ['.pdf', '.jpg', '.png', '.zip']):
             return False
         return True
     
-    def _is_same_host(self, url: str, base: str) -> bool:
-        return urlparse(url).netloc == urlparse(base).netloc
-    
     def _save_documents(self):
-        output_file = self.output_dir / "documents.json"
-        with open(output_file, 'w') as f:
-            json.dump(self.documents, f, indent=2)
-        print(f"Saved {len(self.documents)} documents to {output_file}")
+        if self.previous_documents is not None:
+            self._add_missing_previous_documents()
+        self.store.close()
+        
+        # Pages reused from the previous run were stripped when it finished
+        def fresh_texts():
+            for doc in docstore.iter_documents(self.partial_file):
+                if doc.get("status") != "removed":
+                    yield None if "status" in doc else doc["text"]
+        
+        if self.boilerplate is not None:
+            self.boilerplate.fit(fresh_texts)
+        
+        counts = {status: 0 for status in DOCUMENT_STATUSES}
+        pages = {}
+        
+        def finalize(doc):
+            if "status" in doc:
+                return doc
+            blocks = doc.get("blocks") or [{"type": "paragraph", "text": doc["text"]}]
+            if self.boilerplate is not None:
+                blocks = self.boilerplate.strip_blocks(blocks)
+            blocks = extract.limit_blocks(blocks, extract.TEXT_LIMIT)
+            text = extract.blocks_text(blocks)
+            code_blocks, code_spans = extract.code_block_spans(blocks)
+            doc = {**doc, "text": text, "blocks": blocks,
+                   "code_blocks": code_blocks, "code_spans": code_spans,
+                   "hash": hashlib.sha256(text.encode()).hexdigest()[:16]}
+            if self.incremental:
+                doc["status"] = self._document_status(doc)
+            return doc
+        
+        def tally(documents):
+            for doc in map(finalize, documents):
+                status = doc.get("status", "new")
+                counts[status] += 1
+                if status != "removed":
+                    validators = self._validators.get(doc["url"]) or self.previous_manifest.get(doc["url"], {})
+                    pages[doc["url"]] = {
+                        "etag": validators.get("etag"),
+                        "last_modified": validators.get("last_modified"),
+                        "hash": doc["hash"],
+                    }
+                yield doc
+        
+        # Compress the append-only partial file into the final store
+        output_file = docstore.store_path(self.output_dir, self.store_format)
+        count = docstore.write_store(tally(docstore.iter_documents(self.partial_file)), output_file)
+        docstore.remove_other_stores(self.output_dir, keep=output_file)
+        self.partial_file.unlink()
+        self.checkpoint_file.unlink(missing_ok=True)
+        if self.previous_documents is not None:
+            self.previous_documents.close()
+        print(f"Saved {count} documents to {output_file}")
+        if self.boilerplate is not None:
+            print(f"Boilerplate: {self.boilerplate.stats()}")
+            self._save_boilerplate()
+        
+        if self.incremental:
+            print("Delta: " + ", ".join(f"{status}={count}" for status, count in counts.items()))
+        
+        manifest_file = self.output_dir / "manifest.json"
+        with open(manifest_file, 'w') as f:
+            json.dump({"version": self.version, "pages": pages}, f, indent=2)
+        print(f"Saved manifest with {len(pages)} pages to {manifest_file}")
+    
+    def _save_boilerplate(self):
+        with open(self.output_dir / "boilerplate.json", 'w') as f:
+            json.dump({
+                "version": self.version,
+                "shingle_words": boilerplate.SHINGLE_WORDS,
+                "shingles": sorted(self.boilerplate.boilerplate),
+            }, f)
+    
+    def _add_missing_previous_documents(self):
+        """Account for pages from the previous run that this run did not produce"""
+        missing = [url for url in self.previous_documents.urls() if url not in self.crawled_urls]
+        topics = {url_key(url, self.frontier.case_insensitive) for url in self.topics}
+        removed = 0
+        for url in missing:
+            # Only proof the page is gone removes it from the index. A failed fetch
+            # (timeout, 5xx, empty render) or an unreached page keeps its old record.
+            if url in self.gone_urls or (topics and url_key(url, self.frontier.case_insensitive) not in topics):
+                previous = self.previous_documents.get(url)
+                self.store.append({
+                    "url": url,
+                    "version": previous.get("version", self.version),
+                    "title": previous.get("title", ""),
+                    "hash": previous.get("hash"),
+                    "status": "removed",
+                })
+                removed += 1
+            else:
+                self.store.append({**self.previous_documents.get(url), "status": "unchanged"})
+        if len(missing) > removed:
+            print(f"Carried forward {len(missing) - removed} previous pages that failed or were not "
+                  f"reached" + (" (page budget reached)" if self._budget_exhausted else ""))
 
 async def main():
     parser = argparse.ArgumentParser(description='Crawl grandMA3 documentation')
     parser.add_argument('--version', default='2.3', help='grandMA3 version')
+    parser.add_argument('--versions',
+                        help='Comma-separated versions crawled concurrently with one browser and '
+                             'connection pool (overrides --version)')
     parser.add_argument('--max-pages', type=int, default=100, help='Maximum pages to crawl')
     parser.add_argument('--output', default='./data', help='Output directory')
+    parser.add_argument('--concurrency', type=int, default=4, help='Number of concurrent page workers')
+    parser.add_argument('--rps', type=float, default=2.0, help='Maximum requests per second per host')
+    parser.add_argument('--burst', type=float, default=1.0, help='Token bucket capacity per host')
+    parser.add_argument('--fetch-mode', choices=FETCH_MODES, default='auto',
+                        help='auto: static HTTP first, browser only for JS-rendered pages')
+    parser.add_argument('--min-static-chars', type=int, default=500,
+                        help='Static extractions shorter than this fall back to the browser')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Send conditional requests and reuse unchanged pages from the previous run')
+    parser.add_argument('--store-format', choices=docstore.STORE_FORMATS, default='jsonl.gz',
+                        help='Format of the saved document store')
+    parser.add_argument('--checkpoint-every', type=int, default=25,
+                        help='Write a resumable checkpoint every N pages')
+    parser.add_argument('--case-sensitive-urls', action='store_true',
+                        help='Treat URLs differing only in case as different pages')
+    parser.add_argument('--discovery', choices=DISCOVERY_MODES, default='auto',
+                        help='toc: crawl exactly the sitemap/TOC topic list; links: follow page links; '
+                             'auto: TOC when one is found')
+    parser.add_argument('--min-toc-topics', type=int, default=10,
+                        help='Fewest topics for a discovered TOC to be trusted')
+    parser.add_argument('--render-mode', choices=RENDER_MODES, default='fast',
+                        help='fast: block assets, reuse pages and wait for content; full: fixed waits')
+    parser.add_argument('--ready-min-chars', type=int, default=200,
+                        help='Content length at which a rendered page counts as ready')
+    parser.add_argument('--ready-timeout', type=float, default=10.0,
+                        help='Longest wait in seconds for rendered content to become ready')
+    parser.add_argument('--parse-workers', type=int, default=DEFAULT_PARSE_WORKERS,
+                        help='Processes for HTML parsing and cleaning (0 parses on the event loop)')
+    parser.add_argument('--parser', choices=extract.PARSERS, default='lxml',
+                        help='HTML parser backend; selectolax is faster but optional')
+    parser.add_argument('--boilerplate-threshold', type=float, default=0.5,
+                        help='Strip text shared by more than this share of pages (0 keeps it)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue an interrupted crawl from its checkpoint')
+    parser.add_argument('--metrics-file',
+                        help='Write per-stage timings and counters here (JSON, or Prometheus text for .prom)')
     
     args = parser.parse_args()
     
-    crawler = LightweightCrawler(
-        version=args.version,
-        output_dir=args.output
-    )
-    await crawler.crawl(max_pages=args.max_pages)
+    versions = [v.strip() for v in args.versions.split(",") if v.strip()] if args.versions else [args.version]
+    # Every version lives on the same host, so they share its request budget
+    rate_limiter = HostRateLimiter(rps=args.rps, burst=args.burst)
+    crawlers = [
+        LightweightCrawler(
+            version=version,
+            output_dir=args.output,
+            rate_limiter=rate_limiter,
+            fetch_mode=args.fetch_mode,
+            min_static_chars=args.min_static_chars,
+            incremental=args.incremental,
+            store_format=args.store_format,
+            checkpoint_every=args.checkpoint_every,
+            case_insensitive_urls=not args.case_sensitive_urls,
+            discovery=args.discovery,
+            min_toc_topics=args.min_toc_topics,
+            render_mode=args.render_mode,
+            ready_min_chars=args.ready_min_chars,
+            ready_timeout=args.ready_timeout,
+            parse_workers=args.parse_workers,
+            parser=args.parser,
+            boilerplate_threshold=args.boilerplate_threshold,
+        )
+        for version in dict.fromkeys(versions)
+    ]
+    METRICS.labels.update(script="crawl", versions=",".join(c.version for c in crawlers))
+    try:
+        await crawl_versions(crawlers, args)
+    finally:
+        METRICS.print_summary()
+        if args.metrics_file:
+            METRICS.write(args.metrics_file)
+
+async def crawl_versions(crawlers: List[LightweightCrawler], args):
+    if len(crawlers) == 1:
+        await crawlers[0].crawl(max_pages=args.max_pages, concurrency=args.concurrency, resume=args.resume)
+        return
+    
+    start = time.monotonic()
+    async with FetchSession(args.fetch_mode, args.render_mode, args.concurrency * len(crawlers),
+                            args.parse_workers) as session:
+        await asyncio.gather(*(
+            crawler.crawl(max_pages=args.max_pages, concurrency=args.concurrency,
+                          resume=args.resume, session=session)
+            for crawler in crawlers
+        ))
+    print(f"Crawled {len(crawlers)} versions ({', '.join(c.version for c in crawlers)}) "
+          f"in {time.monotonic() - start:.1f}s, "
+          f"{sum(c.pages_crawled for c in crawlers)} pages in total")
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate chunk detection
+MinHash signatures over word shingles, LSH banding to find candidate pairs and
+union-find to collapse each cluster onto its first chunk
+"""
+
+import time
+import zlib
+from array import array
+from typing import Dict, List, Tuple
+
+SHINGLE_WORDS = 5
+NUM_BINS = 128
+# 16 bands of 8 rows put the LSH candidate threshold near 0.7; candidates are
+# then checked against the configured similarity
+BANDS = 16
+ROWS = NUM_BINS // BANDS
+_EMPTY = 0xFFFFFFFF
+
+
+def minhash(text: str) -> array:
+    """One-permutation MinHash signature of the text's word shingles
+
+    Each shingle hash is sent to one of NUM_BINS bins, which keeps its
+    minimum. Empty bins borrow from the next non-empty bin so short texts
+    still get a full signature.
+    """
+    ids = [zlib.crc32(word.encode()) for word in text.lower().split()]
+    if len(ids) < SHINGLE_WORDS:
+        shingles = [hash(tuple(ids))]
+    else:
+        # A tuple of ints hashes deterministically
+        shingles = [hash(tuple(ids[i:i + SHINGLE_WORDS])) for i in range(len(ids) - SHINGLE_WORDS + 1)]
+
+    signature = array("I", [_EMPTY]) * NUM_BINS
+    for shingle in shingles:
+        shingle &= 0xFFFFFFFFFFFFFFFF
+        bin_index = shingle % NUM_BINS
+        value = (shingle >> 7) & 0xFFFFFFFE
+        if value < signature[bin_index]:
+            signature[bin_index] = value
+
+    filled = [i for i in range(NUM_BINS) if signature[i] != _EMPTY]
+    if len(filled) < NUM_BINS:
+        # Rotation densification, offset per hop so borrowed bins stay distinguishable
+        for i in range(NUM_BINS):
+            hops = 1
+            while signature[i] == _EMPTY:
+                source = signature[(i + hops) % NUM_BINS]
+                if source != _EMPTY:
+                    signature[i] = (source + hops) | 1
+                hops += 1
+    return signature
+
+
+def similarity(a: array, b: array) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_BINS
+
+
+class NearDuplicateIndex:
+    """Collects chunk signatures and clusters those at or above `threshold`
+
+    Only chunks sharing an LSH band are compared, so the work grows with the
+    number of near-duplicates rather than with the square of the corpus.
+    """
+
+    def __init__(self, threshold: float = 0.9):
+        self.threshold = threshold
+        self.ids: List[str] = []
+        self.urls: List[str] = []
+        self._signatures = array("I")
+        self._buckets: List[Dict[Tuple[int, ...], int]] = [{} for _ in range(BANDS)]
+        self._parent: List[int] = []
+        self.candidate_pairs = 0
+        self.seconds = 0.0
+
+    def add(self, chunk_id: str, url: str, text: str):
+        started = time.monotonic()
+        index = len(self.ids)
+        signature = minhash(text)
+        self.ids.append(chunk_id)
+        self.urls.append(url)
+        self._signatures.extend(signature)
+        self._parent.append(index)
+
+        checked = set()
+        for band, buckets in enumerate(self._buckets):
+            key = tuple(signature[band * ROWS:(band + 1) * ROWS])
+            first = buckets.setdefault(key, index)
+            if first == index or first in checked:
+                continue
+            checked.add(first)
+            self.candidate_pairs += 1
+            if similarity(signature, self._signature(first)) >= self.threshold:
+                self._union(first, index)
+        self.seconds += time.monotonic() - started
+
+    def _signature(self, index: int) -> array:
+        return self._signatures[index * NUM_BINS:(index + 1) * NUM_BINS]
+
+    def _find(self, index: int) -> int:
+        while self._parent[index] != index:
+            self._parent[index] = self._parent[self._parent[index]]
+            index = self._parent[index]
+        return index
+
+    def _union(self, a: int, b: int):
+        root_a, root_b = self._find(a), self._find(b)
+        # The earliest chunk in corpus order stays canonical
+        if root_a != root_b:
+            self._parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    def clusters(self) -> Tuple[Dict[str, str], Dict[str, List[str]]]:
+        """Map each duplicate to its canonical chunk, and each canonical to all source URLs"""
+        duplicates: Dict[str, str] = {}
+        sources: Dict[str, List[str]] = {}
+        for index, chunk_id in enumerate(self.ids):
+            root = self._find(index)
+            if root == index:
+                continue
+            canonical = self.ids[root]
+            duplicates[chunk_id] = canonical
+            urls = sources.setdefault(canonical, [self.urls[root]])
+            if self.urls[index] not in urls:
+                urls.append(self.urls[index])
+        return duplicates, sources
+
+    def stats(self, duplicates: Dict[str, str], sources: Dict[str, List[str]]) -> str:
+        return (f"{len(duplicates)} of {len(self.ids)} chunks collapsed into {len(sources)} clusters "
+                f"(threshold {self.threshold}, {self.candidate_pairs} candidate pairs checked, "
+                f"{self.seconds:.1f}s)")
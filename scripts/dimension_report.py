@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Recall-versus-size report for shortened and quantized embeddings
+Compares top-k retrieval at reduced dimensions and int8/binary storage with
+the full 1536-dimension float32 baseline, offline, from an indexer export
+"""
+
+import os
+import gzip
+import json
+import argparse
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Set
+
+import numpy as np
+
+from backup_vector import MANIFEST_FILE, QUANTIZATIONS, RECORDS_FILE, BackupVectors
+from embedding_cache import EmbeddingCache
+from local_index import BLOCK_ROWS, embed_query, normalize
+
+GOLDEN_QUERIES = Path(__file__).resolve().parent.parent / "evaluation" / "golden-queries.json"
+
+
+def shorten(vectors: np.ndarray, dimension: int) -> np.ndarray:
+    """What the API returns for `dimensions=dimension`: the leading values, renormalized
+
+    text-embedding-3 models are trained so that a prefix of the embedding is
+    itself an embedding, so one full-size export covers every smaller size.
+    """
+    return normalize(np.asarray(vectors[..., :dimension], dtype=np.float32))
+
+
+def simulate_storage(vectors: np.ndarray, quantization: str) -> np.ndarray:
+    """Rows as they score after a round trip through BackupWriter's quantization"""
+    if quantization == "int8":
+        scales = np.maximum(np.abs(vectors).max(axis=1, keepdims=True), 1e-12) / 127
+        return np.rint(vectors / scales) * scales
+    if quantization == "binary":
+        return np.where(vectors > 0, 1.0, -1.0).astype(np.float32) / np.float32(np.sqrt(vectors.shape[1]))
+    return vectors
+
+
+def bytes_per_vector(dimension: int, quantization: str) -> int:
+    if quantization == "int8":
+        return dimension + 4
+    if quantization == "binary":
+        return (dimension + 7) // 8
+    return dimension * 4
+
+
+def top_k(corpus: BackupVectors, queries: np.ndarray, k: int, dimension: int, quantization: str,
+          allowed: np.ndarray, exclude: np.ndarray) -> np.ndarray:
+    """Row IDs of each query's k best rows, scanning the corpus in blocks
+
+    `allowed` is a (queries, rows) mask of the rows each query may return;
+    `exclude` is the row each query must not match (-1 for none).
+    """
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+    query_vectors = shorten(queries, dimension)
+    for start in range(0, len(corpus), BLOCK_ROWS):
+        block = simulate_storage(shorten(corpus[start:start + BLOCK_ROWS], dimension), quantization)
+        scores = query_vectors @ block.T
+        rows = np.arange(start, start + len(block))
+        scores[~allowed[:, start:start + len(block)]] = -np.inf
+        scores[rows[None, :] == exclude[:, None]] = -np.inf
+        merged_scores = np.concatenate([best_scores, scores], axis=1)
+        merged_rows = np.concatenate([best_rows, np.broadcast_to(rows, scores.shape)], axis=1)
+        keep = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+        best_rows = np.take_along_axis(merged_rows, keep, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    best_rows = np.take_along_axis(best_rows, order, axis=1)
+    # Queries with fewer than k allowed rows are padded with -1
+    best_rows[np.take_along_axis(best_scores, order, axis=1) == -np.inf] = -1
+    return best_rows
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    """Mean share of the baseline's results found; queries with no baseline results don't count"""
+    scores = [len(set(f) & expected) / len(expected)
+              for f, t in zip(found, truth) if (expected := set(t) - {-1})]
+    return float(np.mean(scores)) if scores else 1.0
+
+
+def golden_query_vectors(queries: List[Dict], dimension: int, model: str,
+                         cache: Optional[EmbeddingCache], allow_api: bool) -> List[Optional[np.ndarray]]:
+    """Baseline embeddings of the golden queries, from the cache or the API"""
+    texts = [q["query"] for q in queries]
+    vectors = cache.get_many(model, dimension, texts) if cache else [None] * len(texts)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing and allow_api:
+        created = [embed_query(texts[i], dimension, model) for i in missing]
+        for i, vector in zip(missing, created):
+            vectors[i] = vector
+        if cache:
+            cache.put_many(model, dimension, [texts[i] for i in missing], created)
+    elif missing:
+        print(f"{len(missing)} golden queries are not in the embedding cache; skipping them")
+    return [np.asarray(vector, dtype=np.float32) if vector is not None else None for vector in vectors]
+
+
+def load_records(source: Path, keep: Optional[Set[int]] = None) -> List[Dict]:
+    """Version and text of each row; texts only for rows in `keep`"""
+    records = []
+    with gzip.open(source / RECORDS_FILE, "rt", encoding="utf-8") as f:
+        for row, line in enumerate(f):
+            metadata = json.loads(line).get("metadata") or {}
+            records.append({"version": metadata.get("version", ""),
+                            "text": metadata.get("text", "") if keep is None or row in keep else ""})
+    return records
+
+
+def keyword_coverage(golden: List[Dict], results: np.ndarray, texts: Dict[int, str], depth: int = 5) -> float:
+    """Share of expected keywords found in each golden query's top results"""
+    coverage = []
+    for q, rows in zip(golden, results):
+        text = " ".join(texts.get(int(row), "") for row in rows[:depth] if row >= 0).lower()
+        coverage.append(sum(keyword.lower() in text for keyword in q["expected_keywords"])
+                        / len(q["expected_keywords"]))
+    return float(np.mean(coverage)) if coverage else 0.0
+
+
+def run_report(source: Path, golden_path: Optional[Path], dimensions: Sequence[int],
+               quantizations: Sequence[str], k: int = 10, corpus_queries: int = 500,
+               cache: Optional[EmbeddingCache] = None, allow_api: bool = True, seed: int = 0) -> Dict:
+    corpus = BackupVectors(source)
+    if corpus.quantization != "float32":
+        raise ValueError(f"The baseline must be a float32 export, {source} is {corpus.quantization}")
+    baseline_dimension = corpus.dimension
+    dimensions = sorted(d for d in dimensions if d <= baseline_dimension)
+    with open(source / MANIFEST_FILE, 'r') as f:
+        model = json.load(f).get("model", "text-embedding-3-small")
+    records = load_records(source, keep=set())
+    versions = np.array([record["version"] for record in records])
+    rows = len(corpus)
+    print(f"Baseline: {rows} vectors of {baseline_dimension} dimensions from {source}")
+
+    # Corpus queries: stored vectors searching for their neighbours, excluding themselves
+    rng = np.random.default_rng(seed)
+    sampled = np.sort(rng.choice(rows, size=min(corpus_queries, rows), replace=False))
+    query_sets = {"corpus": {
+        "vectors": np.asarray(corpus[sampled], dtype=np.float32),
+        "allowed": np.ones((len(sampled), rows), dtype=bool),
+        "exclude": sampled,
+    }}
+
+    golden: List[Dict] = []
+    if golden_path:
+        with open(golden_path, 'r') as f:
+            golden = [q for q in json.load(f)["queries"] if not q.get("should_refuse")]
+        vectors = golden_query_vectors(golden, baseline_dimension, model, cache, allow_api)
+        golden = [q for q, vector in zip(golden, vectors) if vector is not None]
+        if not golden:
+            raise ValueError(f"No golden queries could be used from {golden_path}")
+        query_sets["golden"] = {
+            "vectors": np.stack([vector for vector in vectors if vector is not None]),
+            # A golden query with a version only searches that version's chunks
+            "allowed": np.stack([versions == q["version"] if q.get("version") else np.ones(rows, bool)
+                                 for q in golden]),
+            "exclude": np.full(len(golden), -1),
+        }
+
+    truth = {name: top_k(corpus, queries["vectors"], k, baseline_dimension, "float32",
+                         queries["allowed"], queries["exclude"])
+             for name, queries in query_sets.items()}
+    texts: Dict[int, str] = {}
+    results = []
+    golden_results = {}
+    for dimension in dimensions:
+        for quantization in quantizations:
+            started = time.monotonic()
+            entry = {
+                "dimension": dimension,
+                "quantization": quantization,
+                "bytes_per_vector": bytes_per_vector(dimension, quantization),
+                "corpus_mb": rows * bytes_per_vector(dimension, quantization) / 1e6,
+            }
+            for name, queries in query_sets.items():
+                found = top_k(corpus, queries["vectors"], k, dimension, quantization,
+                              queries["allowed"], queries["exclude"])
+                entry[f"{name}_recall"] = recall(found, truth[name])
+                if name == "golden":
+                    golden_results[(dimension, quantization)] = found
+            entry["seconds"] = time.monotonic() - started
+            results.append(entry)
+
+    if golden:
+        needed = {int(row) for found in [truth["golden"], *golden_results.values()]
+                  for row in found[:, :5].ravel() if row >= 0}
+        texts = {row: record["text"] for row, record in enumerate(load_records(source, keep=needed))
+                 if row in needed}
+        baseline_coverage = keyword_coverage(golden, truth["golden"], texts)
+        for entry in results:
+            entry["golden_keyword_coverage"] = keyword_coverage(
+                golden, golden_results[(entry["dimension"], entry["quantization"])], texts)
+    else:
+        baseline_coverage = None
+
+    report = {
+        "source": str(source),
+        "model": model,
+        "baseline_dimension": baseline_dimension,
+        "vectors": rows,
+        "k": k,
+        "corpus_queries": len(sampled),
+        "golden_queries": len(golden),
+        "baseline_keyword_coverage": baseline_coverage,
+        "results": results,
+    }
+    print_report(report)
+    return report
+
+
+def print_report(report: Dict):
+    k = report["k"]
+    golden = report["golden_queries"]
+    print(f"recall@{k} against {report['baseline_dimension']}-dim float32 "
+          f"({report['corpus_queries']} corpus queries, {golden} golden queries)")
+    header = f"{'dims':>5} {'storage':>8} {'bytes/vec':>9} {'corpus MB':>9} {'corpus':>7}"
+    if golden:
+        header += f" {'golden':>7} {'keywords':>8}"
+    print(header)
+    for entry in report["results"]:
+        line = (f"{entry['dimension']:>5} {entry['quantization']:>8} {entry['bytes_per_vector']:>9} "
+                f"{entry['corpus_mb']:>9.1f} {entry['corpus_recall']:>7.3f}")
+        if golden:
+            line += f" {entry['golden_recall']:>7.3f} {entry['golden_keyword_coverage']:>8.1%}"
+        print(line)
+    if report["baseline_keyword_coverage"] is not None:
+        print(f"Baseline keyword coverage in the top 5: {report['baseline_keyword_coverage']:.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure recall@k of shortened and quantized embeddings')
+    parser.add_argument('source', help='Full-size float32 export (index.py --export-vectors) or backup directory')
+    parser.add_argument('--golden', default=str(GOLDEN_QUERIES), help='Golden queries file')
+    parser.add_argument('--no-golden', action='store_true', help='Only measure recall on corpus queries')
+    parser.add_argument('--dimensions', default='256,512,768,1024,1536',
+                        help='Comma-separated dimensions to compare')
+    parser.add_argument('--quantizations', default=','.join(QUANTIZATIONS),
+                        help='Comma-separated storage formats to compare')
+    parser.add_argument('-k', type=int, default=10, help='Results per query')
+    parser.add_argument('--corpus-queries', type=int, default=500,
+                        help='Stored vectors used as extra queries')
+    parser.add_argument('--embedding-cache', default='./data/cache/embeddings.sqlite',
+                        help='Cache holding the golden query embeddings')
+    parser.add_argument('--offline', action='store_true',
+                        help='Never call OpenAI (also implied without OPENAI_API_KEY); '
+                             'golden queries missing from the cache are skipped')
+    parser.add_argument('--output', help='Also write the report as JSON')
+    args = parser.parse_args()
+
+    quantizations = [q.strip() for q in args.quantizations.split(",") if q.strip()]
+    unknown = set(quantizations) - set(QUANTIZATIONS)
+    if unknown:
+        parser.error(f"Unknown quantizations: {', '.join(sorted(unknown))}")
+    golden_path = None if args.no_golden else Path(args.golden)
+    if golden_path and not golden_path.exists():
+        parser.error(f"Golden queries file {golden_path} not found (--no-golden to skip golden queries)")
+    cache = EmbeddingCache(args.embedding_cache) if args.embedding_cache else None
+    try:
+        report = run_report(
+            Path(args.source), golden_path,
+            [int(d) for d in args.dimensions.split(",") if d.strip()], quantizations,
+            k=args.k, corpus_queries=args.corpus_queries, cache=cache,
+            allow_api=not args.offline and bool(os.getenv("OPENAI_API_KEY")),
+        )
+    except ValueError as e:
+        raise SystemExit(str(e))
+    finally:
+        if cache:
+            cache.close()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote report to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
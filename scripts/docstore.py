@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+JSONL document store shared by the crawler and indexer
+One JSON document per line, optionally gzip (.gz) or zstd (.zst) compressed
+"""
+
+import gzip
+import io
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstd output is optional
+    zstandard = None
+
+STORE_FORMATS = ("jsonl", "jsonl.gz", "jsonl.zst")
+
+
+def store_path(directory, store_format: str) -> Path:
+    return Path(directory) / f"documents.{store_format}"
+
+
+def find_store(directory) -> Optional[Path]:
+    """Document file of a crawl directory, falling back to the legacy documents.json"""
+    for store_format in STORE_FORMATS + ("json",):
+        path = store_path(directory, store_format)
+        if path.exists():
+            return path
+    return None
+
+
+def open_text(path, mode: str, suffix: Optional[str] = None):
+    """Open a store for text reading ('r') or writing ('w'), compressed by suffix"""
+    path = Path(path)
+    suffix = suffix or path.suffix
+    if suffix == ".gz":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if suffix == ".zst":
+        if zstandard is None:
+            raise RuntimeError("zstd stores need the zstandard package: pip install zstandard")
+        if mode == "r":
+            stream = zstandard.ZstdDecompressor().stream_reader(
+                open(path, "rb"), read_across_frames=True, closefd=True
+            )
+        else:
+            stream = zstandard.ZstdCompressor(level=10).stream_writer(open(path, "wb"), closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def iter_documents(path) -> Iterator[Dict]:
+    """Yield documents one at a time from any store format"""
+    path = Path(path)
+    if path.suffix == ".json":
+        # Legacy single-array file written by older crawls
+        with open(path, 'r') as f:
+            yield from json.load(f)
+        return
+
+    with open_text(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_store(documents: Iterable[Dict], path) -> int:
+    """Write documents to a store atomically, returns the number written"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    count = 0
+    with open_text(tmp_path, "w", suffix=path.suffix) as f:
+        for doc in documents:
+            f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def remove_other_stores(directory, keep: Path):
+    """Delete documents.* files in other formats so readers can't pick a stale one"""
+    for store_format in STORE_FORMATS + ("json",):
+        path = store_path(directory, store_format)
+        if path != keep and path.exists():
+            path.unlink()
+
+
+class DocumentWriter:
+    """Appends documents to an uncompressed JSONL file as they are produced
+
+    Each line is flushed immediately so a crash loses at most the line being
+    written; `repair` drops such a truncated tail before appending again.
+    """
+
+    def __init__(self, path, append: bool = False):
+        self.path = Path(path)
+        if append:
+            self.repair(self.path)
+        self._file = open(self.path, "a" if append else "w", encoding="utf-8")
+
+    @staticmethod
+    def repair(path: Path):
+        if not path.exists():
+            return
+        with open(path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                f.truncate(end)
+
+    def append(self, doc: Dict):
+        self._file.write(json.dumps(doc, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class DocumentLookup:
+    """Random access by URL to a finished store without loading it into memory
+
+    The store is copied to an uncompressed scratch file so documents can be
+    read back with a seek; only URL -> byte offset is kept in memory.
+    """
+
+    def __init__(self, path, scratch_path):
+        self._path = Path(scratch_path)
+        self._offsets: Dict[str, int] = {}
+        offset = 0
+        with open(self._path, "wb") as out:
+            for doc in iter_documents(path):
+                # Incremental crawls keep removed pages as tombstones
+                if doc.get("status") == "removed":
+                    continue
+                line = (json.dumps(doc, ensure_ascii=False) + "\n").encode()
+                self._offsets[doc["url"]] = offset
+                out.write(line)
+                offset += len(line)
+        self._file = open(self._path, "rb")
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def urls(self) -> List[str]:
+        return list(self._offsets)
+
+    def get(self, url: str) -> Optional[Dict]:
+        offset = self._offsets.get(url)
+        if offset is None:
+            return None
+        self._file.seek(offset)
+        return json.loads(self._file.readline())
+
+    def close(self):
+        self._file.close()
+        self._path.unlink(missing_ok=True)
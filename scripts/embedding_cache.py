@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Persistent embedding cache
+Stores embeddings in SQLite keyed by (model, dimensions, sha256 of text)
+"""
+
+import hashlib
+import sqlite3
+import time
+from array import array
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache with least-recently-used eviction
+
+    Vectors are stored as packed float32 blobs. The database is a single file,
+    so it can be saved and restored between CI runs as a cache artifact.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                dimensions INTEGER NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, dimensions, text_hash)
+            )
+        """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get_many(self, model: str, dimensions: int, texts: Sequence[str]) -> List[Optional[array]]:
+        """Look up embeddings for texts, returning None for each miss"""
+        hashes = [self.text_hash(text) for text in texts]
+        found = {}
+        # Stay well below SQLite's bound-parameter limit
+        for i in range(0, len(hashes), 500):
+            batch = hashes[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT text_hash, vector FROM embeddings "
+                f"WHERE model = ? AND dimensions = ? AND text_hash IN ({placeholders})",
+                [model, dimensions, *batch],
+            )
+            for text_hash, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[text_hash] = vector
+
+        now = time.time()
+        self.conn.executemany(
+            "UPDATE embeddings SET last_used = ? WHERE model = ? AND dimensions = ? AND text_hash = ?",
+            [(now, model, dimensions, h) for h in found],
+        )
+        self.conn.commit()
+
+        results = [found.get(h) for h in hashes]
+        hits = sum(1 for r in results if r is not None)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def put_many(self, model: str, dimensions: int, texts: Sequence[str], embeddings: Sequence[Sequence[float]]):
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, dimensions, text_hash, vector, last_used) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (model, dimensions, self.text_hash(text), self._to_blob(embedding), now)
+                for text, embedding in zip(texts, embeddings)
+            ],
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def _to_blob(embedding) -> bytes:
+        if isinstance(embedding, array) and embedding.typecode == "f":
+            return embedding.tobytes()
+        return array("f", embedding).tobytes()
+
+    def evict(self):
+        """Drop least recently used entries until the vectors fit in max_bytes"""
+        cursor = self.conn.execute("""
+            DELETE FROM embeddings WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, SUM(LENGTH(vector)) OVER (
+                        ORDER BY last_used DESC, rowid DESC
+                    ) AS running_bytes
+                    FROM embeddings
+                ) WHERE running_bytes > ?
+            )
+        """, (self.max_bytes,))
+        self.evictions += cursor.rowcount
+        self.conn.commit()
+
+    def size_bytes(self) -> int:
+        row = self.conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+        return row[0]
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return (f"{self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate), "
+                f"{self.evictions} evicted, {self.size_bytes() / 1024 / 1024:.1f} MB stored")
+
+    def close(self):
+        self.evict()
+        if self.evictions:
+            # Shrink the file so the saved cache artifact stays small
+            self.conn.execute("VACUUM")
+        # Fold the write-ahead log back into the main file before it's archived
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.close()
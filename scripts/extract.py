@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+HTML to document extraction used by the crawler
+Plain functions of raw HTML so they can run in a process pool off the event loop
+"""
+
+import bisect
+import hashlib
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import urljoin, urlparse, urlunparse
+
+from bs4 import BeautifulSoup, CData, NavigableString
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # selectolax backend is optional
+    LexborHTMLParser = None
+
+# Selectors tried in order for the main topic content (browser and static paths)
+CONTENT_SELECTORS = [
+    '.topic-content',
+    '.main-content',
+    '#content',
+    'main',
+    'article',
+    '.content-wrapper',
+    '[role="main"]',
+    '.body-content',
+    '.doc-content',
+]
+
+PARSERS = ("lxml", "selectolax")
+
+# Stored text per page. Extraction keeps more, so the limit is spent on what
+# is left once cross-page boilerplate has been removed.
+TEXT_LIMIT = 5000
+RAW_TEXT_LIMIT = 4 * TEXT_LIMIT
+
+
+def canonicalize_url(url: str) -> str:
+    """Normalize a URL for fetching: no fragment or query, lowercase host, no trailing slash"""
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    netloc = parsed.netloc.lower()
+    if (scheme, netloc.rpartition(":")[2]) in (("http", "80"), ("https", "443")):
+        netloc = netloc.rpartition(":")[0]
+    path = parsed.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+    return urlunparse((scheme, netloc, path, "", "", ""))
+
+
+def extract_links(page_url: str, hrefs: Iterable[str], base_url: str) -> List[str]:
+    """Canonical same-host .html links, in page order"""
+    host = urlparse(base_url).netloc
+    links = []
+    for href in hrefs:
+        link = canonicalize_url(urljoin(page_url, href))
+        if urlparse(link).netloc == host and link.endswith('.html'):
+            links.append(link)
+    return links
+
+
+def normalize_whitespace(text: str) -> str:
+    return re.sub(r'\s+', ' ', text.replace('\u200b', ' ')).strip()
+
+
+def _code_text(text: str) -> str:
+    """Code keeps its line structure; only blank lines and runs of spaces go"""
+    lines = (normalize_whitespace(line) for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def _normalize_spans(raw: str, spans: Sequence[Sequence[int]]) -> Tuple[str, List[List[int]]]:
+    """`normalize_whitespace(raw)` with [start, end) spans of `raw` moved onto it
+
+    Spans with no text left after normalizing are dropped.
+    """
+    text = normalize_whitespace(raw)
+    if not spans:
+        return text, []
+    # Each run of non-space characters lands in the text one space after the previous run
+    runs = []
+    position = 0
+    for match in re.finditer(r'\S+', raw.replace('\u200b', ' ')):
+        runs.append((match.start(), match.end(), position))
+        position += match.end() - match.start() + 1
+    run_ends = [end for _, end, _ in runs]
+    moved = []
+    for start, end in spans:
+        first = bisect.bisect_right(run_ends, start)
+        last = first
+        while last < len(runs) and runs[last][0] < end:
+            last += 1
+        if last == first:
+            continue
+        head, tail = runs[first], runs[last - 1]
+        moved.append([head[2] + max(start - head[0], 0), tail[2] + min(end, tail[1]) - tail[0]])
+    return text, moved
+
+
+def _table_text(rows: List[List[Tuple[str, List[List[int]]]]]) -> Tuple[str, List[List[int]]]:
+    """Table text from (text, code spans) cells, with the spans moved onto its flat text"""
+    lines, spans = [], []
+    offset = 0
+    for cells in rows:
+        if not any(text for text, _ in cells):
+            continue
+        if lines:
+            offset += 1
+        for i, (text, cell_spans) in enumerate(cells):
+            if i:
+                offset += 3
+            spans.extend([offset + start, offset + end] for start, end in cell_spans)
+            offset += len(text)
+        lines.append(" | ".join(text for text, _ in cells))
+    text = "\n".join(lines)
+    return text, _normalize_spans(text, spans)[1]
+
+
+def blocks_text(blocks: List[Dict]) -> str:
+    """Flat page text: every block on one line"""
+    return " ".join(normalize_whitespace(block["text"]) for block in blocks)
+
+
+def code_block_spans(blocks: List[Dict]) -> Tuple[List[str], List[List[int]]]:
+    """Each code block in the blocks and its [start, end) in `blocks_text(blocks)`
+
+    Spans come from where the blocks sit, so they stay right after blocks are
+    stripped or cut. A code block is code as a whole; other blocks carry
+    the spans of their inline code within their own flat text.
+    """
+    code_blocks, spans = [], []
+    offset = 0
+    for block in blocks:
+        flat = normalize_whitespace(block["text"])
+        if block["type"] == "code":
+            code_blocks.append(block["text"])
+            spans.append([offset, offset + len(flat)])
+        for start, end in block.get("code_spans", ()):
+            code_blocks.append(flat[start:end])
+            spans.append([offset + start, offset + end])
+        offset += len(flat) + 1
+    return code_blocks, spans
+
+
+def _cut_block(block: Dict, length: int) -> Optional[Dict]:
+    """The block with its flat text cut to at most `length` characters"""
+    if block["type"] == "code":
+        # Whole lines, so the code keeps its line breaks
+        lines = []
+        used = -1
+        for line in block["text"].split("\n"):
+            used += len(line) + 1
+            if used > length:
+                break
+            lines.append(line)
+        return {**block, "text": "\n".join(lines)} if lines else None
+    text = normalize_whitespace(block["text"])[:length].rstrip()
+    if not text:
+        return None
+    cut = {**block, "text": text}
+    spans = [[start, min(end, len(text))] for start, end in block.get("code_spans", ()) if start < len(text)]
+    if spans:
+        cut["code_spans"] = spans
+    else:
+        cut.pop("code_spans", None)
+    return cut
+
+
+def limit_blocks(blocks: List[Dict], limit: int) -> List[Dict]:
+    """Leading blocks whose flat text fits in `limit` characters, cutting the last one"""
+    kept = []
+    used = 0
+    for block in blocks:
+        length = len(normalize_whitespace(block["text"]))
+        if used + length > limit:
+            remaining = limit - used
+            if remaining > 1:
+                cut = _cut_block(block, remaining - 1)
+                if cut is not None:
+                    kept.append(cut)
+            break
+        kept.append(block)
+        used += length + 1
+    return kept
+
+
+def build_document(url: str, version: str, title: str, blocks: List[Dict], links: List[str]) -> Dict:
+    text = blocks_text(blocks)
+    code_blocks, code_spans = code_block_spans(blocks)
+    return {
+        "url": url,
+        "version": version,
+        "title": title,
+        "text": text,
+        "blocks": blocks,
+        "code_blocks": code_blocks,
+        "code_spans": code_spans,  # [start, end) of each code block in text
+        "links": list(dict.fromkeys(links)),  # Deduplicated, in page order
+        "hash": hashlib.sha256(text.encode()).hexdigest()[:16],
+    }
+
+
+# Structure kept from the HTML: headings, paragraphs, tables and preformatted code
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+PARAGRAPH_TAGS = {"p", "li", "dt", "dd", "blockquote", "figcaption", "caption", "summary"}
+CONTAINER_TAGS = {
+    "html", "body", "div", "section", "article", "main", "nav", "header", "footer",
+    "aside", "ul", "ol", "dl", "form", "details", "figure", "center", "fieldset",
+}
+SKIP_TAGS = {"script", "style", "noscript", "template", "head", "title"}
+BLOCK_TAGS = sorted(HEADING_TAGS | PARAGRAPH_TAGS | CONTAINER_TAGS | {"pre", "table"})
+BLOCK_SELECTOR = ", ".join(BLOCK_TAGS)
+
+
+class _BlockBuilder:
+    """Turns a walk over an element tree into a list of blocks
+
+    Text outside any block element (bare text in a div, inline elements)
+    is gathered into a paragraph that ends at the next block boundary.
+    Inline code is recorded as it is added, as spans of the block's flat text.
+    """
+
+    def __init__(self):
+        self.blocks: List[Dict] = []
+        self._inline: List[str] = []
+        self._inline_spans: List[List[int]] = []
+        self._inline_length = 0
+
+    def inline(self, text: str, code_spans: Sequence[Sequence[int]] = ()):
+        offset = self._inline_length
+        self._inline_spans.extend([offset + start, offset + end] for start, end in code_spans)
+        self._inline.append(text)
+        self._inline_length += len(text)
+
+    def flush(self):
+        text, code_spans = _normalize_spans("".join(self._inline), self._inline_spans)
+        self._inline, self._inline_spans, self._inline_length = [], [], 0
+        if text:
+            self._append({"type": "paragraph", "text": text}, code_spans)
+
+    def add(self, block_type: str, text: str, level: Optional[int] = None,
+            code_spans: Sequence[Sequence[int]] = ()):
+        self.flush()
+        if not text:
+            return
+        block = {"type": block_type, "text": text}
+        if level is not None:
+            block["level"] = level
+        self._append(block, code_spans)
+
+    def _append(self, block: Dict, code_spans: List[List[int]]):
+        if code_spans:
+            block["code_spans"] = code_spans
+        self.blocks.append(block)
+
+
+# Elements taken as code inside other blocks; a <pre> on its own is a code block
+CODE_TAGS = {"code", "pre"}
+_LXML_TEXT_TYPES = (NavigableString, CData)
+
+
+def _text_lxml(element) -> Tuple[str, List[List[int]]]:
+    """`get_text()` of an element and the span of each code element in it"""
+    parts, spans = [], []
+    length = 0
+    if element.name in CODE_TAGS:
+        spans.append([0, len(element.get_text())])
+    for node in element.descendants:
+        if type(node) in _LXML_TEXT_TYPES:
+            parts.append(node)
+            length += len(node)
+        elif node.name in CODE_TAGS and (not spans or length >= spans[-1][1]):
+            spans.append([length, length + len(node.get_text())])
+    return "".join(parts), spans
+
+
+def _walk_lxml(node, builder: _BlockBuilder):
+    for child in node.children:
+        if isinstance(child, NavigableString):
+            if type(child) is NavigableString:
+                builder.inline(str(child))
+            continue
+        name = child.name
+        if name in SKIP_TAGS:
+            continue
+        if name in HEADING_TAGS:
+            text, code_spans = _normalize_spans(*_text_lxml(child))
+            builder.add("heading", text, level=int(name[1]), code_spans=code_spans)
+        elif name == "pre":
+            builder.add("code", _code_text(child.get_text()))
+        elif name == "table":
+            rows = [
+                [_normalize_spans(*_text_lxml(cell)) for cell in row.find_all(["th", "td"])]
+                for row in child.find_all("tr")
+            ]
+            text, code_spans = _table_text(rows)
+            builder.add("table", text, code_spans=code_spans)
+        elif name in CONTAINER_TAGS or (
+            name in PARAGRAPH_TAGS and child.find(BLOCK_TAGS) is not None
+        ):
+            builder.flush()
+            _walk_lxml(child, builder)
+            builder.flush()
+        elif name in PARAGRAPH_TAGS:
+            text, code_spans = _normalize_spans(*_text_lxml(child))
+            builder.add("paragraph", text, code_spans=code_spans)
+        else:
+            builder.inline(*_text_lxml(child))
+
+
+def _text_selectolax(element) -> Tuple[str, List[List[int]]]:
+    """`text()` of an element and the span of each code element in it"""
+    parts, spans = [], []
+    length = 0
+    for node in element.traverse(include_text=True):
+        if node.tag == "-text":
+            text = node.text(deep=False)
+            parts.append(text)
+            length += len(text)
+        elif node.tag in CODE_TAGS and (not spans or length >= spans[-1][1]):
+            spans.append([length, length + len(node.text())])
+    return "".join(parts), spans
+
+
+def _walk_selectolax(node, builder: _BlockBuilder):
+    for child in node.iter(include_text=True):
+        name = child.tag
+        if name == "-text":
+            builder.inline(child.text(deep=False))
+            continue
+        if name.startswith("-") or name in SKIP_TAGS:
+            continue
+        if name in HEADING_TAGS:
+            text, code_spans = _normalize_spans(*_text_selectolax(child))
+            builder.add("heading", text, level=int(name[1]), code_spans=code_spans)
+        elif name == "pre":
+            builder.add("code", _code_text(child.text()))
+        elif name == "table":
+            rows = [
+                [_normalize_spans(*_text_selectolax(cell)) for cell in row.css("th, td")]
+                for row in child.css("tr")
+            ]
+            text, code_spans = _table_text(rows)
+            builder.add("table", text, code_spans=code_spans)
+        elif name in CONTAINER_TAGS or (
+            name in PARAGRAPH_TAGS and child.css_first(BLOCK_SELECTOR) is not None
+        ):
+            builder.flush()
+            _walk_selectolax(child, builder)
+            builder.flush()
+        elif name in PARAGRAPH_TAGS:
+            text, code_spans = _normalize_spans(*_text_selectolax(child))
+            builder.add("paragraph", text, code_spans=code_spans)
+        else:
+            builder.inline(*_text_selectolax(child))
+
+
+def _parse_lxml(html: str, select_content: bool) -> Tuple[str, List[Dict], List[str]]:
+    soup = BeautifulSoup(html, "lxml")
+    title = soup.title.get_text(strip=True) if soup.title else ""
+    content = soup
+    if select_content:
+        # No <body> fallback: an empty result means the page needs JavaScript to render
+        content = None
+        for selector in CONTENT_SELECTORS:
+            elem = soup.select_one(selector)
+            if elem and len(elem.get_text().strip()) > 100:
+                content = elem
+                break
+    blocks = []
+    if content is not None:
+        builder = _BlockBuilder()
+        _walk_lxml(content, builder)
+        builder.flush()
+        blocks = builder.blocks
+    hrefs = [a["href"] for a in soup.find_all("a", href=True)]
+    return title, blocks, hrefs
+
+
+def _parse_selectolax(html: str, select_content: bool) -> Tuple[str, List[Dict], List[str]]:
+    tree = LexborHTMLParser(html)
+    title_node = tree.css_first("title")
+    title = title_node.text(strip=True) if title_node else ""
+    content = tree.root
+    if select_content:
+        content = None
+        for selector in CONTENT_SELECTORS:
+            elem = tree.css_first(selector)
+            if elem and len(elem.text().strip()) > 100:
+                content = elem
+                break
+    blocks = []
+    if content is not None:
+        builder = _BlockBuilder()
+        _walk_selectolax(content, builder)
+        builder.flush()
+        blocks = builder.blocks
+    hrefs = [a.attributes["href"] for a in tree.css("a[href]") if a.attributes.get("href")]
+    return title, blocks, hrefs
+
+
+def _parser(name: str):
+    if name == "selectolax":
+        if LexborHTMLParser is None:
+            raise RuntimeError("The selectolax parser needs the selectolax package: pip install selectolax")
+        return _parse_selectolax
+    return _parse_lxml
+
+
+def extract_static(url: str, html: str, version: str, base_url: str, parser: str = "lxml") -> Dict:
+    """Document from a server response; text is empty when content is rendered client-side"""
+    title, blocks, hrefs = _parser(parser)(html, select_content=True)
+    return build_document(url, version, title, limit_blocks(blocks, RAW_TEXT_LIMIT),
+                          extract_links(url, hrefs, base_url))
+
+
+def extract_rendered(url: str, version: str, title: str, text: Optional[str], html: str,
+                     base_url: str, extra_links: Sequence[str] = (), parser: str = "lxml") -> Dict:
+    """Document from browser-rendered content HTML plus links found by script
+
+    `text` is the browser's textContent, used as a single paragraph when the
+    HTML yields no blocks.
+    """
+    _, blocks, hrefs = _parser(parser)(html, select_content=False)
+    if not blocks and text and text.strip():
+        blocks = [{"type": "paragraph", "text": normalize_whitespace(text)}]
+    links = extract_links(url, hrefs, base_url) + extract_links(url, extra_links, base_url)
+    return build_document(url, version, title, limit_blocks(blocks, RAW_TEXT_LIMIT), links)
@@ -8,12 +8,31 @@ import json
 import os
 import hashlib
 import argparse
+import base64
+import random
+import tempfile
+import time
+from array import array
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Optional, Set
 import asyncio
 
 import httpx
-from openai import OpenAI
+import openai
+from openai import AsyncOpenAI
+
+import docstore
+from extract import code_block_spans
+from chunker import Chunk, Chunker
+from dedupe import NearDuplicateIndex
+from embedding_cache import EmbeddingCache
+from backup_vector import QUANTIZATIONS, BackupWriter
+from metrics import METRICS, peak_rss_mb
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to the 4-characters-per-token estimate
+    tiktoken = None
 
 # Initialize clients with better error handling
 api_key = os.getenv("OPENAI_API_KEY")
@@ -26,15 +45,111 @@ if not api_key:
         "3. Set the value to your OpenAI API key"
     )
 
-openai_client = OpenAI(api_key=api_key)
+# Retries are handled by DocumentIndexer so the policy is configurable.
+# Set OPENAI_BASE_URL to point the indexer at scripts/mock_services.py.
+openai_client = AsyncOpenAI(api_key=api_key, max_retries=0)
+
+# Set ALGOLIA_BASE_URL the same way for a local Algolia stand-in
+ALGOLIA_BASE_URL = os.getenv("ALGOLIA_BASE_URL")
+
+def encode_json(payload) -> bytes:
+    """Serialize a request body, expanding float32 arrays only at this point"""
+    return json.dumps(payload, default=lambda o: o.tolist()).encode()
+
+
+async def gather_or_cancel(*aws):
+    """Like asyncio.gather, but once one awaitable fails the others are cancelled"""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+class StageStats:
+    """Busy time, throughput and active span of one pipeline stage"""
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.first_start: Optional[float] = None
+        self.last_end: Optional[float] = None
+    
+    def record(self, started: float, items: int):
+        ended = time.monotonic()
+        self.batches += 1
+        self.items += items
+        self.busy_seconds += ended - started
+        if self.first_start is None or started < self.first_start:
+            self.first_start = started
+        self.last_end = ended
+    
+    def summary(self, run_start: float) -> str:
+        if not self.batches:
+            return f"{self.name}: idle"
+        return (f"{self.name}: {self.items} items in {self.batches} batches, "
+                f"busy {self.busy_seconds:.1f}s, active {self.first_start - run_start:.1f}s"
+                f"-{self.last_end - run_start:.1f}s, "
+                f"avg {self.busy_seconds / self.batches * 1000:.0f}ms/batch")
+
 
 class DocumentIndexer:
-    def __init__(self, version: str = "2.3"):
+    def __init__(self, version: str = "2.3", full: bool = False, max_delete_ratio: float = 0.5,
+                 embedding_cache: Optional[EmbeddingCache] = None,
+                 embed_batch_tokens: int = 100_000, embed_batch_size: int = 512,
+                 embed_concurrency: int = 4, embed_max_retries: int = 6,
+                 embed_backoff_base: float = 1.0, embed_backoff_max: float = 60.0,
+                 queue_size: int = 4, upsert_concurrency: int = 2,
+                 dedupe_threshold: Optional[float] = 0.9, max_chunk_tokens: int = 500,
+                 shared_embeddings: Optional[Dict[str, asyncio.Future]] = None,
+                 export_dir: Optional[str] = None, embedding_dimensions: int = 1536,
+                 export_quantization: str = "float32"):
         self.version = version
+        self.full = full
+        self.max_delete_ratio = max_delete_ratio
+        self.embedding_cache = embedding_cache
+        # Embeddings requested by indexers of other versions in the same run, by text hash
+        self.shared_embeddings = shared_embeddings
+        # Text hashes this indexer put in shared_embeddings, so a wait on one of
+        # its own in-flight requests isn't counted as a hit from another version
+        self.shared_requested: Set[str] = set()
+        self.shared_hits = 0
+        # Text hash of every chunk of this version, for cross-version overlap reports
+        self.text_hashes: Set[str] = set()
+        # Every chunk's vector is also written here in the backup_vector.py format
+        self.export_dir = Path(export_dir) / version if export_dir else None
+        self.export_quantization = export_quantization
+        self.embedding_model = "text-embedding-3-small"
+        # text-embedding-3 models return shortened embeddings on request; the
+        # Upstash index must be created with the same dimension
+        self.embedding_dimensions = embedding_dimensions
+        # Requests are packed by estimated tokens (OpenAI caps a request at 300k)
+        self.embed_batch_tokens = embed_batch_tokens
+        self.embed_batch_size = min(embed_batch_size, 2048)
+        self.embed_concurrency = embed_concurrency
+        self.embed_max_retries = embed_max_retries
+        self.embed_backoff_base = embed_backoff_base
+        self.embed_backoff_max = embed_backoff_max
+        self._encoding = tiktoken.get_encoding("cl100k_base") if tiktoken else None
+        self.chunker = Chunker(self._encoding, max_tokens=max_chunk_tokens)
+        self.chunk_seconds = 0.0
+        # Pipeline: batches buffered between stages, and per-request sizes
+        self.queue_size = queue_size
+        self.upsert_concurrency = upsert_concurrency
+        # Chunks at least this similar share one vector; None or 0 disables
+        self.dedupe_threshold = dedupe_threshold
+        self.upsert_batch_size = 100
+        self.algolia_batch_size = 1000
         self.upstash_url = os.getenv("UPSTASH_VECTOR_REST_URL")
         self.upstash_token = os.getenv("UPSTASH_VECTOR_REST_TOKEN")
         self.algolia_app_id = os.getenv("ALGOLIA_APP_ID")
         self.algolia_api_key = os.getenv("ALGOLIA_API_KEY")
+        self.algolia_url = (ALGOLIA_BASE_URL or f"https://{self.algolia_app_id}.algolia.net").rstrip("/")
         
         # Validate required environment variables
         missing_vars = []
@@ -55,182 +170,768 @@ class DocumentIndexer:
         
     async def index_documents(self, input_dir: str = "./data"):
         print(f"Starting indexing for version {self.version}...")
+        run_start = time.monotonic()
         
-        # Load documents
-        docs_file = Path(input_dir) / "raw" / self.version / "documents.json"
-        with open(docs_file, 'r') as f:
-            documents = json.load(f)
+        # Diff against the chunks indexed by the previous run
+        state_file = Path(input_dir) / "index" / self.version / "index_state.json"
+        previous_state = self._load_index_state(state_file)
+        current_state: Dict[str, str] = {}
+        counts = {"documents": 0, "added": 0, "updated": 0, "unchanged": 0, "near_duplicates": 0}
         
-        print(f"Loaded {len(documents)} documents")
+        with tempfile.TemporaryDirectory(prefix="lumdoc-chunks-") as spill_dir:
+            # The dedupe pass spills each page's chunks so they're not chunked twice
+            spill_file = Path(spill_dir) / "chunks.jsonl"
+            duplicates, sources = self._find_near_duplicates(input_dir, spill_file)
+            if spill_file.exists():
+                chunked = (record["chunks"] for record in docstore.iter_documents(spill_file))
+            else:
+                chunked = self._iter_chunked(input_dir)
+            
+            # Chunks are produced lazily and only the changed ones enter the pipeline;
+            # the full corpus is never held in memory
+            changed = self._changed_chunks(chunked, previous_state, current_state, counts,
+                                           duplicates, sources)
+            failed_ids = await self._index_chunks(changed)
         
-        # Process into chunks
-        chunks = []
-        for doc in documents:
-            chunks.extend(self._chunk_document(doc))
+        deleted = [chunk_id for chunk_id in previous_state if chunk_id not in current_state]
+        indexed = len(previous_state)
+        if self.full or not previous_state:
+            # Without a state to diff against (first run, lost state file) stale
+            # chunks are only found by listing what the indexes hold
+            stored = await self._stored_chunk_ids()
+            if stored is not None:
+                untracked = sorted(stored - current_state.keys() - previous_state.keys())
+                if untracked:
+                    print(f"Found {len(untracked)} stored chunks missing from the index state")
+                deleted += untracked
+                indexed = len(stored | previous_state.keys())
+        print(f"Processed {counts['documents']} documents into {len(current_state)} chunks"
+              + (f" ({counts['near_duplicates']} near-duplicates collapsed)" if duplicates else ""))
+        if counts["documents"]:
+            print(f"Chunking took {self.chunk_seconds:.2f}s "
+                  f"({self.chunk_seconds / counts['documents'] * 1000:.2f}s per 1k pages, "
+                  f"{'tiktoken' if self._encoding else 'estimated'} token counts)")
+        print(f"Delta: {counts['added']} added, {counts['updated']} updated, "
+              f"{len(deleted)} deleted, {counts['unchanged']} unchanged")
+        if self.shared_embeddings is not None:
+            print(f"Embeddings taken from other versions' in-flight requests: {self.shared_hits}")
         
-        print(f"Created {len(chunks)} chunks")
+        refused_deletes: List[str] = []
+        if not self.full and len(deleted) > self.max_delete_ratio * indexed:
+            # Most likely a broken crawl rather than a real docs change
+            print(f"Refusing to delete {len(deleted)} of {indexed} indexed chunks "
+                  f"(max ratio {self.max_delete_ratio}); rerun with --full to force")
+            refused_deletes, deleted = deleted, []
         
-        # Index to Upstash Vector
-        await self._index_to_upstash(chunks)
+        # Remove chunks that no longer exist
+        failed_upstash_deletes, failed_algolia_deletes = await asyncio.gather(
+            self._delete_from_upstash(deleted),
+            self._delete_from_algolia(deleted),
+        )
+        failed_deletes = failed_upstash_deletes | failed_algolia_deletes
         
-        # Index to Algolia
-        await self._index_to_algolia(chunks)
+        # Failed upserts are left out of the state so the next run retries them;
+        # failed and refused deletes stay in it for the same reason (with no
+        # hash when they were found by listing the indexes)
+        new_state = {
+            chunk_id: chunk_hash for chunk_id, chunk_hash in current_state.items()
+            if chunk_id not in failed_ids
+        }
+        for chunk_id in (*failed_deletes, *refused_deletes):
+            new_state[chunk_id] = previous_state.get(chunk_id, "")
+        self._save_index_state(state_file, new_state)
         
-        print("Indexing complete!")
+        if failed_ids or failed_deletes:
+            print(f"{len(failed_ids)} upserts and {len(failed_deletes)} deletes failed; "
+                  "they will be retried on the next run")
+        print(f"Indexing complete in {time.monotonic() - run_start:.1f}s, "
+              f"peak RSS {peak_rss_mb():.0f} MB")
+    
+    def _iter_documents(self, input_dir: str) -> Iterator[Dict]:
+        crawl_dir = Path(input_dir) / "raw" / self.version
+        docs_file = docstore.find_store(crawl_dir)
+        if docs_file is None:
+            raise FileNotFoundError(f"No crawled documents found in {crawl_dir}")
+        print(f"Reading documents from {docs_file}")
+        
+        for doc in docstore.iter_documents(docs_file):
+            # Incremental crawls keep removed pages as tombstones
+            if doc.get("status") != "removed":
+                yield doc
+    
+    def _iter_chunked(self, input_dir: str) -> Iterator[List[Dict]]:
+        """Chunks of each document, one list per page"""
+        for doc in self._iter_documents(input_dir):
+            started = time.monotonic()
+            chunks = self._chunk_document(doc)
+            elapsed = time.monotonic() - started
+            self.chunk_seconds += elapsed
+            METRICS.observe("index_chunk_seconds", elapsed)
+            METRICS.inc("index_chunks", len(chunks))
+            yield chunks
+    
+    def _find_near_duplicates(self, input_dir: str, spill_file: Path):
+        """Cluster near-identical chunks across the corpus before anything is embedded
+        
+        Every page's chunks are written to spill_file for the delta pass to reuse.
+        Returns duplicate id -> canonical id, and canonical id -> all source URLs.
+        """
+        if not self.dedupe_threshold:
+            return {}, {}
+        index = NearDuplicateIndex(threshold=self.dedupe_threshold)
+        with docstore.open_text(spill_file, "w") as spill:
+            for chunks in self._iter_chunked(input_dir):
+                spill.write(json.dumps({"chunks": chunks}, ensure_ascii=False) + "\n")
+                for chunk in chunks:
+                    index.add(chunk["id"], chunk["url"], chunk["text"])
+        duplicates, sources = index.clusters()
+        print(f"Near-duplicates: {index.stats(duplicates, sources)}")
+        return duplicates, sources
+    
+    def _changed_chunks(self, chunked: Iterable[List[Dict]], previous_state: Dict[str, str],
+                        current_state: Dict[str, str], counts: Dict[str, int],
+                        duplicates: Dict[str, str], sources: Dict[str, List[str]]) -> Iterator[Dict]:
+        """Yield the chunks of each page that need (re-)indexing
+        
+        Fills current_state with the hash of every chunk seen and tallies the delta.
+        Near-duplicates are left out; their URLs are carried by the canonical chunk.
+        """
+        for chunks in chunked:
+            counts["documents"] += 1
+            for chunk in chunks:
+                if chunk["id"] in duplicates:
+                    counts["near_duplicates"] += 1
+                    continue
+                chunk["urls"] = sources.get(chunk["id"], [chunk["url"]])
+                self.text_hashes.add(EmbeddingCache.text_hash(chunk["text"]))
+                chunk_hash = self._chunk_hash(chunk)
+                current_state[chunk["id"]] = chunk_hash
+                previous_hash = previous_state.get(chunk["id"])
+                if previous_hash is None:
+                    counts["added"] += 1
+                elif previous_hash != chunk_hash:
+                    counts["updated"] += 1
+                else:
+                    counts["unchanged"] += 1
+                    # --full re-uploads everything but still deletes stale chunks
+                    if not self.full:
+                        if not self.export_dir:
+                            continue
+                        # Embedded (from the cache) for the export, but not uploaded again
+                        chunk["export_only"] = True
+                yield chunk
+    
+    def _load_index_state(self, state_file: Path) -> Dict[str, str]:
+        if not state_file.exists():
+            print("No previous index state found, indexing all chunks")
+            return {}
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+        # States from before --dimensions were always 1536
+        dimensions = state.get("dimensions", 1536)
+        if dimensions != self.embedding_dimensions:
+            print(f"Previous index state has {dimensions}-dimension vectors, "
+                  f"re-indexing all chunks at {self.embedding_dimensions}")
+            return {}
+        return state.get("chunks", {})
+    
+    def _save_index_state(self, state_file: Path, chunks: Dict[str, str]):
+        state_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(state_file, 'w') as f:
+            json.dump({"version": self.version, "dimensions": self.embedding_dimensions,
+                       "chunks": chunks}, f)
+        print(f"Saved index state for {len(chunks)} chunks to {state_file}")
+    
+    def _chunk_hash(self, chunk: Dict) -> str:
+        """Hash of everything we upload for a chunk, so metadata edits count as updates"""
+        payload = json.dumps(chunk, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()[:16]
     
     def _chunk_document(self, doc: Dict) -> List[Dict]:
-        """Simple chunking - split text into ~500 token chunks"""
-        chunks = []
-        text = doc["text"]
+        """Split a page into chunks along its headings, paragraphs, tables and code"""
+        # Crawls from before block extraction only have flat text
+        blocks = doc.get("blocks") or [{"type": "paragraph", "text": doc["text"]}]
+        pieces = self.chunker.chunk(doc["title"], blocks)
         
-        # Rough approximation: 1 token ≈ 4 characters
-        chunk_size = 2000  # ~500 tokens
-        overlap = 200
+        code_blocks = doc.get("code_blocks", [])
+        code_spans = doc.get("code_spans")
+        if code_spans is None:
+            # Crawls from before code spans: the spans follow from where the code blocks sit
+            code_blocks, code_spans = code_block_spans(blocks)
+        chunk_code = self._assign_code_blocks(pieces, code_blocks, code_spans)
         
-        for i in range(0, len(text), chunk_size - overlap):
-            chunk_text = text[i:i + chunk_size]
-            
-            if len(chunk_text) < 100:  # Skip tiny chunks
-                continue
-            
+        chunks = []
+        for i, (piece, code) in enumerate(zip(pieces, chunk_code)):
             chunk_id = hashlib.sha256(
-                f"{doc['url']}_{i}_{chunk_text[:50]}".encode()
+                f"{doc['url']}_{i}_{piece.text[:50]}".encode()
             ).hexdigest()[:16]
             
             chunk = {
                 "id": chunk_id,
-                "text": chunk_text,
+                "text": piece.text,
                 "url": doc["url"],
                 "title": doc["title"],
                 "version": doc["version"],
-                "section_path": doc["title"],  # Simplified
-                "code_blocks": self._extract_relevant_code(chunk_text, doc.get("code_blocks", [])),
+                "section_path": piece.section_path,
+                "code_blocks": code,
             }
             chunks.append(chunk)
         
         return chunks
     
-    def _extract_relevant_code(self, text: str, code_blocks: List[str]) -> List[str]:
-        """Find code blocks relevant to this chunk"""
-        relevant = []
-        text_lower = text.lower()
-        
-        for code in code_blocks:
-            # Simple relevance check
-            if any(word in code.lower() for word in text_lower.split()[:20]):
-                relevant.append(code)
-                if len(relevant) >= 2:
-                    break
-        
-        return relevant
-    
-    async def _index_to_upstash(self, chunks: List[Dict]):
-        """Index to Upstash Vector using REST API"""
-        print("Indexing to Upstash Vector...")
-        
-        # Generate embeddings
-        texts = [c["text"] for c in chunks]
-        
-        # Batch embed (OpenAI allows up to 2048 inputs)
-        batch_size = 100
-        all_embeddings = []
-        
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            response = openai_client.embeddings.create(
-                model="text-embedding-3-small",
-                input=batch,
-                dimensions=1536
-            )
-            all_embeddings.extend([e.embedding for e in response.data])
-            print(f"Embedded batch {i//batch_size + 1}/{(len(texts) + batch_size - 1)//batch_size}")
-        
-        # Prepare vectors for Upstash
-        vectors = []
-        for chunk, embedding in zip(chunks, all_embeddings):
-            vectors.append({
-                "id": chunk["id"],
-                "vector": embedding,
-                "metadata": {
-                    "text": chunk["text"],
-                    "url": chunk["url"],
-                    "title": chunk["title"],
-                    "version": chunk["version"],
-                    "section_path": chunk["section_path"],
-                    "code_blocks": chunk["code_blocks"],
-                }
-            })
-        
-        # Upsert to Upstash in batches
-        async with httpx.AsyncClient() as client:
-            batch_size = 100
-            for i in range(0, len(vectors), batch_size):
-                batch = vectors[i:i + batch_size]
+    @staticmethod
+    def _assign_code_blocks(chunks: List[Chunk], code_blocks: List[str],
+                            code_spans: List[List[int]]) -> List[List[str]]:
+        """Code blocks whose span overlaps each chunk's span
+        
+        Chunks are in page order and don't overlap, so one sweep over both
+        sorted lists suffices; a block split across chunks goes to each of them.
+        """
+        order = sorted(range(len(code_blocks)), key=lambda i: code_spans[i][0])
+        assigned: List[List[str]] = []
+        first = 0
+        for chunk in chunks:
+            # Blocks ending before this chunk can't overlap any later chunk either
+            while first < len(order) and code_spans[order[first]][1] <= chunk.start:
+                first += 1
+            matched = []
+            i = first
+            while i < len(order) and code_spans[order[i]][0] < chunk.end:
+                if code_spans[order[i]][1] > chunk.start:
+                    matched.append(code_blocks[order[i]])
+                i += 1
+            assigned.append(matched)
+        return assigned
+    
+    async def _index_chunks(self, chunks: Iterable[Dict]) -> Set[str]:
+        """Stream chunks through the embed -> Upstash upsert and Algolia stages
+        
+        Stages are joined by bounded queues, so Algolia batches go out while the
+        first embeddings are still in flight and each embedded batch is upserted
+        while later ones are being embedded. Returns IDs that failed to index.
+        """
+        failed_ids: Set[str] = set()
+        print("Indexing changed chunks to Upstash Vector and Algolia...")
+        stages = {name: StageStats(name) for name in ("embed", "upsert", "algolia")}
+        embed_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        upsert_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        algolia_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        start = time.monotonic()
+        exporter = None
+        if self.export_dir:
+            exporter = BackupWriter(self.export_dir, self.embedding_dimensions,
+                                    quantization=self.export_quantization)
+        if exporter and not self.embedding_cache:
+            print("Warning: exporting vectors without the embedding cache re-embeds unchanged chunks")
+        
+        async def produce():
+            embed_batch: List[Dict] = []
+            batch_tokens = 0
+            algolia_batch: List[Dict] = []
+            for chunk in chunks:
+                if not chunk.get("export_only"):
+                    algolia_batch.append(self._algolia_record(chunk))
+                    if len(algolia_batch) >= self.algolia_batch_size:
+                        await algolia_queue.put(algolia_batch)
+                        algolia_batch = []
+                
+                # Pack embedding requests by estimated tokens, not item count
+                tokens = self._estimate_tokens(chunk["text"])
+                if embed_batch and (batch_tokens + tokens > self.embed_batch_tokens
+                                    or len(embed_batch) >= self.embed_batch_size):
+                    await embed_queue.put(embed_batch)
+                    embed_batch, batch_tokens = [], 0
+                embed_batch.append(chunk)
+                batch_tokens += tokens
+            
+            if algolia_batch:
+                await algolia_queue.put(algolia_batch)
+            if embed_batch:
+                await embed_queue.put(embed_batch)
+            await algolia_queue.put(None)
+            for _ in range(self.embed_concurrency):
+                await embed_queue.put(None)
+        
+        async def embed_worker():
+            while (batch := await embed_queue.get()) is not None:
+                started = time.monotonic()
+                embeddings = await self._embed_batch([c["text"] for c in batch])
+                stages["embed"].record(started, len(batch))
+                METRICS.observe("index_embed_batch_seconds", time.monotonic() - started)
+                print(f"Embedded batch {stages['embed'].batches}")
                 
+                vectors = [self._vector_record(c, e) for c, e in zip(batch, embeddings)]
+                if exporter:
+                    for vector in vectors:
+                        exporter.append(vector["id"], vector["vector"], vector["metadata"])
+                vectors = [v for c, v in zip(batch, vectors) if not c.get("export_only")]
+                for i in range(0, len(vectors), self.upsert_batch_size):
+                    await upsert_queue.put(vectors[i:i + self.upsert_batch_size])
+        
+        async def embed_stage():
+            await gather_or_cancel(*(embed_worker() for _ in range(self.embed_concurrency)))
+            for _ in range(self.upsert_concurrency):
+                await upsert_queue.put(None)
+        
+        async def upsert_worker(client: httpx.AsyncClient):
+            while (batch := await upsert_queue.get()) is not None:
+                started = time.monotonic()
+                body = encode_json(batch)
                 response = await client.post(
                     f"{self.upstash_url}/upsert",
-                    headers={"Authorization": f"Bearer {self.upstash_token}"},
-                    json=batch,
+                    headers={
+                        "Authorization": f"Bearer {self.upstash_token}",
+                        "Content-Type": "application/json",
+                    },
+                    content=body,
                     timeout=30
                 )
+                stages["upsert"].record(started, len(batch))
+                METRICS.observe("index_request_seconds", time.monotonic() - started, service="upstash", op="upsert")
+                METRICS.inc("index_bytes_sent", len(body), service="upstash")
                 
                 if response.status_code != 200:
+                    METRICS.inc("index_request_errors", service="upstash", op="upsert")
                     print(f"Upstash error: {response.text}")
+                    failed_ids.update(v["id"] for v in batch)
                 else:
-                    print(f"Upserted batch {i//batch_size + 1} to Upstash")
+                    print(f"Upserted batch {stages['upsert'].batches} to Upstash")
         
-        print(f"Indexed {len(vectors)} vectors to Upstash")
-    
-    async def _index_to_algolia(self, chunks: List[Dict]):
-        """Index to Algolia using REST API"""
-        print("Indexing to Algolia...")
+        async def algolia_worker(client: httpx.AsyncClient):
+            while (batch := await algolia_queue.get()) is not None:
+                started = time.monotonic()
+                body = encode_json({"requests": [{"action": "addObject", "body": r} for r in batch]})
+                response = await client.post(
+                    f"{self.algolia_url}/1/indexes/ma3_docs/batch",
+                    headers={
+                        "X-Algolia-Application-Id": self.algolia_app_id,
+                        "X-Algolia-API-Key": self.algolia_api_key,
+                        "Content-Type": "application/json",
+                    },
+                    content=body,
+                    timeout=30
+                )
+                stages["algolia"].record(started, len(batch))
+                METRICS.observe("index_request_seconds", time.monotonic() - started, service="algolia", op="batch")
+                METRICS.inc("index_bytes_sent", len(body), service="algolia")
+                
+                if response.status_code != 200:
+                    METRICS.inc("index_request_errors", service="algolia", op="batch")
+                    print(f"Algolia error: {response.text}")
+                    failed_ids.update(r["objectID"] for r in batch)
+                else:
+                    print(f"Indexed batch {stages['algolia'].batches} to Algolia")
         
-        # Prepare records for Algolia
-        records = []
-        for chunk in chunks:
-            records.append({
-                "objectID": chunk["id"],
+        async with httpx.AsyncClient() as client:
+            try:
+                await gather_or_cancel(
+                    produce(),
+                    embed_stage(),
+                    *(upsert_worker(client) for _ in range(self.upsert_concurrency)),
+                    algolia_worker(client),
+                )
+            except BaseException:
+                if exporter:
+                    exporter.abort()
+                raise
+        if exporter:
+            exporter.close(source="index.py", model=self.embedding_model, version=self.version)
+            print(f"Exported {exporter.count} vectors to {self.export_dir}")
+        
+        total = stages["algolia"].items
+        if not total:
+            print("Upstash Vector and Algolia are up to date")
+            return failed_ids
+        
+        elapsed = time.monotonic() - start
+        print(f"Indexed {total - len(failed_ids)} of {total} chunks in {elapsed:.1f}s")
+        for stage in stages.values():
+            print(f"  {stage.summary(start)}")
+        if self.embedding_cache:
+            print(f"Embedding cache: {self.embedding_cache.stats()}")
+        return failed_ids
+    
+    def _vector_record(self, chunk: Dict, embedding: array) -> Dict:
+        return {
+            "id": chunk["id"],
+            "vector": embedding,
+            "metadata": {
                 "text": chunk["text"],
                 "url": chunk["url"],
                 "title": chunk["title"],
                 "version": chunk["version"],
                 "section_path": chunk["section_path"],
-                "code_blocks": " ".join(chunk["code_blocks"]) if chunk["code_blocks"] else "",
-            })
+                "code_blocks": chunk["code_blocks"],
+                "urls": chunk["urls"],
+            }
+        }
+    
+    def _algolia_record(self, chunk: Dict) -> Dict:
+        return {
+            "objectID": chunk["id"],
+            "text": chunk["text"],
+            "url": chunk["url"],
+            "title": chunk["title"],
+            "version": chunk["version"],
+            "section_path": chunk["section_path"],
+            "code_blocks": " ".join(chunk["code_blocks"]) if chunk["code_blocks"] else "",
+            "urls": chunk["urls"],
+        }
+    
+    async def _embed_batch(self, texts: List[str]) -> List[array]:
+        """Embed one batch, serving repeats from the embedding cache
+        
+        With shared_embeddings, a text another version's indexer is already
+        embedding is awaited instead of requested a second time.
+        """
+        if self.embedding_cache:
+            embeddings = self.embedding_cache.get_many(
+                self.embedding_model, self.embedding_dimensions, texts
+            )
+        else:
+            embeddings = [None] * len(texts)
+        
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if self.embedding_cache:
+            METRICS.inc("index_embedding_cache_hits", len(texts) - len(missing))
+        waiting: Dict[int, asyncio.Future] = {}
+        owned: Dict[str, asyncio.Future] = {}
+        if self.shared_embeddings is not None:
+            # No await between the cache lookup and this check, so a text is
+            # always either in the cache or in the shared map
+            requested = []
+            for i in missing:
+                text_hash = EmbeddingCache.text_hash(texts[i])
+                future = self.shared_embeddings.get(text_hash)
+                if future is None:
+                    future = asyncio.get_running_loop().create_future()
+                    self.shared_embeddings[text_hash] = future
+                    self.shared_requested.add(text_hash)
+                    owned[text_hash] = future
+                    requested.append(i)
+                elif text_hash in owned:
+                    requested.append(i)
+                else:
+                    waiting[i] = future
+            missing = requested
+        
+        if missing:
+            batch = [texts[i] for i in missing]
+            try:
+                created = await self._create_embeddings(batch)
+            except Exception as e:
+                for text_hash, future in owned.items():
+                    future.set_exception(e)
+                    # Waiters re-raise it; mark it retrieved so an unawaited one isn't logged
+                    future.exception()
+                    del self.shared_embeddings[text_hash]
+                    self.shared_requested.discard(text_hash)
+                raise
+            for i, embedding in zip(missing, created):
+                embeddings[i] = embedding
+            if self.embedding_cache:
+                self.embedding_cache.put_many(
+                    self.embedding_model, self.embedding_dimensions, batch, created
+                )
+            for i, embedding in zip(missing, created):
+                future = owned.pop(EmbeddingCache.text_hash(texts[i]), None)
+                if future is not None:
+                    future.set_result(embedding)
+                    if self.embedding_cache:
+                        # Cached now; without a cache the resolved future is the run's copy
+                        del self.shared_embeddings[EmbeddingCache.text_hash(texts[i])]
+        
+        retry = []
+        for i, future in waiting.items():
+            try:
+                embeddings[i] = await future
+                if EmbeddingCache.text_hash(texts[i]) not in self.shared_requested:
+                    self.shared_hits += 1
+            except Exception:
+                # The owning batch's request failed; don't fail this batch with it
+                retry.append(i)
+        if retry:
+            created = await self._create_embeddings([texts[i] for i in retry])
+            for i, embedding in zip(retry, created):
+                embeddings[i] = embedding
+        
+        return embeddings
+    
+    def _estimate_tokens(self, text: str) -> int:
+        if self._encoding:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        # Rough approximation: 1 token ≈ 4 characters
+        return len(text) // 4 + 1
+    
+    async def _create_embeddings(self, batch: List[str]) -> List[array]:
+        """One embeddings request, retried with exponential backoff and full jitter"""
+        for attempt in range(self.embed_max_retries + 1):
+            started = time.monotonic()
+            try:
+                # Asking for base64 explicitly makes the client hand back the raw
+                # payload, which decodes straight into a float32 buffer
+                response = await openai_client.embeddings.create(
+                    model=self.embedding_model,
+                    input=batch,
+                    dimensions=self.embedding_dimensions,
+                    encoding_format="base64"
+                )
+                METRICS.observe("index_request_seconds", time.monotonic() - started, service="openai", op="embed")
+                # Input text only; the JSON envelope around it is not counted
+                METRICS.inc("index_bytes_sent", sum(len(text.encode()) for text in batch), service="openai")
+                METRICS.inc("index_texts_embedded", len(batch))
+                if response.usage:
+                    METRICS.inc("index_tokens_embedded", response.usage.total_tokens)
+                return [array("f", base64.b64decode(e.embedding)) for e in response.data]
+            except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+                METRICS.observe("index_request_seconds", time.monotonic() - started, service="openai", op="embed")
+                METRICS.inc("index_request_errors", service="openai", op="embed")
+                if attempt == self.embed_max_retries:
+                    raise
+                METRICS.inc("index_retries", service="openai", error=type(e).__name__)
+                delay = random.uniform(0, min(self.embed_backoff_max, self.embed_backoff_base * 2 ** attempt))
+                # Honour the server's hint when it sends one
+                retry_after = getattr(getattr(e, "response", None), "headers", {}).get("retry-after")
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                print(f"Embedding request failed ({type(e).__name__}), "
+                      f"retry {attempt + 1}/{self.embed_max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    
+    async def _stored_chunk_ids(self) -> Optional[Set[str]]:
+        """IDs of this version's chunks in Upstash and Algolia, None if they can't be listed"""
+        try:
+            upstash_ids, algolia_ids = await gather_or_cancel(
+                self._stored_upstash_ids(), self._stored_algolia_ids()
+            )
+        except httpx.HTTPError as e:
+            print(f"Could not list stored chunks ({e}); chunks missing from the index state "
+                  "are not deleted")
+            return None
+        return upstash_ids | algolia_ids
+    
+    async def _stored_upstash_ids(self) -> Set[str]:
+        """Scan every vector ID, keeping this version's (the index is shared by versions)"""
+        ids: Set[str] = set()
+        cursor = "0"
+        async with httpx.AsyncClient() as client:
+            while cursor:
+                with METRICS.timer("index_request_seconds", service="upstash", op="range"):
+                    response = await client.post(
+                        f"{self.upstash_url}/range",
+                        headers={"Authorization": f"Bearer {self.upstash_token}"},
+                        json={"cursor": cursor, "limit": 1000,
+                              "includeVectors": False, "includeMetadata": True},
+                        timeout=60
+                    )
+                response.raise_for_status()
+                page = response.json()["result"]
+                ids.update(
+                    vector["id"] for vector in page["vectors"]
+                    if (vector.get("metadata") or {}).get("version") == self.version
+                )
+                cursor = page.get("nextCursor")
+        return ids
+    
+    async def _stored_algolia_ids(self) -> Set[str]:
+        """Browse every record, keeping this version's objectIDs"""
+        ids: Set[str] = set()
+        cursor = None
+        async with httpx.AsyncClient() as client:
+            while True:
+                params = {"hitsPerPage": 1000, "attributesToRetrieve": "version"}
+                if cursor:
+                    params["cursor"] = cursor
+                with METRICS.timer("index_request_seconds", service="algolia", op="browse"):
+                    response = await client.get(
+                        f"{self.algolia_url}/1/indexes/ma3_docs/browse",
+                        headers={
+                            "X-Algolia-Application-Id": self.algolia_app_id,
+                            "X-Algolia-API-Key": self.algolia_api_key,
+                        },
+                        params=params,
+                        timeout=60
+                    )
+                response.raise_for_status()
+                data = response.json()
+                ids.update(hit["objectID"] for hit in data.get("hits", []) if hit.get("version") == self.version)
+                cursor = data.get("cursor")
+                if not cursor:
+                    return ids
+    
+    async def _delete_from_upstash(self, chunk_ids: List[str]) -> Set[str]:
+        """Delete vectors by ID, returns IDs that failed to delete"""
+        failed_ids: Set[str] = set()
+        if not chunk_ids:
+            return failed_ids
         
-        # Index to Algolia
         async with httpx.AsyncClient() as client:
-            # Batch index
             batch_size = 1000
-            for i in range(0, len(records), batch_size):
-                batch = records[i:i + batch_size]
+            for i in range(0, len(chunk_ids), batch_size):
+                batch = chunk_ids[i:i + batch_size]
                 
-                response = await client.post(
-                    f"https://{self.algolia_app_id}.algolia.net/1/indexes/ma3_docs/batch",
-                    headers={
-                        "X-Algolia-Application-Id": self.algolia_app_id,
-                        "X-Algolia-API-Key": self.algolia_api_key,
-                    },
-                    json={"requests": [{"action": "addObject", "body": r} for r in batch]},
-                    timeout=30
-                )
+                with METRICS.timer("index_request_seconds", service="upstash", op="delete"):
+                    response = await client.post(
+                        f"{self.upstash_url}/delete",
+                        headers={"Authorization": f"Bearer {self.upstash_token}"},
+                        json=batch,
+                        timeout=30
+                    )
                 
                 if response.status_code != 200:
-                    print(f"Algolia error: {response.text}")
-                else:
-                    print(f"Indexed batch {i//batch_size + 1} to Algolia")
+                    METRICS.inc("index_request_errors", service="upstash", op="delete")
+                    print(f"Upstash delete error: {response.text}")
+                    failed_ids.update(batch)
+        
+        print(f"Deleted {len(chunk_ids) - len(failed_ids)} stale vectors from Upstash")
+        return failed_ids
+    
+    async def _delete_from_algolia(self, chunk_ids: List[str]) -> Set[str]:
+        """Delete records by objectID, returns IDs that failed to delete"""
+        failed_ids: Set[str] = set()
+        if not chunk_ids:
+            return failed_ids
         
-        print(f"Indexed {len(records)} documents to Algolia")
+        async with httpx.AsyncClient() as client:
+            batch_size = 1000
+            for i in range(0, len(chunk_ids), batch_size):
+                batch = chunk_ids[i:i + batch_size]
+                
+                with METRICS.timer("index_request_seconds", service="algolia", op="delete"):
+                    response = await client.post(
+                        f"{self.algolia_url}/1/indexes/ma3_docs/batch",
+                        headers={
+                            "X-Algolia-Application-Id": self.algolia_app_id,
+                            "X-Algolia-API-Key": self.algolia_api_key,
+                        },
+                        json={"requests": [
+                            {"action": "deleteObject", "body": {"objectID": chunk_id}}
+                            for chunk_id in batch
+                        ]},
+                        timeout=30
+                    )
+                
+                if response.status_code != 200:
+                    METRICS.inc("index_request_errors", service="algolia", op="delete")
+                    print(f"Algolia delete error: {response.text}")
+                    failed_ids.update(batch)
+        
+        print(f"Deleted {len(chunk_ids) - len(failed_ids)} stale records from Algolia")
+        return failed_ids
 
 async def main():
     parser = argparse.ArgumentParser(description='Index grandMA3 documentation')
     parser.add_argument('--version', default='2.3', help='grandMA3 version')
+    parser.add_argument('--versions',
+                        help='Comma-separated versions indexed concurrently; chunks with text '
+                             'identical across versions are embedded once (overrides --version)')
     parser.add_argument('--input', default='./data', help='Input directory')
+    parser.add_argument('--full', action='store_true',
+                        help='Re-index every chunk instead of only the delta, and delete this '
+                             'version\'s stored chunks that are not in the crawl (also done when '
+                             'there is no index state)')
+    parser.add_argument('--max-delete-ratio', type=float, default=0.5,
+                        help='Skip deletes when more than this share of indexed chunks disappeared')
+    parser.add_argument('--embedding-cache', default='./data/cache/embeddings.sqlite',
+                        help='Path of the persistent embedding cache')
+    parser.add_argument('--no-embedding-cache', action='store_true', help='Disable the embedding cache')
+    parser.add_argument('--cache-max-mb', type=int, default=512,
+                        help='Evict least recently used embeddings above this size')
+    parser.add_argument('--embed-batch-tokens', type=int, default=100_000,
+                        help='Maximum estimated tokens per embeddings request')
+    parser.add_argument('--embed-batch-size', type=int, default=512,
+                        help='Maximum inputs per embeddings request (at most 2048)')
+    parser.add_argument('--embed-concurrency', type=int, default=4,
+                        help='Concurrent embeddings requests')
+    parser.add_argument('--embed-max-retries', type=int, default=6,
+                        help='Retries on 429, 5xx and connection errors')
+    parser.add_argument('--embed-backoff-base', type=float, default=1.0,
+                        help='Base delay in seconds for exponential backoff')
+    parser.add_argument('--embed-backoff-max', type=float, default=60.0,
+                        help='Maximum backoff delay in seconds')
+    parser.add_argument('--queue-size', type=int, default=4,
+                        help='Batches buffered between pipeline stages')
+    parser.add_argument('--upsert-concurrency', type=int, default=2,
+                        help='Concurrent Upstash upsert requests')
+    parser.add_argument('--max-chunk-tokens', type=int, default=500,
+                        help='Token budget per chunk')
+    parser.add_argument('--dedupe-threshold', type=float, default=0.9,
+                        help='Collapse chunks with at least this estimated similarity (0 disables)')
+    parser.add_argument('--export-vectors', metavar='DIR',
+                        help='Also write every chunk vector to DIR/<version> for local_index.py '
+                             '(unchanged chunks come from the embedding cache)')
+    parser.add_argument('--dimensions', type=int, choices=(256, 512, 768, 1024, 1536), default=1536,
+                        help='Embedding dimensions; changing it re-indexes every chunk into an index '
+                             'of that dimension (see scripts/dimension_report.py)')
+    parser.add_argument('--export-quantization', choices=QUANTIZATIONS, default='float32',
+                        help='Storage of exported vectors: float32, int8 (per-vector scale) or '
+                             'binary (sign bits)')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Lowest memory: one batch in flight per stage (overrides concurrency)')
+    parser.add_argument('--metrics-file',
+                        help='Write per-stage timings and counters here (JSON, or Prometheus text for .prom)')
     
     args = parser.parse_args()
     
-    indexer = DocumentIndexer(version=args.version)
-    await indexer.index_documents(input_dir=args.input)
+    if args.streaming:
+        args.queue_size = 1
+        args.embed_concurrency = 1
+        args.upsert_concurrency = 1
+    
+    versions = [v.strip() for v in args.versions.split(",") if v.strip()] if args.versions else [args.version]
+    versions = list(dict.fromkeys(versions))
+    embedding_cache = None
+    if not args.no_embedding_cache:
+        embedding_cache = EmbeddingCache(args.embedding_cache, max_bytes=args.cache_max_mb * 1024 * 1024)
+    shared_embeddings = {} if len(versions) > 1 else None
+    
+    indexers = [
+        DocumentIndexer(
+            version=version,
+            full=args.full,
+            max_delete_ratio=args.max_delete_ratio,
+            embedding_cache=embedding_cache,
+            embed_batch_tokens=args.embed_batch_tokens,
+            embed_batch_size=args.embed_batch_size,
+            embed_concurrency=args.embed_concurrency,
+            embed_max_retries=args.embed_max_retries,
+            embed_backoff_base=args.embed_backoff_base,
+            embed_backoff_max=args.embed_backoff_max,
+            queue_size=args.queue_size,
+            upsert_concurrency=args.upsert_concurrency,
+            dedupe_threshold=args.dedupe_threshold,
+            max_chunk_tokens=args.max_chunk_tokens,
+            shared_embeddings=shared_embeddings,
+            export_dir=args.export_vectors,
+            embedding_dimensions=args.dimensions,
+            export_quantization=args.export_quantization,
+        )
+        for version in versions
+    ]
+    METRICS.labels.update(script="index", versions=",".join(versions))
+    try:
+        await gather_or_cancel(*(indexer.index_documents(input_dir=args.input) for indexer in indexers))
+    finally:
+        if embedding_cache:
+            embedding_cache.close()
+        METRICS.print_summary()
+        if args.metrics_file:
+            METRICS.write(args.metrics_file)
+    if len(indexers) > 1:
+        report_version_overlap(indexers)
+
+
+def report_version_overlap(indexers: List[DocumentIndexer]):
+    """Share of each later version's chunks whose text already exists in an earlier one"""
+    for i, earlier in enumerate(indexers):
+        for later in indexers[i + 1:]:
+            shared = len(later.text_hashes & earlier.text_hashes)
+            ratio = shared / len(later.text_hashes) if later.text_hashes else 0.0
+            print(f"Dedupe {earlier.version} -> {later.version}: {shared} of "
+                  f"{len(later.text_hashes)} chunks identical ({ratio:.1%})")
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
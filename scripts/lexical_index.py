@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Local BM25 lexical index
+Inverted index over chunk records with varint-compressed postings in a single
+memory-mapped file, so lexical search and CI evaluation run without Algolia
+"""
+
+import json
+import math
+import re
+import argparse
+import random
+import struct
+import time
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import docstore
+from backup_vector import RECORDS_FILE
+from metrics import percentile
+
+MAGIC = b"LDBM25\x00\x01"
+
+# Command keywords like At, Thru, If, On and Off are deliberately not stopwords
+STOPWORDS = {
+    "a", "an", "the", "of", "to", "in", "is", "are", "be", "for", "this", "that",
+    "with", "as", "by", "it", "can", "you", "your", "will", "was", "from",
+}
+
+TOKEN_RE = re.compile(r"""
+    (?P<option>/[A-Za-z][\w-]*)                 # command options: /merge, /overwrite
+  | (?P<placeholder>\[[A-Za-z][\w ]{0,30}\])    # syntax placeholders: [Object], [Destination]
+  | (?P<number>\d+(?:\.\d+)*)                   # IDs and addresses: 1, 101.2, 1.2.3
+  | (?P<word>[A-Za-z][A-Za-z0-9_]*(?:[+-](?![A-Za-z0-9]))?)  # words; Go+ and Go- stay distinct
+""", re.VERBOSE)
+_SPACE_ONLY = re.compile(r"\s+")
+
+
+def _fold(word: str) -> str:
+    """Lowercase and fold simple plurals (fixtures -> fixture)"""
+    word = word.lower()
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Terms of a text, keeping grandMA3 syntax intact
+
+    Options (/merge) and placeholders ([Object]) are single terms, and a
+    keyword directly followed by a number (Sequence 1) also yields the pair
+    as one term, so exact object references outrank loose mentions.
+    """
+    terms = []
+    previous_word: Optional[str] = None
+    previous_end = -1
+    for match in TOKEN_RE.finditer(text):
+        kind = match.lastgroup
+        value = match.group()
+        if kind == "word":
+            term = _fold(value)
+            previous_word, previous_end = term, match.end()
+            if term not in STOPWORDS:
+                terms.append(term)
+            continue
+        if kind == "number" and previous_word is not None and \
+                _SPACE_ONLY.fullmatch(text[previous_end:match.start()] or " "):
+            terms.append(f"{previous_word} {value}")
+        terms.append(value.lower())
+        previous_word = None
+    return terms
+
+
+def encode_varints(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """LEB128 bytes of non-negative integers, and the byte length of each"""
+    values = values.astype(np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28, 35):
+        lengths += values >= (1 << shift)
+    out = np.zeros(int(lengths.sum()), dtype=np.uint8)
+    starts = np.cumsum(lengths) - lengths
+    for j in range(int(lengths.max()) if len(values) else 0):
+        present = lengths > j
+        chunk = ((values[present] >> np.uint64(7 * j)) & np.uint64(0x7F)).astype(np.uint8)
+        chunk |= np.where(lengths[present] > j + 1, 0x80, 0).astype(np.uint8)
+        out[starts[present] + j] = chunk
+    return out, lengths
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty_like(ends)
+    starts[0:1] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts + 1
+    values = np.zeros(len(ends), dtype=np.uint64)
+    for j in range(int(lengths.max()) if len(ends) else 0):
+        present = lengths > j
+        values[present] |= (data[starts[present] + j] & 0x7F).astype(np.uint64) << np.uint64(7 * j)
+    return values
+
+
+def iter_chunk_records(sources: Sequence[Path]) -> Iterator[Dict]:
+    """Chunk records from Algolia snapshots/restores or vector backups/exports"""
+    for source in sources:
+        path = source / RECORDS_FILE if source.is_dir() else source
+        for record in docstore.iter_documents(path):
+            # Vector records carry the chunk fields in their metadata
+            fields = record.get("metadata") or record
+            code_blocks = fields.get("code_blocks") or ""
+            yield {
+                "id": record.get("objectID") or record.get("id"),
+                "text": fields.get("text", ""),
+                "url": fields.get("url", ""),
+                "title": fields.get("title", ""),
+                "section_path": fields.get("section_path", ""),
+                "version": fields.get("version", ""),
+                "code_blocks": " ".join(code_blocks) if isinstance(code_blocks, list) else code_blocks,
+            }
+
+
+def _write_array(f, arrays: Dict[str, Dict], name: str, values: np.ndarray):
+    # Every array starts 8-byte aligned so it can be viewed in place
+    f.write(b"\x00" * (-f.tell() % 8))
+    arrays[name] = {"dtype": values.dtype.str, "offset": f.tell(), "count": int(values.size)}
+    f.write(values.tobytes())
+
+
+def build_index(records: Iterable[Dict], output: Path, title_weight: int = 2,
+                k1: float = 1.2, b: float = 0.75) -> Dict:
+    """Write the index file; returns its header
+
+    Title and section path count `title_weight` times. Postings are
+    (doc ID gap, term frequency) pairs, varint-encoded per term.
+    """
+    start = time.monotonic()
+    postings: Dict[str, Tuple[array, array]] = {}
+    doc_lengths = array("I")
+    doc_versions = array("H")
+    versions: Dict[str, int] = {}
+    doc_blob = bytearray()
+    doc_offsets = array("Q", [0])
+
+    for doc_id, record in enumerate(records):
+        terms = tokenize(record["text"]) + tokenize(record["code_blocks"])
+        terms += tokenize(record["section_path"] or record["title"]) * title_weight
+        doc_lengths.append(len(terms))
+        doc_versions.append(versions.setdefault(record["version"], len(versions)))
+        for term, tf in Counter(terms).items():
+            entry = postings.get(term)
+            if entry is None:
+                entry = postings[term] = (array("I"), array("I"))
+            entry[0].append(doc_id)
+            entry[1].append(tf)
+        stored = {key: record[key] for key in ("id", "url", "title", "section_path", "version", "text")}
+        doc_blob += json.dumps(stored, ensure_ascii=False).encode()
+        doc_offsets.append(len(doc_blob))
+
+    # Terms sorted by their UTF-8 bytes, so lookups can binary-search the blob
+    encoded_terms = sorted((term.encode(), term) for term in postings)
+    term_blob = b"".join(encoded for encoded, _ in encoded_terms)
+    term_offsets = np.zeros(len(encoded_terms) + 1, dtype=np.uint64)
+    np.cumsum([len(encoded) for encoded, _ in encoded_terms], out=term_offsets[1:])
+    df = np.array([len(postings[term][0]) for _, term in encoded_terms], dtype=np.uint32)
+
+    pairs = []
+    for _, term in encoded_terms:
+        docs, tfs = postings.pop(term)
+        docs = np.frombuffer(docs, dtype=np.uint32).astype(np.int64)
+        gaps = np.diff(docs, prepend=0)
+        pairs.append(np.column_stack([gaps, np.frombuffer(tfs, dtype=np.uint32)]).ravel())
+    values = np.concatenate(pairs) if pairs else np.zeros(0, dtype=np.int64)
+    encoded, lengths = encode_varints(values)
+    # Byte offset where each term's pairs start
+    value_ends = np.cumsum(df.astype(np.int64) * 2)
+    byte_ends = np.cumsum(lengths)[value_ends - 1] if len(values) else np.zeros(0, dtype=np.int64)
+    posting_offsets = np.concatenate([[0], byte_ends]).astype(np.uint64)
+
+    lengths_np = np.frombuffer(doc_lengths, dtype=np.uint32)
+    header = {
+        "documents": len(doc_lengths),
+        "terms": len(encoded_terms),
+        "avg_length": float(lengths_np.mean()) if len(lengths_np) else 0.0,
+        "k1": k1,
+        "b": b,
+        "versions": list(versions),
+        "arrays": {},
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output.with_name(output.name + ".tmp")
+    # The header's array offsets are only known after writing, so it has a
+    # fixed-size slot that is filled in last
+    header_slot = 4096
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + b"\x00" * (8 + header_slot))
+        for name, values_array in (
+            ("doc_lengths", lengths_np),
+            ("doc_versions", np.frombuffer(doc_versions, dtype=np.uint16)),
+            ("doc_offsets", np.frombuffer(doc_offsets, dtype=np.uint64)),
+            ("doc_blob", np.frombuffer(bytes(doc_blob), dtype=np.uint8)),
+            ("term_offsets", term_offsets),
+            ("term_blob", np.frombuffer(term_blob, dtype=np.uint8)),
+            ("df", df),
+            ("posting_offsets", posting_offsets),
+            ("posting_data", encoded),
+        ):
+            _write_array(f, header["arrays"], name, values_array)
+        header_bytes = json.dumps(header).encode()
+        if len(header_bytes) > header_slot:
+            raise ValueError("Index header too large")
+        f.seek(len(MAGIC))
+        f.write(struct.pack("<Q", len(header_bytes)) + header_bytes)
+    tmp_path.replace(output)
+
+    size_mb = output.stat().st_size / 1e6
+    print(f"Indexed {header['documents']} chunks, {header['terms']} terms, "
+          f"{len(values) // 2} postings ({len(encoded) / max(1, len(values) // 2):.2f} bytes each) "
+          f"into {output} ({size_mb:.1f} MB) in {time.monotonic() - start:.1f}s")
+    return header
+
+
+class LexicalIndex:
+    """BM25 search over an index file, read through one memory map
+
+    Only the header is parsed on open; terms are found by binary search in
+    the sorted term blob and their postings decoded on demand.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._map = np.memmap(self.path, dtype=np.uint8, mode="r")
+        if bytes(self._map[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a lexical index")
+        (header_len,) = struct.unpack("<Q", bytes(self._map[len(MAGIC):len(MAGIC) + 8]))
+        start = len(MAGIC) + 8
+        self.header = json.loads(bytes(self._map[start:start + header_len]))
+        for name, spec in self.header["arrays"].items():
+            setattr(self, name, np.frombuffer(self._map, dtype=np.dtype(spec["dtype"]),
+                                              count=spec["count"], offset=spec["offset"]))
+        self.version_codes = {version: code for code, version in enumerate(self.header["versions"])}
+        self._doc_norm = None
+
+    def __len__(self) -> int:
+        return self.header["documents"]
+
+    def _term_id(self, term: str) -> Optional[int]:
+        key = term.encode()
+        low, high = 0, self.header["terms"]
+        while low < high:
+            middle = (low + high) // 2
+            found = bytes(self.term_blob[self.term_offsets[middle]:self.term_offsets[middle + 1]])
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Doc IDs and term frequencies of a term"""
+        term_id = self._term_id(term)
+        if term_id is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        data = self.posting_data[self.posting_offsets[term_id]:self.posting_offsets[term_id + 1]]
+        pairs = decode_varints(data).astype(np.int64).reshape(-1, 2)
+        return np.cumsum(pairs[:, 0]), pairs[:, 1]
+
+    def search(self, query: str, k: int = 10, version: Optional[str] = None) -> List[Tuple[int, float]]:
+        """(doc ID, BM25 score) of the k best chunks, best first"""
+        k1, b = self.header["k1"], self.header["b"]
+        if self._doc_norm is None:
+            # Per-document part of the BM25 denominator, computed once
+            self._doc_norm = (k1 * (1 - b + b * self.doc_lengths / max(self.header["avg_length"], 1e-9))
+                              ).astype(np.float32)
+        documents = len(self)
+        scores = np.zeros(documents, dtype=np.float32)
+        for term in set(tokenize(query)):
+            docs, tfs = self.postings(term)
+            if not len(docs):
+                continue
+            idf = math.log(1 + (documents - len(docs) + 0.5) / (len(docs) + 0.5))
+            # Doc IDs are unique within a posting list, so plain fancy-index adds are safe
+            scores[docs] += idf * tfs * (k1 + 1) / (tfs + self._doc_norm[docs])
+        if version is not None:
+            code = self.version_codes.get(version)
+            if code is None:
+                return []
+            scores[self.doc_versions != code] = 0
+        candidates = np.flatnonzero(scores)
+        if not len(candidates):
+            return []
+        k = min(k, len(candidates))
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(doc), float(scores[doc])) for doc in top]
+
+    def document(self, doc_id: int) -> Dict:
+        return json.loads(bytes(self.doc_blob[self.doc_offsets[doc_id]:self.doc_offsets[doc_id + 1]]))
+
+
+def benchmark(index: LexicalIndex, golden_path: Optional[Path], sampled: int = 500, k: int = 10,
+              seed: int = 0):
+    """Query latency over golden queries plus queries sampled from the corpus
+
+    Golden queries also report how many of their expected keywords appear in
+    the top results, a network-free proxy for lexical recall.
+    """
+    queries: List[Tuple[str, Optional[str]]] = []
+    golden = []
+    if golden_path and golden_path.exists():
+        with open(golden_path, 'r') as f:
+            golden = [q for q in json.load(f)["queries"] if not q.get("should_refuse")]
+        queries += [(q["query"], q.get("version")) for q in golden]
+    rng = random.Random(seed)
+    for _ in range(sampled):
+        words = index.document(rng.randrange(len(index)))["text"].split()
+        if len(words) >= 4:
+            position = rng.randrange(len(words) - 3)
+            queries.append((" ".join(words[position:position + rng.randint(2, 4)]), None))
+
+    latencies = []
+    for query, version in queries:
+        started = time.perf_counter()
+        index.search(query, k=k, version=version)
+        latencies.append((time.perf_counter() - started) * 1000)
+    print(f"{len(index)} chunks, {index.header['terms']} terms, {len(queries)} queries, k={k}")
+    print(f"  latency p50 {percentile(latencies, 50):.2f}ms, p95 {percentile(latencies, 95):.2f}ms, "
+          f"p99 {percentile(latencies, 99):.2f}ms, {len(queries) / (sum(latencies) / 1000):.0f} queries/s")
+
+    if golden:
+        coverage = []
+        for q in golden:
+            text = " ".join(index.document(doc)["text"].lower()
+                            for doc, _ in index.search(q["query"], k=5, version=q.get("version")))
+            found = sum(1 for keyword in q["expected_keywords"] if keyword.lower() in text)
+            coverage.append(found / len(q["expected_keywords"]))
+            print(f"  {q['id']}: {found}/{len(q['expected_keywords'])} expected keywords in top 5")
+        print(f"  Keyword coverage: {sum(coverage) / len(coverage):.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build, query and benchmark the local BM25 index')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='Index chunk records')
+    build.add_argument('sources', nargs='+',
+                       help='Algolia snapshots/restores (.jsonl[.gz|.zst]) or vector backup/export directories')
+    build.add_argument('--output', default='./data/lexical.bm25', help='Index file')
+    build.add_argument('--title-weight', type=int, default=2, help='Times the section path counts')
+
+    query = subparsers.add_parser('query', help='Search the index')
+    query.add_argument('text', help='Query text')
+    query.add_argument('--index', default='./data/lexical.bm25', help='Index file')
+    query.add_argument('--version', help='Only return chunks of this grandMA3 version')
+    query.add_argument('-k', type=int, default=5, help='Results to return')
+
+    bench = subparsers.add_parser('bench', help='Measure query latency and keyword coverage')
+    bench.add_argument('--index', default='./data/lexical.bm25', help='Index file')
+    bench.add_argument('--golden', default='./evaluation/golden-queries.json', help='Golden queries file')
+    bench.add_argument('--sampled', type=int, default=500, help='Extra queries sampled from the corpus')
+    bench.add_argument('-k', type=int, default=10, help='Results per query')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        sources = [Path(source) for source in args.sources]
+        build_index(iter_chunk_records(sources), Path(args.output), title_weight=args.title_weight)
+        return
+
+    index = LexicalIndex(args.index)
+    if args.command == 'bench':
+        benchmark(index, Path(args.golden), sampled=args.sampled, k=args.k)
+        return
+
+    started = time.perf_counter()
+    hits = index.search(args.text, k=args.k, version=args.version)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"Terms: {tokenize(args.text)}")
+    for doc_id, score in hits:
+        doc = index.document(doc_id)
+        print(f"{score:7.3f}  {doc['section_path'] or doc['title']}")
+        print(f"         {doc['url']} (v{doc['version']})")
+    print(f"{len(hits)} results in {elapsed_ms:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
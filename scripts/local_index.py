@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Local vector index
+Exact and IVF top-k search over a memory-mapped float32 matrix, built from a
+vector backup (backup_vector.py) or an indexer export (index.py --export-vectors)
+so retrieval can be served without Upstash
+"""
+
+import os
+import gzip
+import json
+import argparse
+import random
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backup_vector import MANIFEST_FILE, RECORDS_FILE, VECTORS_FILE, BackupVectors
+from metrics import percentile
+
+try:
+    import openai
+except ImportError:  # Only needed to embed free-text queries
+    openai = None
+
+META_FILE = "meta.json"
+# Rows scored per matrix product while building, to bound memory
+BLOCK_ROWS = 16_384
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def auto_nlist(rows: int) -> int:
+    """IVF list count: about 4 * sqrt(rows), with at least 39 training points per list"""
+    if rows < 10_000:
+        return 0
+    return min(int(4 * np.sqrt(rows)), rows // 39)
+
+
+def train_ivf(vectors: np.ndarray, nlist: int, train_size: int = 50_000,
+              iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means centroids from a sample of the (unit-length) rows"""
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(len(vectors), size=min(train_size, len(vectors)), replace=False))
+    sample = np.asarray(vectors[sample_rows])
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=nlist)
+        # Empty lists restart from a random sample point
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids.astype(np.float32)
+
+
+def build_index(sources: Sequence[Path], output: Path, nlist: Optional[int] = None,
+                train_size: int = 50_000, iterations: int = 10) -> Dict:
+    """Write a local index from backup/export directories
+
+    Rows are normalized so inner product is cosine similarity, and grouped
+    by IVF list so each list is one contiguous slice of the matrix. Record
+    metadata stays in a JSONL file read by byte offset for the top-k only.
+    """
+    start = time.monotonic()
+    output.mkdir(parents=True, exist_ok=True)
+    # Quantized exports are expanded back to float32 block by block
+    matrices = [BackupVectors(source) for source in sources]
+    dimensions = {matrix.shape[1] for matrix in matrices}
+    if len(dimensions) != 1:
+        raise ValueError(f"Sources have different dimensions: {sorted(dimensions)}")
+    dimension = dimensions.pop()
+    rows = sum(len(matrix) for matrix in matrices)
+
+    # Normalized copy in source order, plus records and their byte offsets
+    unordered_path = output / (VECTORS_FILE + ".unordered")
+    unordered = np.lib.format.open_memmap(unordered_path, mode="w+", dtype=np.float32, shape=(rows, dimension))
+    offsets = np.empty(rows, dtype=np.int64)
+    version_codes = np.empty(rows, dtype=np.int16)
+    versions: Dict[str, int] = {}
+    row = 0
+    offset = 0
+    with open(output / "records.jsonl", "wb") as records_out:
+        for source, matrix in zip(sources, matrices):
+            for i in range(0, len(matrix), BLOCK_ROWS):
+                block = np.asarray(matrix[i:i + BLOCK_ROWS], dtype=np.float32)
+                unordered[row + i:row + i + len(block)] = normalize(block)
+            with gzip.open(source / RECORDS_FILE, "rt", encoding="utf-8") as records_in:
+                for line in records_in:
+                    record = json.loads(line)
+                    version = (record.get("metadata") or {}).get("version", "")
+                    version_codes[row] = versions.setdefault(version, len(versions))
+                    offsets[row] = offset
+                    encoded = (json.dumps(record, ensure_ascii=False) + "\n").encode()
+                    records_out.write(encoded)
+                    offset += len(encoded)
+                    row += 1
+    if row != rows:
+        raise ValueError(f"Records and vectors disagree: {row} records for {rows} vectors")
+
+    if nlist is None:
+        nlist = auto_nlist(rows)
+    order = np.arange(rows)
+    if nlist:
+        centroids = train_ivf(unordered, nlist, train_size=train_size, iterations=iterations)
+        assignment = np.empty(rows, dtype=np.int32)
+        for i in range(0, rows, BLOCK_ROWS):
+            assignment[i:i + BLOCK_ROWS] = np.argmax(unordered[i:i + BLOCK_ROWS] @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))])
+        np.save(output / "centroids.npy", centroids)
+        np.save(output / "list_offsets.npy", list_offsets.astype(np.int64))
+
+    if nlist:
+        vectors = np.lib.format.open_memmap(output / VECTORS_FILE, mode="w+", dtype=np.float32,
+                                            shape=(rows, dimension))
+        for i in range(0, rows, BLOCK_ROWS):
+            vectors[i:i + BLOCK_ROWS] = unordered[order[i:i + BLOCK_ROWS]]
+        vectors.flush()
+        del vectors, unordered
+        unordered_path.unlink()
+    else:
+        unordered.flush()
+        del unordered
+        unordered_path.replace(output / VECTORS_FILE)
+    np.save(output / "offsets.npy", offsets[order])
+    np.save(output / "versions.npy", version_codes[order])
+
+    meta = {
+        "rows": rows,
+        "dimension": dimension,
+        "versions": list(versions),
+        "nlist": nlist,
+        "sources": [str(source) for source in sources],
+    }
+    for source in sources:
+        manifest_path = source / MANIFEST_FILE
+        if manifest_path.exists():
+            with open(manifest_path, 'r') as f:
+                model = json.load(f).get("model")
+            if model:
+                meta["model"] = model
+    with open(output / META_FILE, 'w') as f:
+        json.dump(meta, f, indent=2)
+    print(f"Built local index of {rows} vectors ({dimension} dimensions, "
+          f"{'IVF with ' + str(nlist) + ' lists' if nlist else 'brute force only'}) "
+          f"in {output} in {time.monotonic() - start:.1f}s")
+    return meta
+
+
+class LocalIndex:
+    """Top-k cosine search over a built index
+
+    Brute force scores every row of the memory-mapped matrix; with nprobe,
+    only the rows of the nprobe IVF lists nearest the query are scored.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / META_FILE, 'r') as f:
+            self.meta = json.load(f)
+        self.vectors = np.load(self.path / VECTORS_FILE, mmap_mode="r")
+        self.offsets = np.load(self.path / "offsets.npy")
+        self.versions = np.load(self.path / "versions.npy")
+        self.version_codes = {version: code for code, version in enumerate(self.meta["versions"])}
+        self.centroids = None
+        self.list_offsets = None
+        if self.meta["nlist"]:
+            self.centroids = np.load(self.path / "centroids.npy")
+            self.list_offsets = np.load(self.path / "list_offsets.npy")
+        self._records = open(self.path / "records.jsonl", "rb")
+
+    def __len__(self) -> int:
+        return self.meta["rows"]
+
+    def _candidates(self, query: np.ndarray, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        lists = np.argpartition(-(self.centroids @ query), min(nprobe, len(self.centroids)) - 1)[:nprobe]
+        rows = np.concatenate([np.arange(self.list_offsets[l], self.list_offsets[l + 1]) for l in lists])
+        scores = np.concatenate([
+            self.vectors[self.list_offsets[l]:self.list_offsets[l + 1]] @ query for l in lists
+        ])
+        return rows, scores
+
+    def search(self, query: Sequence[float], k: int = 10, version: Optional[str] = None,
+               nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """(row, score) of the k nearest rows, best first"""
+        query = normalize(np.asarray(query, dtype=np.float32))
+        if nprobe and self.centroids is not None:
+            rows, scores = self._candidates(query, nprobe)
+        else:
+            rows, scores = None, self.vectors @ query
+        if version is not None:
+            code = self.version_codes.get(version)
+            if code is None:
+                return []
+            versions = self.versions if rows is None else self.versions[rows]
+            scores = np.where(versions == code, scores, -np.inf)
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        top = top[np.isfinite(scores[top])]
+        hits = top if rows is None else rows[top]
+        return [(int(row), float(score)) for row, score in zip(hits, scores[top])]
+
+    def record(self, row: int) -> Dict:
+        self._records.seek(int(self.offsets[row]))
+        return json.loads(self._records.readline())
+
+    def find(self, vector_id: str) -> Optional[int]:
+        """Row of a vector ID (a scan of the records file)"""
+        self._records.seek(0)
+        offset = 0
+        for line in self._records:
+            if json.loads(line)["id"] == vector_id:
+                return int(np.flatnonzero(self.offsets == offset)[0])
+            offset += len(line)
+        return None
+
+    def close(self):
+        self._records.close()
+
+
+def benchmark(index: LocalIndex, queries: int = 200, k: int = 10, nprobes: Sequence[int] = (1, 4, 16),
+              version: Optional[str] = None, noise: float = 0.05, seed: int = 0):
+    """Latency of brute force and IVF search, and IVF recall@k against brute force
+
+    Queries are stored vectors with Gaussian noise, so they land near but not
+    exactly on an indexed row.
+    """
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    rows = [rng.randrange(len(index)) for _ in range(queries)]
+    query_vectors = [
+        np.asarray(index.vectors[row]) + np_rng.normal(0, noise / np.sqrt(index.meta["dimension"]),
+                                                         index.meta["dimension"]).astype(np.float32)
+        for row in rows
+    ]
+
+    def timed(nprobe):
+        latencies, results = [], []
+        for query in query_vectors:
+            started = time.perf_counter()
+            results.append({row for row, _ in index.search(query, k, version=version, nprobe=nprobe)})
+            latencies.append((time.perf_counter() - started) * 1000)
+        return latencies, results
+
+    exact_latencies, exact = timed(None)
+    print(f"{len(index)} vectors, {index.meta['dimension']} dimensions, {queries} queries, k={k}"
+          + (f", version {version}" if version else ""))
+    print(f"  brute force: p50 {percentile(exact_latencies, 50):.2f}ms, "
+          f"p95 {percentile(exact_latencies, 95):.2f}ms, recall@{k} 1.000")
+    if index.centroids is None:
+        print("  (no IVF lists; rebuild with --nlist to compare)")
+        return
+    for nprobe in nprobes:
+        latencies, results = timed(nprobe)
+        recall = sum(len(found & truth) / max(1, len(truth)) for found, truth in zip(results, exact)) / queries
+        print(f"  IVF nprobe={nprobe} of {index.meta['nlist']}: p50 {percentile(latencies, 50):.2f}ms, "
+              f"p95 {percentile(latencies, 95):.2f}ms, recall@{k} {recall:.3f}")
+
+
+def embed_query(text: str, dimension: int, model: str) -> List[float]:
+    if openai is None:
+        raise RuntimeError("Free-text queries need the openai package: pip install openai")
+    client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return client.embeddings.create(model=model, input=text, dimensions=dimension).data[0].embedding
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build, query and benchmark a local vector index')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='Build an index from vector backups or indexer exports')
+    build.add_argument('sources', nargs='+', help='Directories written by backup_vector.py or --export-vectors')
+    build.add_argument('--output', default='./data/local_index', help='Index directory')
+    build.add_argument('--nlist', type=int, help='IVF lists (0 for brute force only; default by corpus size)')
+    build.add_argument('--train-size', type=int, default=50_000, help='Rows sampled to train IVF centroids')
+    build.add_argument('--iterations', type=int, default=10, help='k-means iterations')
+
+    query = subparsers.add_parser('query', help='Search the index')
+    query.add_argument('text', nargs='?', help='Query text (embedded with OpenAI)')
+    query.add_argument('--vector-id', help='Use a stored vector as the query instead of text')
+    query.add_argument('--index', default='./data/local_index', help='Index directory')
+    query.add_argument('--version', help='Only return chunks of this grandMA3 version')
+    query.add_argument('-k', type=int, default=5, help='Results to return')
+    query.add_argument('--nprobe', type=int, help='IVF lists to search (default: brute force)')
+
+    bench = subparsers.add_parser('bench', help='Measure latency and IVF recall')
+    bench.add_argument('--index', default='./data/local_index', help='Index directory')
+    bench.add_argument('--queries', type=int, default=200, help='Number of queries')
+    bench.add_argument('-k', type=int, default=10, help='Results per query')
+    bench.add_argument('--nprobe', default='1,4,16', help='Comma-separated IVF nprobe values')
+    bench.add_argument('--version', help='Filter queries to this version')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_index([Path(source) for source in args.sources], Path(args.output), nlist=args.nlist,
+                    train_size=args.train_size, iterations=args.iterations)
+        return
+
+    index = LocalIndex(args.index)
+    try:
+        if args.command == 'bench':
+            benchmark(index, queries=args.queries, k=args.k, version=args.version,
+                      nprobes=[int(n) for n in args.nprobe.split(",")])
+            return
+
+        if args.vector_id:
+            row = index.find(args.vector_id)
+            if row is None:
+                raise SystemExit(f"No vector with ID {args.vector_id}")
+            vector = index.vectors[row]
+        elif args.text:
+            vector = embed_query(args.text, index.meta["dimension"],
+                                 index.meta.get("model", "text-embedding-3-small"))
+        else:
+            raise SystemExit("Give query text or --vector-id")
+
+        started = time.perf_counter()
+        hits = index.search(vector, k=args.k, version=args.version, nprobe=args.nprobe)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for row, score in hits:
+            metadata = index.record(row).get("metadata") or {}
+            print(f"{score:.4f}  {metadata.get('section_path') or metadata.get('title', '')}")
+            print(f"        {metadata.get('url', '')} (v{metadata.get('version', '?')})")
+        print(f"{len(hits)} results in {elapsed_ms:.1f}ms")
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Run metrics for the crawl, index and backup scripts
+Timers collect the latency of every call to a hot step and counters track
+retries, bytes and tokens. Each script writes one summary per run with
+--metrics-file: JSON, or the Prometheus textfile format for a .prom path
+"""
+
+import json
+import math
+import resource
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+# Percentiles reported for every timer
+QUANTILES = (50, 95, 99)
+# Prefix of every Prometheus metric name
+PROMETHEUS_PREFIX = "lumdoc_"
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: object) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile, q in [0, 100]; every report uses this one definition"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+class Metrics:
+    """Timers and counters keyed by name and labels
+
+    Every timed call is kept (8 bytes each), so percentiles are exact for
+    the run rather than estimated from buckets.
+    """
+
+    def __init__(self):
+        self.timers: Dict[Tuple[str, LabelKey], array] = {}
+        self.counters: Dict[Tuple[str, LabelKey], float] = {}
+        # Labels of the whole run, such as the script and versions
+        self.labels: Dict[str, str] = {}
+        self.started = time.time()
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, _label_key(labels))
+        samples = self.timers.get(key)
+        if samples is None:
+            samples = self.timers[key] = array("d")
+        samples.append(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Time the block, including when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = (name, _label_key(labels))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def summary(self) -> Dict:
+        timers: Dict[str, List[Dict]] = {}
+        for (name, labels), samples in sorted(self.timers.items()):
+            ordered = sorted(samples)
+            entry = {
+                "labels": dict(labels),
+                "count": len(ordered),
+                "sum": sum(ordered),
+                "max": ordered[-1],
+            }
+            for q in QUANTILES:
+                entry[f"p{q}"] = percentile(ordered, q)
+            timers.setdefault(name, []).append(entry)
+        counters: Dict[str, List[Dict]] = {}
+        for (name, labels), value in sorted(self.counters.items()):
+            counters.setdefault(name, []).append({"labels": dict(labels), "value": value})
+        finished = time.time()
+        return {
+            "labels": dict(self.labels),
+            "started": datetime.fromtimestamp(self.started).isoformat(),
+            "finished": datetime.fromtimestamp(finished).isoformat(),
+            "duration_seconds": finished - self.started,
+            "timers": timers,
+            "counters": counters,
+        }
+
+    def to_prometheus(self) -> str:
+        """Textfile collector format: timers as summaries, counters as counters"""
+        summary = self.summary()
+        lines = []
+
+        def series(name: str, labels: Dict[str, str], value: float) -> str:
+            merged = {**self.labels, **labels}
+            if not merged:
+                return f"{name} {value!r}"
+            escaped = ",".join(f'{key}="{_escape(val)}"' for key, val in sorted(merged.items()))
+            return f"{name}{{{escaped}}} {value!r}"
+
+        for name, entries in summary["timers"].items():
+            metric = PROMETHEUS_PREFIX + name
+            lines.append(f"# TYPE {metric} summary")
+            for entry in entries:
+                for q in QUANTILES:
+                    lines.append(series(metric, {**entry["labels"], "quantile": str(q / 100)}, entry[f"p{q}"]))
+                lines.append(series(metric + "_sum", entry["labels"], entry["sum"]))
+                lines.append(series(metric + "_count", entry["labels"], entry["count"]))
+        for name, entries in summary["counters"].items():
+            metric = PROMETHEUS_PREFIX + name + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(series(metric, entry["labels"], entry["value"]) for entry in entries)
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}run_duration_seconds gauge")
+        lines.append(series(f"{PROMETHEUS_PREFIX}run_duration_seconds", {}, summary["duration_seconds"]))
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}run_finished_timestamp_seconds gauge")
+        lines.append(series(f"{PROMETHEUS_PREFIX}run_finished_timestamp_seconds", {}, time.time()))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the run summary, replacing the file atomically so collectors never read half of it"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'w') as f:
+            if path.suffix == ".prom":
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.summary(), f, indent=2)
+        tmp_path.replace(path)
+        print(f"Wrote run metrics to {path}")
+
+    def print_summary(self):
+        if not self.timers:
+            return
+        print("Timings (p50 / p95 / max, count):")
+        for name, entries in self.summary()["timers"].items():
+            for entry in entries:
+                labels = ",".join(f"{key}={value}" for key, value in entry["labels"].items())
+                print(f"  {name}{'{' + labels + '}' if labels else ''}: "
+                      f"{entry['p50'] * 1000:.1f} / {entry['p95'] * 1000:.1f} / {entry['max'] * 1000:.1f}ms, "
+                      f"{entry['count']}")
+
+
+# Shared by every module of a script run
+METRICS = Metrics()
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the external services used by the crawl, index and backup scripts
+Serves an OpenAI-compatible embeddings endpoint, the Upstash Vector REST
+endpoints (upsert, delete, range, fetch, info), the Algolia batch, browse,
+clear and settings endpoints, and a synthetic copy of the docs site for
+offline testing
+
+Point the scripts at it with:
+    DOCS_BASE_URL=http://localhost:8900 python scripts/crawl.py --fetch-mode static
+    OPENAI_BASE_URL=http://localhost:8900/v1 OPENAI_API_KEY=test \
+    UPSTASH_VECTOR_REST_URL=http://localhost:8900 UPSTASH_VECTOR_REST_TOKEN=test \
+    ALGOLIA_BASE_URL=http://localhost:8900 ALGOLIA_APP_ID=test ALGOLIA_API_KEY=test python scripts/index.py
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from array import array
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+# Vocabulary of the synthetic manual
+TERMS = (
+    "sequence cue executor preset fixture group attribute patch universe dmx fader playback "
+    "macro layout view window page master timing fade delay speed store update merge overwrite "
+    "console session network user profile plugin phaser recipe selection programmer world filter"
+).split()
+KEYWORDS = "Store Go+ Go- Goto Assign Delete Copy Move Label Edit Off On At Thru Fixture Group Preset".split()
+OBJECTS = "Sequence Cue Executor Preset Group Macro Layout Page World Filter".split()
+# Pages whose content differs between versions; the rest are identical
+CHANGED_EVERY = 10
+
+
+def fake_embedding(text: str, dimensions: int) -> List[float]:
+    """Deterministic unit vector derived from the text
+
+    Built from random bytes rather than Gaussian draws, so the mock keeps
+    up with benchmark runs of a few hundred thousand chunks.
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    vector = array("b", random.Random(seed).randbytes(dimensions))
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choice(TERMS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def synthetic_page(version: str, number: int) -> Tuple[str, str]:
+    """Title and HTML of topic `number`, deterministic per version
+
+    Pages have the manual's shape: site chrome inside the content, headings,
+    paragraphs, a table, command examples in <pre> and inline <code>, and
+    links to neighbouring topics. Only every CHANGED_EVERY-th page differs
+    between versions, like a minor release.
+    """
+    seed = f"{version}:{number}" if number % CHANGED_EVERY == 0 else f"topic:{number}"
+    rng = random.Random(seed)
+    title = f"{rng.choice(OBJECTS)} {rng.choice(TERMS).title()} {number}"
+    parts = [f"<h1>{escape(title)}</h1>"]
+    for section in range(rng.randint(2, 5)):
+        parts.append(f"<h2>{rng.choice(TERMS).title()} {rng.choice(TERMS)} {section + 1}</h2>")
+        for _ in range(rng.randint(1, 4)):
+            sentences = " ".join(_sentence(rng, rng.randint(8, 20)) for _ in range(rng.randint(2, 6)))
+            inline = f"{rng.choice(KEYWORDS)} {rng.choice(OBJECTS)} {rng.randint(1, 999)}"
+            parts.append(f"<p>{sentences} Use <code>{inline}</code> for this.</p>")
+        if rng.random() < 0.5:
+            command = (f"{rng.choice(KEYWORDS)} {rng.choice(OBJECTS)} {rng.randint(1, 99)}"
+                       f" {rng.choice(['/merge', '/overwrite', '/remove', ''])}").strip()
+            parts.append(f"<pre>{escape(command)}</pre>")
+        if rng.random() < 0.3:
+            rows = "".join(f"<tr><td>{rng.choice(TERMS)}</td><td>{rng.randint(0, 255)}</td></tr>"
+                           for _ in range(rng.randint(2, 6)))
+            parts.append(f"<table><tr><th>Property</th><th>Value</th></tr>{rows}</table>")
+    links = "".join(f'<a href="t{(number + step) % 100_000}.html">Related {step}</a> '
+                    for step in (1, 7, 31))
+    html = (
+        f"<html><head><title>{escape(title)}</title></head><body>"
+        f'<div class="topic-content"><p>grandMA3 User Manual Home Operate Patch Setup Keyboard Shortcuts '
+        f'Command Syntax Search this manual</p>{"".join(parts)}<p>{links}</p>'
+        f"<p>Copyright MA Lighting Technology GmbH. All rights reserved. Version {escape(version)} "
+        f"Imprint Privacy Contact</p></div>"
+        f"</body></html>"
+    )
+    return title, html
+
+
+def synthetic_toc(pages: int) -> str:
+    links = "".join(f'<a href="t{n}.html">Topic {n}</a>' for n in range(pages))
+    return f'<html><head><title>Help</title></head><body><nav class="toc">{links}</nav></body></html>'
+
+
+class MockState:
+    """Behaviour knobs and request counters shared by all handler threads"""
+
+    def __init__(self, latency_ms: float = 0.0, error_rate: float = 0.0, dimensions: int = 1536,
+                 site_pages: int = 1000):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+        # Upstash Vector index: id -> {"id", "vector", "metadata", "data"}, in insertion order
+        self.dimensions = dimensions
+        self.vectors: Dict[str, Dict] = {}
+        # Algolia indices: name -> objectID -> record, in insertion order
+        self.algolia: Dict[str, Dict[str, Dict]] = {}
+        # Topics per version on the synthetic docs site
+        self.site_pages = site_pages
+
+    def count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    state: MockState = MockState()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload, headers: Dict[str, str] = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def _simulate_conditions(self) -> bool:
+        """Apply configured latency and errors, returns False if an error was sent"""
+        if self.state.latency_ms:
+            time.sleep(self.state.latency_ms / 1000)
+        if self.state.error_rate and random.random() < self.state.error_rate:
+            self.state.count("errors")
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}})
+            return False
+        return True
+
+    def _send_html(self, status: int, body: str, content_type: str = "text/html"):
+        data = body.encode()
+        etag = '"' + hashlib.sha256(data).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle_docs(self, path: str):
+        """/grandMA3/<version>/HTML/{help.html,sitemap.xml,t<n>.html}"""
+        parts = path.split("/")
+        if len(parts) != 5 or parts[3] != "HTML":
+            self._send_json(404, {"error": "not found"})
+            return
+        version, name = parts[2], parts[4]
+        if not self._simulate_conditions():
+            return
+        self.state.count("docs_requests")
+        if name == "help.html":
+            self._send_html(200, synthetic_toc(self.state.site_pages))
+        elif name == "sitemap.xml":
+            base = f"http://{self.headers.get('Host')}/grandMA3/{version}/HTML/"
+            locs = "".join(f"<url><loc>{base}t{n}.html</loc></url>" for n in range(self.state.site_pages))
+            self._send_html(200, '<?xml version="1.0" encoding="UTF-8"?>'
+                                 f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{locs}</urlset>',
+                            content_type="application/xml")
+        elif name.startswith("t") and name.endswith(".html") and name[1:-5].isdigit() \
+                and int(name[1:-5]) < self.state.site_pages:
+            self._send_html(200, synthetic_page(version, int(name[1:-5]))[1])
+        else:
+            self._send_html(404, "<html><body>Not found</body></html>")
+
+    def _handle_algolia_get(self, index: str, action: str, query: Dict[str, List[str]]):
+        if not self._simulate_conditions():
+            return
+        self.state.count(f"algolia_{action}_requests")
+        if action == "settings":
+            self._send_json(200, {"searchableAttributes": ["section_path", "text", "code_blocks"],
+                                  "attributesForFaceting": ["version"]})
+            return
+        if action == "task":
+            # Writes are applied before they are acknowledged
+            self._send_json(200, {"status": "published"})
+            return
+        if action != "browse":
+            self._send_json(404, {"error": "not found"})
+            return
+        # The cursor is an offset into the insertion order
+        start = int((query.get("cursor") or ["0"])[0])
+        hits_per_page = int((query.get("hitsPerPage") or ["1000"])[0])
+        with self.state.lock:
+            records = list(self.state.algolia.get(index, {}).values())
+        page = records[start:start + hits_per_page]
+        payload = {"hits": [dict(record, _highlightResult={}) for record in page],
+                   "nbHits": len(records)}
+        if start + len(page) < len(records):
+            payload["cursor"] = str(start + len(page))
+        self._send_json(200, payload)
+
+    def _handle_algolia_post(self, index: str, action: str):
+        request = self._read_json()
+        if not self._simulate_conditions():
+            return
+        if action not in ("batch", "clear", "operation"):
+            self._send_json(404, {"error": "not found"})
+            return
+        self.state.count(f"algolia_{action}_requests")
+        if action == "batch":
+            self.state.count("algolia_records", len(request["requests"]))
+        with self.state.lock:
+            if action == "operation":
+                # Settings, synonyms and rules aren't modelled, so a scoped copy only creates the index
+                source = self.state.algolia.get(index, {})
+                if request["operation"] == "move":
+                    self.state.algolia[request["destination"]] = self.state.algolia.pop(index, {})
+                else:
+                    self.state.algolia[request["destination"]] = {} if request.get("scope") else dict(source)
+            else:
+                records = self.state.algolia.setdefault(index, {})
+                if action == "clear":
+                    records.clear()
+                for operation in request["requests"] if action == "batch" else []:
+                    body = operation["body"]
+                    if operation["action"] == "deleteObject":
+                        records.pop(body["objectID"], None)
+                    else:
+                        records[body["objectID"]] = body
+        self._send_json(200, {"taskID": 1})
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path.startswith("/grandMA3/"):
+            self._handle_docs(url.path)
+        elif url.path.startswith("/1/indexes/"):
+            _, _, _, index, action = (url.path.split("/") + [""])[:5]
+            self._handle_algolia_get(index, action, parse_qs(url.query))
+        elif self.path == "/stats":
+            with self.state.lock:
+                stats = dict(self.state.counters)
+            # CPU time of the mock itself, to tell when it is the bottleneck of a benchmark
+            stats["cpu_ms"] = int(time.process_time() * 1000)
+            self._send_json(200, stats)
+        elif self.path == "/info":
+            with self.state.lock:
+                count = len(self.state.vectors)
+            self._send_json(200, {"result": {
+                "vectorCount": count,
+                "pendingVectorCount": 0,
+                "indexSize": count * self.state.dimensions * 4,
+                "dimension": self.state.dimensions,
+                "similarityFunction": "COSINE",
+            }})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_DELETE(self):
+        path = self.path.rstrip("/")
+        if not path.startswith("/1/indexes/"):
+            self._send_json(404, {"error": "not found"})
+            return
+        with self.state.lock:
+            self.state.algolia.pop(path.split("/")[3], None)
+        self._send_json(200, {"taskID": 1})
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        upstash_handlers = {
+            "/upsert": self._handle_upsert,
+            "/delete": self._handle_delete,
+            "/range": self._handle_range,
+            "/fetch": self._handle_fetch,
+        }
+        if path.endswith("/embeddings"):
+            self._handle_embeddings()
+        elif path.startswith("/1/indexes/"):
+            _, _, _, index, action = (path.split("/") + [""])[:5]
+            self._handle_algolia_post(index, action)
+        elif path in upstash_handlers:
+            request = self._read_json()
+            if not self._simulate_conditions():
+                return
+            self.state.count(f"upstash_{path[1:]}_requests")
+            with self.state.lock:
+                result = upstash_handlers[path](request)
+            if isinstance(result, tuple):
+                self._send_json(*result)
+            else:
+                self._send_json(200, {"result": result})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def _handle_upsert(self, request):
+        for vector in request if isinstance(request, list) else [request]:
+            if len(vector["vector"]) != self.state.dimensions:
+                return 422, {"error": f"Invalid vector dimension: {len(vector['vector'])}, "
+                                      f"expected: {self.state.dimensions}"}
+            self.state.vectors[vector["id"]] = {
+                "id": vector["id"], "vector": vector["vector"],
+                "metadata": vector.get("metadata"), "data": vector.get("data"),
+            }
+        return "Success"
+
+    def _handle_delete(self, request):
+        ids = request if isinstance(request, list) else request["ids"]
+        deleted = sum(1 for i in ids if self.state.vectors.pop(i, None) is not None)
+        return {"deleted": deleted}
+
+    def _vector_result(self, vector: Dict, request) -> Dict:
+        result = {"id": vector["id"]}
+        if request.get("includeVectors"):
+            result["vector"] = vector["vector"]
+        if request.get("includeMetadata") and vector["metadata"] is not None:
+            result["metadata"] = vector["metadata"]
+        if request.get("includeData") and vector["data"] is not None:
+            result["data"] = vector["data"]
+        return result
+
+    def _handle_range(self, request):
+        # The cursor is an offset into the insertion order
+        start = int(request.get("cursor") or 0)
+        ids = list(self.state.vectors)[start:start + request["limit"]]
+        end = start + len(ids)
+        return {
+            "nextCursor": str(end) if end < len(self.state.vectors) else "",
+            "vectors": [self._vector_result(self.state.vectors[i], request) for i in ids],
+        }
+
+    def _handle_fetch(self, request):
+        return [
+            self._vector_result(self.state.vectors[i], request) if i in self.state.vectors else None
+            for i in request["ids"]
+        ]
+
+    def _handle_embeddings(self):
+        request = self._read_json()
+        if not self._simulate_conditions():
+            return
+
+        inputs = request["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dimensions = request.get("dimensions") or 1536
+        base64_output = request.get("encoding_format") == "base64"
+
+        data = []
+        tokens = 0
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text, dimensions)
+            tokens += len(text) // 4 + 1
+            if base64_output:
+                vector = base64.b64encode(array("f", vector).tobytes()).decode()
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+
+        self.state.count("embedding_requests")
+        self.state.count("embedding_inputs", len(inputs))
+        self.state.count("embedding_tokens", tokens)
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": request.get("model", "text-embedding-3-small"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+
+def serve(port: int, state: MockState) -> ThreadingHTTPServer:
+    """Start the mock server on a background thread"""
+    MockHandler.state = state
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run local mock services for offline testing')
+    parser.add_argument('--port', type=int, default=8900, help='Port to listen on')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Added latency per request')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Share of requests answered with 429')
+    parser.add_argument('--dimensions', type=int, default=1536, help='Dimensions of the mock vector index')
+    parser.add_argument('--site-pages', type=int, default=1000, help='Topics per version on the mock docs site')
+
+    args = parser.parse_args()
+
+    server = serve(args.port, MockState(latency_ms=args.latency_ms, error_rate=args.error_rate,
+                                        dimensions=args.dimensions, site_pages=args.site_pages))
+    print(f"Mock services listening on http://127.0.0.1:{args.port}")
+    print(f"  OpenAI embeddings: OPENAI_BASE_URL=http://127.0.0.1:{args.port}/v1")
+    print(f"  Upstash Vector:    UPSTASH_VECTOR_REST_URL=http://127.0.0.1:{args.port}")
+    print(f"  Algolia:           ALGOLIA_BASE_URL=http://127.0.0.1:{args.port}")
+    print(f"  Docs site:         DOCS_BASE_URL=http://127.0.0.1:{args.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
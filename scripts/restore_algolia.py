@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Restore an Algolia backup written by backup_algolia.py
+Replays the latest full snapshot and the incremental snapshots after it into
+one complete record set, written to a file and optionally pushed to the index
+"""
+
+import os
+import argparse
+import asyncio
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+import httpx
+
+import docstore
+from backup_algolia import load_chain
+
+
+def snapshots_to_replay(backup_dir: Path, until: Optional[str] = None) -> Tuple[Path, List[Path]]:
+    """The full snapshot and deltas that rebuild the index as of `until` (default: latest)"""
+    snapshots = load_chain(backup_dir)["snapshots"]
+    if until:
+        names = [snapshot["file"] for snapshot in snapshots]
+        if until not in names:
+            raise ValueError(f"{until} is not a snapshot in {backup_dir}")
+        snapshots = snapshots[:names.index(until) + 1]
+    base_index = max((i for i, s in enumerate(snapshots) if s["type"] == "base"), default=None)
+    if base_index is None:
+        raise FileNotFoundError(f"No full snapshot found in {backup_dir}")
+    return (backup_dir / snapshots[base_index]["file"],
+            [backup_dir / s["file"] for s in snapshots[base_index + 1:]])
+
+
+def replay(base: Path, deltas: List[Path]) -> Iterator[Dict]:
+    """Records of the base snapshot with the deltas applied, in base order then new records
+
+    Only the deltas' net effect per objectID is held in memory; the base is
+    streamed.
+    """
+    changes: Dict[str, Optional[Dict]] = {}
+    for delta in deltas:
+        for op in docstore.iter_documents(delta):
+            changes[op["objectID"]] = None if op["op"] == "delete" else op["record"]
+
+    for record in docstore.iter_documents(base):
+        object_id = record["objectID"]
+        if object_id in changes:
+            changed = changes.pop(object_id)
+            if changed is not None:
+                yield changed
+        else:
+            yield record
+    # Whatever is left was added after the base
+    for record in changes.values():
+        if record is not None:
+            yield record
+
+
+async def wait_for_task(client: httpx.AsyncClient, index_url: str, task_id: int, timeout: float = 600):
+    """Wait until an Algolia indexing task is published"""
+    deadline = time.monotonic() + timeout
+    while True:
+        response = await client.get(f"{index_url}/task/{task_id}")
+        response.raise_for_status()
+        if response.json().get("status") == "published":
+            return
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Algolia task {task_id} not published after {timeout:.0f}s")
+        await asyncio.sleep(0.5)
+
+
+async def push_records(records: Iterator[Dict], app_id: str, api_key: str, index: str,
+                       batch_size: int = 1000) -> int:
+    """Replace the index contents with the records
+
+    The records go into a temporary index that is then moved onto `index` in
+    one atomic operation, so a failed restore leaves the live index untouched.
+    """
+    headers = {
+        "X-Algolia-Application-Id": app_id,
+        "X-Algolia-API-Key": api_key,
+    }
+    host = os.getenv("ALGOLIA_BASE_URL", f"https://{app_id}.algolia.net").rstrip("/")
+    index_url = f"{host}/1/indexes/{index}"
+    tmp_index = f"{index}_restore_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    tmp_url = f"{host}/1/indexes/{tmp_index}"
+    pushed = 0
+    move_sent = moved = False
+    async with httpx.AsyncClient(headers=headers, timeout=60) as client:
+        try:
+            # The move replaces settings too, so start from the live index's configuration
+            response = await client.get(f"{index_url}/settings")
+            if response.status_code == 200:
+                response = await client.post(f"{index_url}/operation", json={
+                    "operation": "copy", "destination": tmp_index,
+                    "scope": ["settings", "synonyms", "rules"],
+                })
+                response.raise_for_status()
+                await wait_for_task(client, index_url, response.json()["taskID"])
+            elif response.status_code != 404:
+                response.raise_for_status()
+
+            task_id = None
+            batch: List[Dict] = []
+            for record in records:
+                batch.append({"action": "addObject", "body": record})
+                if len(batch) >= batch_size:
+                    response = await client.post(f"{tmp_url}/batch", json={"requests": batch})
+                    response.raise_for_status()
+                    task_id = response.json()["taskID"]
+                    pushed += len(batch)
+                    print(f"Pushed {pushed} records to {tmp_index}")
+                    batch = []
+            if batch:
+                response = await client.post(f"{tmp_url}/batch", json={"requests": batch})
+                response.raise_for_status()
+                task_id = response.json()["taskID"]
+                pushed += len(batch)
+            # Tasks of one index are applied in order, so the last one covers every batch
+            if task_id is not None:
+                await wait_for_task(client, tmp_url, task_id)
+
+            move_sent = True
+            response = await client.post(f"{tmp_url}/operation", json={
+                "operation": "move", "destination": index,
+            })
+            response.raise_for_status()
+            moved = True
+            await wait_for_task(client, tmp_url, response.json()["taskID"])
+        except BaseException as e:
+            # Once Algolia has the move, it completes on its own and the
+            # temporary index must be left for it
+            if moved:
+                print(f"Restore interrupted after the move was accepted; {index} is being "
+                      f"replaced by {tmp_index}, check it once the task has published")
+            elif move_sent and not isinstance(e, httpx.HTTPStatusError):
+                print(f"Restore interrupted while requesting the move; {index} may be replaced "
+                      f"by {tmp_index}, check both and delete {tmp_index} if it remains")
+            else:
+                print(f"Restore failed; {index} was not changed, deleting {tmp_index}")
+                try:
+                    await client.delete(tmp_url)
+                except httpx.HTTPError as delete_error:
+                    print(f"Could not delete {tmp_index}: {delete_error}")
+            raise
+    return pushed
+
+
+async def restore_algolia():
+    parser = argparse.ArgumentParser(description='Rebuild the Algolia index from a snapshot chain')
+    parser.add_argument('backup_dir', help='Directory written by backup_algolia.py')
+    parser.add_argument('--until', help='Restore as of this snapshot file (default: the latest)')
+    parser.add_argument('--output', help='Write the restored records to this .jsonl/.gz/.zst file')
+    parser.add_argument('--push', action='store_true',
+                        help='Replace the contents of the Algolia index with the restored records '
+                             '(built in a temporary index, then moved onto it atomically)')
+    parser.add_argument('--index', default='ma3_docs', help='Algolia index to push to')
+    args = parser.parse_args()
+
+    base, deltas = snapshots_to_replay(Path(args.backup_dir), args.until)
+    print(f"Replaying {base.name} and {len(deltas)} incremental snapshots")
+
+    if args.output:
+        count = docstore.write_store(replay(base, deltas), Path(args.output))
+        print(f"Wrote {count} records to {args.output}")
+
+    if args.push:
+        app_id = os.getenv("ALGOLIA_APP_ID")
+        api_key = os.getenv("ALGOLIA_API_KEY")
+        if not app_id or not api_key:
+            print("Missing Algolia credentials")
+            return
+        count = await push_records(replay(base, deltas), app_id, api_key, args.index)
+        print(f"Restored {count} records to {args.index}")
+
+    if not args.output and not args.push:
+        count = sum(1 for _ in replay(base, deltas))
+        print(f"Snapshot chain holds {count} records; pass --output or --push to restore them")
+
+if __name__ == "__main__":
+    asyncio.run(restore_algolia())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Restore an Upstash Vector backup written by backup_vector.py
+Upserts the backup in parallel batches; finished batches are recorded so an
+interrupted restore can be resumed with --resume
+"""
+
+import os
+import json
+import argparse
+import asyncio
+import time
+from itertools import islice
+from pathlib import Path
+from typing import List, Set
+import httpx
+
+from backup_vector import MANIFEST_FILE, iter_backup, post_with_retry
+
+STATE_FILE = "restore_state.json"
+
+
+class VectorRestore:
+    """Parallel upsert of a backup with per-batch progress tracking
+
+    Batch n is rows [n * batch_size, (n + 1) * batch_size) of the backup.
+    The numbers of upserted batches are saved after each one completes, so a
+    resumed restore skips exactly the batches already written.
+    """
+
+    def __init__(self, url: str, token: str, backup_dir, batch_size: int = 100,
+                 concurrency: int = 4, resume: bool = False):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.backup_dir = Path(backup_dir)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.resume = resume
+        self.state_file = self.backup_dir / STATE_FILE
+        self.done: Set[int] = set()
+        self.failed: List[int] = []
+
+    def _load_state(self):
+        if not self.resume or not self.state_file.exists():
+            return
+        with open(self.state_file, 'r') as f:
+            state = json.load(f)
+        if state["target"] != self.url:
+            raise ValueError(f"Restore state is for {state['target']}, not {self.url}; "
+                             "rerun without --resume to start over")
+        # Batch numbers only mean something with the original batch size
+        self.batch_size = state["batch_size"]
+        self.done = set(state["done"])
+        print(f"Resuming restore: {len(self.done)} batches already upserted")
+
+    def _save_state(self):
+        tmp_path = self.state_file.with_name(STATE_FILE + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({"target": self.url, "batch_size": self.batch_size, "done": sorted(self.done)}, f)
+        tmp_path.replace(self.state_file)
+
+    async def run(self) -> bool:
+        with open(self.backup_dir / MANIFEST_FILE, 'r') as f:
+            manifest = json.load(f)
+        self._load_state()
+        start = time.monotonic()
+        headers = {"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"}
+        limits = httpx.Limits(max_connections=self.concurrency)
+        upserted = 0
+        async with httpx.AsyncClient(headers=headers, limits=limits, timeout=60) as client:
+            info_response = await client.get(f"{self.url}/info")
+            info_response.raise_for_status()
+            dimension = info_response.json()["result"].get("dimension")
+            if dimension and dimension != manifest["dimension"]:
+                raise ValueError(f"Backup has {manifest['dimension']} dimensions "
+                                 f"but the target index has {dimension}")
+            print(f"Restoring {manifest['count']} vectors from {self.backup_dir} to {self.url}")
+
+            batches: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+            async def produce():
+                rows = iter_backup(self.backup_dir)
+                number = 0
+                while batch := list(islice(rows, self.batch_size)):
+                    if number not in self.done:
+                        await batches.put((number, batch))
+                    number += 1
+                for _ in range(self.concurrency):
+                    await batches.put(None)
+
+            async def upsert_worker():
+                nonlocal upserted
+                while (item := await batches.get()) is not None:
+                    number, batch = item
+                    payload = [{"id": record["id"], "vector": vector.tolist(),
+                                **{k: record[k] for k in ("metadata", "data") if k in record}}
+                               for record, vector in batch]
+                    try:
+                        await post_with_retry(client, f"{self.url}/upsert", payload)
+                    except RuntimeError as e:
+                        print(f"Batch {number} failed: {e}")
+                        self.failed.append(number)
+                        continue
+                    self.done.add(number)
+                    self._save_state()
+                    upserted += len(batch)
+                    if upserted // 10_000 != (upserted - len(batch)) // 10_000:
+                        print(f"Restored {upserted} vectors...")
+
+            await asyncio.gather(produce(), *(upsert_worker() for _ in range(self.concurrency)))
+
+        elapsed = time.monotonic() - start
+        print(f"Restored {upserted} vectors in {elapsed:.1f}s "
+              f"({upserted / elapsed if elapsed else 0:.0f} vectors/s)")
+        if self.failed:
+            print(f"{len(self.failed)} batches failed; rerun with --resume to retry them")
+            return False
+        self.state_file.unlink(missing_ok=True)
+        return True
+
+
+async def restore_upstash_vector():
+    parser = argparse.ArgumentParser(description='Restore an Upstash Vector backup')
+    parser.add_argument('backup_dir', help='Directory written by backup_vector.py')
+    parser.add_argument('--batch-size', type=int, default=100, help='Vectors per upsert request')
+    parser.add_argument('--concurrency', type=int, default=4, help='Concurrent upsert requests')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip batches upserted by an interrupted restore')
+    args = parser.parse_args()
+
+    url = os.getenv("UPSTASH_VECTOR_REST_URL")
+    token = os.getenv("UPSTASH_VECTOR_REST_TOKEN")
+
+    if not url or not token:
+        print("Missing Upstash credentials")
+        return
+
+    restore = VectorRestore(url, token, args.backup_dir, batch_size=args.batch_size,
+                            concurrency=args.concurrency, resume=args.resume)
+    if not await restore.run():
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    asyncio.run(restore_upstash_vector())